@@ -0,0 +1,324 @@
+import re
+import threading
+import time
+from collections import deque
+import metrics
+
+#Clock IDs used by ATST<n> commands (see select_time() in sw/serial.c)
+clockNames = {'0': 'Current', '1': 'Closing', '2': 'Cleanup', '3': 'Countdown'}
+
+stRe = re.compile(r'ATST([0-3])(\?|=X$|=)', re.IGNORECASE)
+
+roundTrip = metrics.Histogram('spacetime_command_seconds',
+  'Time from writing a command to SpaceTime to its last reply', ('result',))
+finishResults = {'Timeout': 'timeout', 'Cleared': 'cleared', 'No reply': 'no_reply'}
+queueCoalesced = metrics.Counter('spacetime_commands_coalesced_total',
+  'Queued commands replaced by a newer one before being sent')
+
+class ATCommand:
+  #Handle for a command sent to SpaceTime, returned by SpaceTime.SerialCommand().
+  #SpaceTime handles one command at a time, in the order they were sent, and
+  #replies to each with the echo of the command followed by:
+  # ATSTn?      the time, unlabelled ('HH:MM:SS' or 'Not set')
+  # ATSTn=time  'Current time: ...' or 'Closing time: ...' (clocks 0, 1), then OK
+  # ATSTn=X     'Closing time: Not set' then OK (only clock 1 is clearable)
+  # AT          OK
+  #or an ERROR line. The CommandTracker matches replies to commands using
+  #that order, so several commands can be in flight at once.
+
+  defaultTimeout = 2 #Seconds to wait for the reply before giving up
+  queueTimeout = 10  #Seconds Wait() allows, by default, for the command to be sent
+
+  def __init__(self, text, timeout = None):
+    self.text = text
+    self.timeout = timeout if timeout != None else self.defaultTimeout
+    self.clock = None    #Clock name for ATST<n> commands, ex: 'Closing'
+    self.query = False   #True for ATSTn?, which replies with a time but no OK
+    m = stRe.match(text)
+    if m:
+      self.clock = clockNames[m.group(1)]
+      self.query = m.group(2) == '?'
+    self.sent = None     #time.time() when written to the serial port
+    self.doneAt = None   #time.time() when the last reply arrived
+    self.echoed = False
+    self.done = False
+    self.replies = []    #Every SerialMsg received in reply, except the echo
+    self.value = None    #The time reply (a 'Current' or 'Closing' SerialMsg), if any
+    self.result = None   #The final OK/ERROR SerialMsg, or the value for queries
+    self.error = None    #'Timeout', or the ERROR line from SpaceTime
+    self.event = threading.Event()
+    self.tracker = None
+    self.superseded = [] #Older queued commands this one replaced (see CommandQueue)
+
+  def Key(self):
+    #Queued commands with the same key replace each other: setting or clearing
+    #a clock only matters for the last one, and identical queries get one reply.
+    if self.clock != None and not self.query:
+      return self.text[:6].upper() #ATST<n>=
+    if self.query:
+      return self.text.upper()
+    return None
+
+  def Done(self, error = None):
+    self.done = True
+    self.error = error
+    self.event.set()
+    #Whoever sent a command that this one replaced gets this one's outcome
+    for old in self.superseded:
+      old.sent, old.doneAt = self.sent, self.doneAt
+      old.replies, old.value, old.result = self.replies, self.value, self.result
+      old.Done(error)
+
+  def Expired(self, now):
+    return self.sent != None and now - self.sent >= self.timeout
+
+  def Ok(self):
+    return self.done and self.error == None
+
+  def Latency(self):
+    #Seconds from sending the command to its last reply
+    if not self.done or self.sent == None:
+      return None
+    return self.doneAt - self.sent
+
+  def Wait(self, timeout = None):
+    #Blocks until SpaceTime has replied, or the timeout given here has passed.
+    #Without a timeout, waits up to queueTimeout for the command to be sent
+    #(ex: while the serial port is being reconnected) and then up to its own
+    #timeout. Returns the time reply for time commands, the OK reply for
+    #others, or None on timeout or error. A command still queued when Wait()
+    #gives up is sent later all the same.
+    #If nobody else is reading the serial port, replies are read here, and
+    #stay queued for SpaceTime.Read() as well.
+    #Don't call this from a SerialMsg handler running on the Runtime's loop.
+    end = time.time() + (timeout if timeout != None else self.queueTimeout + self.timeout)
+    while not self.done:
+      remaining = end - time.time()
+      if timeout == None and self.sent != None:
+        remaining = min(remaining, self.sent + self.timeout - time.time())
+      if remaining <= 0:
+        break
+      if self.tracker == None or not self.tracker.Pump(min(remaining, 0.1)):
+        self.event.wait(min(remaining, 0.1))
+      if self.tracker != None:
+        self.tracker.Expire()
+    if not self.Ok():
+      return None
+    return self.value if self.value != None else self.result
+
+class CommandTracker:
+  #Matches the messages SpaceTime sends to the commands in flight (see ATCommand).
+  #Messages that aren't replies to any command (ex: a closing time set on the
+  #keypad) are left alone.
+
+  def __init__(self, pump = None):
+    #pump(timeout) reads and feeds pending serial data, returning False if it
+    #can't (ex: the Runtime's event loop is doing the reading).
+    self.inflight = deque()
+    self.lock = threading.RLock()
+    self.pump = pump
+    self.onFinish = None #Called (with self.lock held) when a command is done
+
+  def Pump(self, timeout):
+    return self.pump != None and self.pump(timeout)
+
+  def Sent(self, cmd):
+    #Registers cmd as written to the serial port. Must be called in the same
+    #order the commands were written.
+    with self.lock:
+      cmd.sent = time.time()
+      cmd.tracker = self
+      self.inflight.append(cmd)
+
+  def Pending(self):
+    with self.lock:
+      return len(self.inflight)
+
+  def InflightBytes(self):
+    return sum(len(c.text) + 2 for c in self.inflight)
+
+  def NextExpiry(self):
+    #time.time() at which the oldest command in flight times out, or None
+    with self.lock:
+      if not self.inflight:
+        return None
+      return min(c.sent + c.timeout for c in self.inflight)
+
+  def Finish(self, cmd, error = None):
+    cmd.doneAt = time.time()
+    self.inflight.remove(cmd)
+    #ERROR and BUSY lines from SpaceTime vary, so they're just 'error'
+    result = 'ok' if error == None else finishResults.get(error, 'error')
+    roundTrip.Labels(result).Observe(cmd.doneAt - cmd.sent)
+    cmd.Done(error)
+    if self.onFinish != None:
+      self.onFinish()
+
+  def Expire(self):
+    #Gives up on commands whose timeout has passed
+    with self.lock:
+      now = time.time()
+      for cmd in [c for c in self.inflight if c.Expired(now)]:
+        self.Finish(cmd, 'Timeout')
+
+  def Clear(self):
+    #Gives up on all commands in flight (ex: the serial buffers were flushed)
+    with self.lock:
+      for cmd in list(self.inflight):
+        self.Finish(cmd, 'Cleared')
+
+  def TakeBack(self):
+    #Takes back the commands in flight without finishing them, to be sent
+    #again (ex: the serial port was lost before they were answered).
+    #Returns them, oldest first.
+    with self.lock:
+      cmds = list(self.inflight)
+      self.inflight.clear()
+      for cmd in cmds:
+        cmd.sent, cmd.echoed, cmd.replies, cmd.value, cmd.result = None, False, [], None, None
+      return cmds
+
+  def Current(self):
+    #The command SpaceTime is replying to: the last one echoed
+    for cmd in self.inflight:
+      if cmd.echoed:
+        return cmd
+    return None
+
+  def Feed(self, msg):
+    #Matches msg to a command in flight. Replies to ATSTn? are relabelled
+    #from AmbiguousTime to the name of the clock that was queried.
+    #Returns msg.
+    with self.lock:
+      self.Expire()
+      if msg.type == 'Echo':
+        self.OnEcho(msg)
+        return msg
+      cmd = self.Current()
+      if cmd == None:
+        return msg
+      if cmd.query:
+        if msg.type == 'AmbiguousTime':
+          msg.type = cmd.clock
+          self.Reply(cmd, msg)
+          cmd.value = cmd.result = msg
+          self.Finish(cmd)
+        elif msg.type == 'Error':
+          self.Reply(cmd, msg)
+          cmd.result = msg
+          self.Finish(cmd, msg.val.rstrip())
+      elif msg.type in ('Current', 'Closing'):
+        #Only a reply if it's for the clock we set; otherwise it's the keypad
+        if msg.type == cmd.clock:
+          self.Reply(cmd, msg)
+          cmd.value = msg
+      elif msg.type in ('OK', 'Error', 'Busy'):
+        self.Reply(cmd, msg)
+        cmd.result = msg
+        self.Finish(cmd, None if msg.type == 'OK' else msg.val.rstrip())
+      elif msg.type == 'Help':
+        self.Reply(cmd, msg)
+      return msg
+
+  def Reply(self, cmd, msg):
+    cmd.replies.append(msg)
+    msg.command = cmd
+
+  def OnEcho(self, msg):
+    #SpaceTime echoes at most 20 characters of a command (BUFFER_SIZE)
+    echo = msg.val.rstrip('\r\n')
+    for cmd in self.inflight:
+      if not cmd.echoed and echo and cmd.text.upper().startswith(echo.upper()):
+        #SpaceTime has moved on, so anything before this is as done as it'll get
+        for old in list(self.inflight):
+          if old is cmd:
+            break
+          if old.result != None or old.replies:
+            #Ex: AT? prints help but no OK
+            old.result = old.result or old.replies[-1]
+            self.Finish(old)
+          else:
+            self.Finish(old, 'No reply')
+        cmd.echoed = True
+        return
+
+class CommandQueue:
+  #The single writer of commands to SpaceTime. Every caller (the main loop,
+  #timers, the REST thread) goes through Submit(), so commands are never
+  #interleaved on the wire.
+  #SpaceTime reads commands into a 20 byte buffer (BUFFER_SIZE in sw/serial.c)
+  #and its UART only buffers 8 bytes while it's busy printing, so commands
+  #are only written while the ones in flight add up to less than window
+  #bytes. The rest wait here, where a newer command for the same clock
+  #replaces an older one (last writer wins) instead of flooding the board.
+  #While SpaceTime can't be written to (see Pause()), commands wait here.
+
+  def __init__(self, write, tracker, window = 20):
+    #write(cmd) writes an ATCommand to the serial port
+    self.write = write
+    self.tracker = tracker
+    self.window = window
+    self.queue = deque()
+    self.lock = tracker.lock
+    self.onSubmit = None #Called after a command is queued (ex: to wake the Runtime)
+    self.coalesced = 0   #Commands replaced by newer ones before being sent
+    self.paused = False  #Commands are queued but not written
+    tracker.onFinish = self.Flush
+
+  def Submit(self, cmd):
+    with self.lock:
+      key = cmd.Key()
+      if key != None:
+        for old in [c for c in self.queue if c.Key() == key]:
+          self.queue.remove(old)
+          cmd.superseded.append(old)
+          self.coalesced += 1
+          queueCoalesced.Inc()
+      #So Wait() reads replies (and gives up on commands ahead of this one) while it's queued
+      cmd.tracker = self.tracker
+      self.queue.append(cmd)
+      self.Flush()
+    if self.onSubmit != None:
+      self.onSubmit()
+    return cmd
+
+  def Pending(self):
+    #Commands waiting to be written
+    with self.lock:
+      return len(self.queue)
+
+  def Pause(self):
+    #Stops writing (ex: the serial port was lost). The commands in flight
+    #go back to the front of the queue, in order, to be sent again by
+    #Resume(), unless a newer one for the same clock replaces them: every
+    #SpaceTime command can safely be repeated.
+    with self.lock:
+      self.paused = True
+      for cmd in reversed(self.tracker.TakeBack()):
+        key = cmd.Key()
+        newer = [c for c in self.queue if key != None and c.Key() == key]
+        if newer:
+          newer[0].superseded.append(cmd)
+          self.coalesced += 1
+          queueCoalesced.Inc()
+        else:
+          self.queue.appendleft(cmd)
+
+  def Resume(self):
+    #Writes what was queued while paused
+    with self.lock:
+      self.paused = False
+      self.Flush()
+
+  def Flush(self):
+    #Writes queued commands while there's room in SpaceTime's buffer.
+    #At least one command is always allowed in flight.
+    with self.lock:
+      while self.queue and not self.paused:
+        cmd = self.queue[0]
+        if self.tracker.inflight and self.tracker.InflightBytes() + len(cmd.text) + 2 > self.window:
+          return
+        self.queue.popleft()
+        #Registered first, so the reply can't arrive before we expect it
+        self.tracker.Sent(cmd)
+        self.write(cmd)
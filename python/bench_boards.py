@@ -0,0 +1,129 @@
+import argparse
+import contextlib
+import io
+import sys
+import threading
+import time
+import main
+from boards import BoardManager
+from emulator import SpaceTimeEmulator
+from runtime import Runtime
+from scheduler import Scheduler
+from spacetime import SpaceTime
+from statestore import StateStore
+from bench_latency import Percentile, WaitFor
+
+#Latency of a closing time set on one board's keypad, with 1 to 16 emulated
+#boards (emulator.py) read by the one Runtime loop (see boards.py). Each
+#keypad entry is timed from the board sending it:
+#  dispatch   -> its 'Closing time:' handed to ProcessSerialMsg
+#  web        -> the web API update (a stand-in that returns right away)
+#  propagate  -> every other board has replied that it's set
+#Dispatch and web latency should stay flat as boards are added; propagation
+#grows a little, since every other board has to be sent the new time.
+#To run from command line:
+#python bench_boards.py [-n 100] [--boards 1,2,4,8,16]
+#Exits with an error if dispatch p95 with the most boards is slower than with
+#the fewest by more than the tolerance.
+
+stages = ['dispatch', 'web', 'propagate']
+
+class FakeWebApi:
+  def __init__(self):
+    self.updates = []
+
+  def Update(self, *args):
+    self.updates.append(time.time())
+    return True
+
+class Harness:
+  def __init__(self, n, baud):
+    main.manager = BoardManager()
+    main.state = StateStore()
+    main.scheduler = Scheduler()
+    main.dispatcher = None
+    self.web = FakeWebApi()
+    self.emus = []
+    self.reports = [] #(time handled, board index, closing time)
+    self.rt = Runtime(None, None, main.scheduler)
+    for i in range(n):
+      emu = SpaceTimeEmulator(baud = baud, boot = False).Start()
+      st = SpaceTime(emu.device)
+      self.emus.append(emu)
+      main.manager.Add(st, 'board' + str(i))
+      self.rt.Add(st, lambda msg, i = i, st = st: self.OnMsg(msg, i, st))
+    self.thread = threading.Thread(target = self.rt.Run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def OnMsg(self, msg, i, st):
+    if msg.type == 'Closing':
+      self.reports.append((time.time(), i, msg.val))
+    main.ProcessSerialMsg(msg, self.web, st)
+
+  def Measure(self, i, timestr):
+    #Sets timestr on board i's keypad
+    n = len(self.emus)
+    updates = len(self.web.updates)
+    reports = len(self.reports)
+    start = time.time()
+    self.emus[i].Keypad('1', timestr)
+    val = timestr + ':00'
+    WaitFor(lambda: len(set(r[1] for r in self.reports[reports:] if r[2] == val)) == n
+      and len(self.web.updates) > updates, 10)
+    mine = [r[0] for r in self.reports[reports:] if r[1] == i]
+    return {
+      'dispatch': mine[0] - start,
+      'web': self.web.updates[updates] - start,
+      'propagate': max(r[0] for r in self.reports[reports:]) - start }
+
+  def Stop(self):
+    self.rt.Stop()
+    self.thread.join()
+    for board, emu in zip(main.manager.boards, self.emus):
+      board.st.serial.close()
+      emu.Stop()
+
+def Run(n, count, baud):
+  results = dict((s, []) for s in stages)
+  h = Harness(n, baud)
+  try:
+    for k in range(count):
+      timestr = '%02d:%02d' % (10 + k // 60 % 12, k % 60)
+      for s, v in h.Measure(k % n, timestr).items():
+        results[s].append(v * 1000)
+  finally:
+    h.Stop()
+  return dict((s, dict((p, Percentile(v, int(p[1:]))) for p in ('p50', 'p95')))
+    for s, v in results.items())
+
+def Main(argv):
+  p = argparse.ArgumentParser(description = 'Keypad to web API latency with several emulated boards')
+  p.add_argument('-n', type = int, default = 100, help = 'keypad entries per board count')
+  p.add_argument('--boards', default = '1,2,4,8,16', help = 'board counts to try')
+  p.add_argument('--baud', type = int, default = 57600, help = 'emulated serial baud rate')
+  p.add_argument('--tolerance', type = float, default = 0.5, help = 'allowed dispatch p95 growth, ex: 0.5 = 50%%')
+  p.add_argument('--slack', type = float, default = 1.0, help = 'allowed dispatch p95 growth in ms, on top of tolerance')
+  args = p.parse_args(argv)
+  counts = [int(c) for c in args.boards.split(',')]
+  saved = main.manager, main.state, main.scheduler, main.dispatcher
+  main.log.out = io.StringIO() #Keep main's log out of the results
+  summaries = {}
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      for n in counts:
+        summaries[n] = Run(n, args.n, args.baud)
+  finally:
+    main.manager, main.state, main.scheduler, main.dispatcher = saved
+  print('%-7s' % 'boards' + ''.join('%14s %6s' % (s + ' p50', 'p95') for s in stages) + '   (ms)')
+  for n in counts:
+    print('%-7d' % n + ''.join('%14.2f %6.2f' % (summaries[n][s]['p50'], summaries[n][s]['p95']) for s in stages))
+  fewest, most = summaries[counts[0]]['dispatch']['p95'], summaries[counts[-1]]['dispatch']['p95']
+  if most > fewest * (1 + args.tolerance) + args.slack:
+    print('Dispatch latency grows with the number of boards')
+    return 1
+  print('Dispatch latency is flat')
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
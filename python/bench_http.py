@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+import time
+import requests
+from stubserver import StubServer, MakeCert
+from webapi import WebApi
+
+#Compares pooled (keep-alive) and unpooled WebApi round-trips against a
+#local HTTPS stand-in for isvhsopen.com.
+#To run from command line:
+#python bench_http.py [number of requests]
+
+def Measure(name, query, n):
+  #Returns per-request wall time and CPU time, in ms
+  query() #Warm up
+  wall = time.perf_counter()
+  cpu = time.process_time()
+  for i in range(n):
+    if query() == False:
+      raise Exception(name + ' request failed')
+  wall = (time.perf_counter() - wall) * 1000 / n
+  cpu = (time.process_time() - cpu) * 1000 / n
+  print('%-10s %8.2f ms/request %8.2f ms CPU/request' % (name, wall, cpu))
+  return wall, cpu
+
+def main(n = 200):
+  with tempfile.TemporaryDirectory() as d:
+    certfile, keyfile = MakeCert(d)
+    os.environ['REQUESTS_CA_BUNDLE'] = certfile
+    srv = StubServer(certfile = certfile, keyfile = keyfile).Start()
+    try:
+      web = WebApi(dataURL = srv.webURL)
+      def Unpooled():
+        #What WebApi.Query did before: a new connection for every request
+        r = requests.get(srv.webURL, timeout = 5)
+        return r.json() if r.status_code == requests.codes.ok else False
+      print(str(n) + ' GET round-trips to ' + srv.webURL)
+      c = srv.connections
+      uwall, ucpu = Measure('unpooled', Unpooled, n)
+      uconn = srv.connections - c
+      c = srv.connections
+      pwall, pcpu = Measure('pooled', web.Query, n)
+      pconn = srv.connections - c
+      print('connections: unpooled %d, pooled %d' % (uconn, pconn))
+      print('speedup: %.1fx latency, %.1fx CPU' % (uwall / pwall, ucpu / pcpu))
+    finally:
+      srv.Stop()
+
+if __name__ == '__main__':
+  main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,190 @@
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import socket
+import sys
+import threading
+import time
+import main
+import restserv
+from emulator import SpaceTimeEmulator
+from sinks import Dispatcher, WebApiSink
+from runtime import Runtime
+from spacetime import SpaceTime
+from stubserver import StubServer
+from webapi import WebApi
+
+#End-to-end latency of a closing time change, from a REST request to the
+#isvhsopen.com POST, using the emulated board (emulator.py) and a local
+#stand-in for the web APIs (stubserver.py). Each request is split into stages:
+#  rest    REST request received -> ATST1 command written to the serial port
+#  serial  command written -> 'Closing time:' reply read from the serial port
+#  parse   reply read -> parsed, matched and handed to ProcessSerialMsg
+#  web     ProcessSerialMsg -> POST answered by the stand-in isvhsopen.com
+#  total   REST request sent -> POST answered
+#To run from command line:
+#python bench_latency.py [-n 200] [--save-baseline latency.json] [--baseline latency.json]
+#With --baseline, exits with an error if any stage's p95 got slower than the
+#stored baseline by more than the tolerance.
+
+stages = ['rest', 'serial', 'parse', 'web', 'total']
+
+def Percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def FreePort():
+  s = socket.socket()
+  s.bind(('127.0.0.1', 0))
+  port = s.getsockname()[1]
+  s.close()
+  return port
+
+def WaitFor(cond, timeout):
+  end = time.time() + timeout
+  while not cond():
+    if time.time() > end:
+      raise Exception('Timed out')
+    time.sleep(0.0005)
+
+class Harness:
+  def __init__(self, args):
+    self.emu = SpaceTimeEmulator(baud = args.baud, latency = args.board_latency, boot = False).Start()
+    self.stub = StubServer(delay = args.web_delay, failureRate = args.failure_rate, seed = 1)
+    if args.recording:
+      self.stub.LoadRecording(args.recording)
+    self.stub.Start()
+    self.st = SpaceTime(self.emu.device)
+    self.web = WebApi(dataURL = self.stub.webURL)
+    main.dispatcher = Dispatcher([WebApiSink(self.web)], backoffMin = 0.01, backoffMax = 0.1)
+    main.dispatcher.Start()
+    self.port = FreePort()
+    restserv.RestServ(self.st, self.port, '127.0.0.1')
+    self.Instrument()
+    self.rt = Runtime(self.st, self.OnMsg)
+    self.thread = threading.Thread(target = self.rt.Run)
+    self.thread.daemon = True
+    self.thread.start()
+    WaitFor(self.RestUp, 5)
+
+  def Instrument(self):
+    #Timestamps commands as they're written, and messages as they're read
+    self.commands = []
+    self.closing = []
+    send = self.st.SerialCommand
+    def SerialCommand(cmd, timeout = None):
+      c = send(cmd, timeout)
+      self.commands.append(c)
+      return c
+    self.st.SerialCommand = SerialCommand
+    feed = self.st.parser.Feed
+    def Feed(data):
+      read = time.time()
+      msgs = feed(data)
+      for m in msgs:
+        m.read = read
+      return msgs
+    self.st.parser.Feed = Feed
+
+  def OnMsg(self, msg):
+    if msg.type == 'Closing':
+      msg.dispatched = time.time()
+      self.closing.append(msg)
+    main.ProcessSerialMsg(msg, self.web, self.st)
+
+  def RestUp(self):
+    try:
+      socket.create_connection(('127.0.0.1', self.port), 0.1).close()
+      return True
+    except OSError:
+      return False
+
+  def Posts(self):
+    return [t for t, method, path, code in self.stub.log if method == 'POST' and code == 200]
+
+  def Measure(self, path):
+    posts = len(self.Posts())
+    ncmd = len(self.commands)
+    nclosing = len(self.closing)
+    start = time.time()
+    c = http.client.HTTPConnection('127.0.0.1', self.port, timeout = 10)
+    c.request('GET', path)
+    reply = c.getresponse().read()
+    c.close()
+    if b'did not confirm' in reply:
+      raise Exception('SpaceTime did not confirm ' + path)
+    WaitFor(lambda: len(self.Posts()) > posts, 30)
+    cmd = self.commands[ncmd]
+    msg = self.closing[nclosing]
+    posted = self.Posts()[posts]
+    return {
+      'rest': cmd.sent - start,
+      'serial': msg.read - cmd.sent,
+      'parse': msg.dispatched - msg.read,
+      'web': posted - msg.dispatched,
+      'total': posted - start }
+
+  def Stop(self):
+    self.rt.Stop()
+    self.thread.join()
+    main.dispatcher.Stop()
+    self.st.serial.close()
+    self.emu.Stop()
+    self.stub.Stop()
+
+def Run(args):
+  results = dict((s, []) for s in stages)
+  h = Harness(args)
+  try:
+    for i in range(args.n):
+      path = '/set/closed' if i % 2 else '/set/open/%02d:%02d' % (10 + i // 60 % 12, i % 60)
+      for s, v in h.Measure(path).items():
+        results[s].append(v * 1000)
+  finally:
+    h.Stop()
+  return dict((s, dict((p, Percentile(v, int(p[1:]))) for p in ('p50', 'p95', 'p99')))
+    for s, v in results.items())
+
+def Compare(summary, baseline, tolerance, slack):
+  #Returns the stages whose p95 got slower than the baseline
+  slower = []
+  for s in stages:
+    if s in baseline and summary[s]['p95'] > baseline[s]['p95'] * (1 + tolerance) + slack:
+      slower.append(s)
+  return slower
+
+def Main(argv):
+  p = argparse.ArgumentParser(description = 'End-to-end latency from REST request to isvhsopen POST')
+  p.add_argument('-n', type = int, default = 200, help = 'number of requests')
+  p.add_argument('--baud', type = int, default = 57600, help = 'emulated serial baud rate')
+  p.add_argument('--board-latency', type = float, default = 0, help = 'emulated board reply delay (s)')
+  p.add_argument('--web-delay', type = float, default = 0, help = 'stand-in web API delay (s)')
+  p.add_argument('--failure-rate', type = float, default = 0, help = 'stand-in web API failure rate')
+  p.add_argument('--recording', help = 'recorded web API responses (ex: testdata/recorded_responses.json)')
+  p.add_argument('--save-baseline', help = 'store the results in this file')
+  p.add_argument('--baseline', help = 'fail if slower than the results in this file')
+  p.add_argument('--tolerance', type = float, default = 0.5, help = 'allowed p95 slowdown, ex: 0.5 = 50%%')
+  p.add_argument('--slack', type = float, default = 1.0, help = 'allowed p95 slowdown in ms, on top of tolerance')
+  args = p.parse_args(argv)
+  main.log.out = io.StringIO() #Keep main's log out of the results
+  with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+    summary = Run(args)
+  print('%-8s %9s %9s %9s' % ('stage', 'p50 ms', 'p95 ms', 'p99 ms'))
+  for s in stages:
+    print('%-8s %9.2f %9.2f %9.2f' % (s, summary[s]['p50'], summary[s]['p95'], summary[s]['p99']))
+  if args.save_baseline:
+    with open(args.save_baseline, 'w') as f:
+      json.dump(summary, f, indent = 2)
+  if args.baseline:
+    with open(args.baseline) as f:
+      slower = Compare(summary, json.load(f), args.tolerance, args.slack)
+    if slower:
+      print('Slower than baseline: ' + ', '.join(slower))
+      return 1
+    print('Within baseline')
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,106 @@
+import io
+import os
+import select
+import sys
+import threading
+import time
+from timeutil import IsTimeStr
+from serialparser import SerialMsg, SerialParser, CRLF
+from spacetime import SpaceTime
+
+#Compares SerialParser with the readline()-based SpaceTime.Read() it replaced,
+#in messages per second.
+#To run from command line:
+#python bench_serialparser.py [number of messages]
+
+#A typical mix of what SpaceTime sends: command echoes, replies and results
+sample = (b'ATST0?\r\n14:56:05\r\n'
+  b'ATST0=14:56:05\r\nCurrent time: 14:56:05\r\nOK\r\n'
+  b'ATST1=X\r\nClosing time: Not set\r\nOK\r\n'
+  b'Closing time: 23:30:00\r\nAT\r\nOK\r\n')
+sampleMsgs = 11
+
+def LegacyParse(data):
+  #SpaceTime.Read() before SerialParser, minus the readline()
+  if data.startswith('OK'):
+    return SerialMsg('OK', data)
+  elif data.startswith('AT'):
+    return SerialMsg('Echo', data)
+  elif data.startswith('Closing time: ') or data.startswith('Current time: '):
+    msgtype = data[:7]
+    timeval = None
+    if not data.endswith('Not set' + CRLF):
+      timeval = data[14:-2]
+    return SerialMsg(msgtype, timeval)
+  elif data == 'SpaceTime, yay!' + CRLF:
+    return SerialMsg('Boot', data)
+  elif data.startswith('Not set'):
+    return SerialMsg('AmbiguousTime', None)
+  else:
+    if IsTimeStr(data[0:-2]):
+      return SerialMsg('AmbiguousTime', data[0:-2])
+    return SerialMsg('Unknown', data)
+
+def Report(name, n, seconds):
+  print('%-36s %10.0f msgs/s' % (name, n / seconds))
+  return n / seconds
+
+def InMemory(n):
+  #Parsing cost alone, with the serial port taken out of the picture
+  reps = n // sampleMsgs
+  data = sample * reps
+  n = reps * sampleMsgs
+  f = io.BytesIO(data)
+  start = time.perf_counter()
+  count = 0
+  line = f.readline()
+  while line:
+    LegacyParse(line.decode('ascii'))
+    count += 1
+    line = f.readline()
+  legacy = Report('readline + startswith chain', count, time.perf_counter() - start)
+  p = SerialParser()
+  start = time.perf_counter()
+  count = 0
+  for i in range(0, len(data), 4096): #As read from inWaiting() in one go
+    count += len(p.Feed(data[i:i+4096]))
+  parser = Report('SerialParser.Feed', count, time.perf_counter() - start)
+  print('%-36s %10.1fx' % ('speedup', parser / legacy))
+
+def OverPty(n):
+  #End to end through pyserial on a pseudo-terminal
+  reps = n // sampleMsgs
+  n = reps * sampleMsgs
+  results = []
+  for name in ('serial.readline()', 'SpaceTime.ReadAvailable()'):
+    master, slave = os.openpty()
+    st = SpaceTime(os.ttyname(slave))
+    def Write():
+      for i in range(reps):
+        os.write(master, sample)
+    writer = threading.Thread(target = Write)
+    writer.daemon = True
+    start = time.perf_counter()
+    writer.start()
+    count = 0
+    if name == 'serial.readline()':
+      while count < n:
+        LegacyParse(st.serial.readline().decode('ascii'))
+        count += 1
+    else:
+      while count < n:
+        select.select([st.fileno()], [], [], 1)
+        count += len(st.ReadAvailable())
+    results.append(Report(name + ' over pty', count, time.perf_counter() - start))
+    writer.join()
+    st.serial.close()
+    os.close(slave)
+    os.close(master)
+  print('%-36s %10.1fx' % ('speedup', results[1] / results[0]))
+
+def main(n = 100000):
+  InMemory(n)
+  OverPty(n)
+
+if __name__ == '__main__':
+  main(*[int(a) for a in sys.argv[1:]])
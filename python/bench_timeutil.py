@@ -0,0 +1,59 @@
+import sys
+import time
+from timeutil import StrToTime, TimeToStr, TimeOffsetSeconds, ClockTime
+
+#Compares ClockTime with the struct_time functions it replaced, in
+#operations per second, for what main.py does with each time SpaceTime
+#reports: parse it, compare it with the system clock, and format a time.
+#To run from command line:
+#python bench_timeutil.py [number of operations]
+
+samples = ['14:56:05', '21:30:00', '00:00:00', '23:59:59', '08:00:20', '04:10:00']
+
+def Report(name, n, seconds):
+  print('%-36s %10.0f ops/s' % (name, n / seconds))
+  return n / seconds
+
+def Speedup(new, old):
+  print('%-36s %10.1fx' % ('speedup', new / old))
+
+def Run(name, func, n):
+  start = time.perf_counter()
+  func(n)
+  return Report(name, n, time.perf_counter() - start)
+
+def main(n = 200000):
+  reps = n // len(samples)
+  n = reps * len(samples)
+  work = samples * reps
+
+  def ParseOld(n):
+    for s in work:
+      StrToTime(s)
+  def ParseNew(n):
+    for s in work:
+      ClockTime.Parse(s)
+  Speedup(Run('ClockTime.Parse', ParseNew, n), Run('time.strptime (StrToTime)', ParseOld, n))
+
+  structs = [StrToTime(s) for s in samples] * reps
+  clocks = [ClockTime.Parse(s) for s in samples] * reps
+  def FormatOld(n):
+    for t in structs:
+      TimeToStr(t)
+  def FormatNew(n):
+    for t in clocks:
+      str(t)
+  Speedup(Run('str(ClockTime)', FormatNew, n), Run('time.strftime (TimeToStr)', FormatOld, n))
+
+  def SyncOld(n):
+    now = time.localtime(time.time())
+    for s in work:
+      TimeOffsetSeconds(now, StrToTime(s))
+  def SyncNew(n):
+    now = ClockTime.FromEpoch(time.time())
+    for s in work:
+      now.Offset(ClockTime.Parse(s))
+  Speedup(Run('Parse + ClockTime.Offset', SyncNew, n), Run('strptime + TimeOffsetSeconds', SyncOld, n))
+
+if __name__ == '__main__':
+  main(*[int(a) for a in sys.argv[1:]])
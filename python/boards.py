@@ -0,0 +1,134 @@
+import os
+import time
+from spacetime import SpaceTime
+from timeutil import ClockTime
+from drift import DriftModel
+
+#Several SpaceTime boards driven by one process (ex: the front door's and
+#the back door's), all showing the same closing time.
+#Each board keeps its own clock and drift model, but the closing time is the
+#space's: setting it on any board's keypad passes it on to the others (see
+#BoardManager.Propagate()), and setting it over the REST API sets it on all
+#of them at once. All boards are read by the one Runtime loop (see
+#runtime.py), so there's no thread per board.
+#Boards are configured as a list of devices, ex: from the SPACETIME_DEVICES
+#environment variable (see main.py):
+#  front=/dev/ttyAMA0,back=/dev/ttyUSB0
+
+def ParseDevices(text):
+  #Returns [(name or None, device path)] for a comma-separated list of
+  #devices, each optionally named with 'name='
+  devices = []
+  for item in text.split(','):
+    item = item.strip()
+    if not item:
+      continue
+    name, sep, path = item.rpartition('=')
+    devices.append((name.strip() or None, path.strip()))
+  return devices
+
+class Board:
+  #One SpaceTime board, and what this process believes about it
+  def __init__(self, st, name = None, maxDrift = 0.5):
+    self.st = st
+    self.name = name if name != None else os.path.basename(st.serial.name)
+    self.drift = DriftModel(maxDrift) #Decides when to check and set its clock
+    self.closing_time = None  #What it last reported or was told ('HH:MM:SS' or None)
+    self.current_time = None  #Its clock when it last reported it
+    self.last_sync = None     #time.time() when it last reported its clock
+    self.heard = False        #Whether it has reported its closing time yet
+
+  def Job(self, name):
+    #Name of this board's scheduler job, ex: 'clock sync back'
+    return name + ' ' + self.name
+
+  def Status(self, now):
+    #For /status
+    return {
+      'device': self.st.serial.name,
+      'closing_time': self.closing_time,
+      'current_time': self.current_time,
+      'last_sync': self.last_sync,
+      'connected': self.st.connected,
+      'clock': self.drift.Status(now) }
+
+class CommandGroup:
+  #The same command sent to several boards, waited on as one (ex: by restserv)
+  def __init__(self, names, commands):
+    self.names = names       #Board names, in the same order as commands
+    self.commands = commands
+    self.error = None
+
+  def Wait(self, timeout = None):
+    #Returns the first board's reply if every board replied, otherwise None
+    #(see ATCommand.Wait()), with the first failure in self.error. A timeout
+    #is for all of them together.
+    end = None if timeout == None else time.time() + timeout
+    results = [c.Wait(None if end == None else max(0, end - time.time())) for c in self.commands]
+    for name, c, result in zip(self.names, self.commands, results):
+      if result == None:
+        self.error = name + ': ' + str(c.error)
+        return None
+    return results[0] if results else None
+
+class BoardManager:
+  def __init__(self, maxDrift = 0.5):
+    self.maxDrift = maxDrift
+    self.boards = []      #In the order added; the first is the primary
+    self.bySpaceTime = {} #id(SpaceTime) -> Board
+    self.closing_time = None #The space's closing time, last sent to the web API
+
+  def Add(self, st, name = None):
+    board = Board(st, name, self.maxDrift)
+    if any(b.name == board.name for b in self.boards):
+      board.name += '-' + str(len(self.boards))
+    self.boards.append(board)
+    self.bySpaceTime[id(st)] = board
+    return board
+
+  def Open(self, devices):
+    #Opens a SpaceTime for each (name, device path) in devices (see
+    #ParseDevices()). Returns the new Boards.
+    return [self.Add(SpaceTime(path), name) for name, path in devices]
+
+  def Get(self, st):
+    #The Board for SpaceTime st, added if it's new to us
+    board = self.bySpaceTime.get(id(st))
+    return board if board != None else self.Add(st)
+
+  def Primary(self):
+    return self.boards[0] if self.boards else None
+
+  def Others(self, board):
+    return [b for b in self.boards if b is not board]
+
+  def Propagate(self, board, closing_time):
+    #Sets closing_time on every board but board that doesn't already have
+    #it. Returns the commands sent. The boards are taken to have it right
+    #away, so their replies don't get passed on again.
+    commands = []
+    for other in self.Others(board):
+      if other.closing_time != closing_time:
+        commands.append(self.SetClosing(other, closing_time))
+    return commands
+
+  def SetClosing(self, board, closing_time):
+    board.closing_time = closing_time
+    if closing_time == None:
+      return board.st.ClearTime(1)
+    return board.st.SetTime(1, ClockTime.Parse(closing_time))
+
+  #Same as SpaceTime's, for every board at once, so a BoardManager can be
+  #given to RestServ() in place of a SpaceTime
+
+  def SetTime(self, clockID, clocktime, timeout = None):
+    return self.Send(lambda st: st.SetTime(clockID, clocktime, timeout))
+
+  def ClearTime(self, clockID, timeout = None):
+    return self.Send(lambda st: st.ClearTime(clockID, timeout))
+
+  def Send(self, command):
+    return CommandGroup([b.name for b in self.boards], [command(b.st) for b in self.boards])
+
+  def Status(self, now):
+    return dict((b.name, b.Status(now)) for b in self.boards)
@@ -0,0 +1,125 @@
+import threading
+import time
+import metrics
+from logbuffer import log
+
+#Circuit breaker for a web API (see HttpClient), so that while a server is
+#down, calls to it fail right away instead of each waiting out the timeout.
+#  closed     calls go through; failureThreshold failures in a row open it
+#  open       calls fail with CircuitOpen without touching the network, until
+#             resetTimeout seconds have passed
+#  half_open  up to probes calls go through to test the server; the first
+#             to succeed closes it, one that fails opens it again
+#Whoever gets CircuitOpen can retry at its retryAt (see sinks.Dispatcher).
+
+states = ('closed', 'half_open', 'open')
+
+circuitState = metrics.Gauge('webapi_circuit_state',
+  'Circuit breaker state of each web API: 0 closed, 1 half open, 2 open', ('api',))
+transitions = metrics.Counter('webapi_circuit_transitions_total',
+  'Circuit breaker state changes, by web API and new state', ('api', 'state'))
+rejected = metrics.Counter('webapi_circuit_rejected_total',
+  'Web API calls failed by an open circuit breaker without being made', ('api',))
+
+class CircuitOpen(Exception):
+  #Raised instead of making a call while the circuit is open
+  def __init__(self, name, retryAt):
+    Exception.__init__(self, 'Circuit open for ' + name + ', retry in ' + str(round(max(0, retryAt - time.time()), 1)) + 's')
+    self.name = name
+    self.retryAt = retryAt
+
+class CircuitBreaker:
+  def __init__(self, name, failureThreshold = 3, resetTimeout = 30, probes = 1):
+    self.name = name
+    self.failureThreshold = failureThreshold
+    self.resetTimeout = resetTimeout
+    self.probes = probes
+    self.lock = threading.Lock()
+    self.state = 'closed'
+    self.failures = 0     #Failures in a row while closed
+    self.openedAt = 0
+    self.probing = 0      #Probe calls in flight while half open
+    self.onChange = None  #Called with (name, old state, new state), without self.lock held
+    self.changes = []     #(old state, new state) not yet logged and reported
+    self.gauge = circuitState.Labels(name)
+    self.rejected = rejected.Labels(name)
+
+  def Allow(self):
+    #Call before each call. Raises CircuitOpen if it mustn't be made, or
+    #returns whether it's a probe, to be passed to Success() or Failure().
+    try:
+      with self.lock:
+        if self.state == 'open':
+          if time.time() < self.openedAt + self.resetTimeout:
+            self.rejected.Inc()
+            raise CircuitOpen(self.name, self.openedAt + self.resetTimeout)
+          self.Change('half_open')
+        if self.state == 'half_open':
+          if self.probing >= self.probes:
+            self.rejected.Inc()
+            raise CircuitOpen(self.name, time.time() + 1)
+          self.probing += 1
+          return True
+        return False
+    finally:
+      self.Notify()
+
+  def Success(self, probe = False):
+    with self.lock:
+      if probe:
+        self.probing -= 1
+      self.failures = 0
+      if self.state == 'half_open' and probe:
+        self.Change('closed')
+    self.Notify()
+
+  def Failure(self, probe = False):
+    with self.lock:
+      if probe:
+        self.probing -= 1
+        if self.state == 'half_open':
+          self.Open()
+      elif self.state == 'closed':
+        self.failures += 1
+        if self.failures >= self.failureThreshold:
+          self.Open()
+    self.Notify()
+
+  def Open(self):
+    #Called with self.lock held
+    self.openedAt = time.time()
+    self.failures = 0
+    self.Change('open')
+
+  def Change(self, state):
+    #Called with self.lock held. The change is logged and reported by
+    #Notify(), once the lock is released.
+    old, self.state = self.state, state
+    self.gauge.Set(states.index(state))
+    transitions.Labels(self.name, state).Inc()
+    self.changes.append((old, state))
+
+  def Notify(self):
+    #Logs the changes made since the last call, and calls onChange with each,
+    #without self.lock held, so onChange can call State() or RetryAt()
+    with self.lock:
+      changes, self.changes = self.changes, []
+    for old, state in changes:
+      log.Warning('Circuit breaker ' + state, api = self.name, was = old)
+      if self.onChange != None:
+        self.onChange(self.name, old, state)
+
+  def State(self):
+    #The state calls would find now: an open circuit whose resetTimeout is
+    #over counts as half open
+    with self.lock:
+      if self.state == 'open' and time.time() >= self.openedAt + self.resetTimeout:
+        return 'half_open'
+      return self.state
+
+  def RetryAt(self):
+    #time.time() when a call may next go through, or None if it may now
+    with self.lock:
+      if self.state == 'open' and time.time() < self.openedAt + self.resetTimeout:
+        return self.openedAt + self.resetTimeout
+      return None
@@ -0,0 +1,153 @@
+import math
+from collections import deque
+from timeutil import ClockTime
+
+class DriftModel:
+  #Learns how fast SpaceTime's clock drifts from the system clock, to sync
+  #it just before it's off by more than threshold seconds, rather than on a
+  #fixed schedule.
+  #Each reading of SpaceTime's clock (a reply to ATST0?) gives its offset
+  #from the system clock at that moment. The offsets since the clock was
+  #last set are fitted with a line: the slope is the drift rate, and the
+  #line predicts when the offset will reach threshold. The rate is kept
+  #when the clock is set again, and used until there are enough new readings.
+  #SpaceTime only replies with whole seconds, truncated, so each reading is
+  #off by up to a second; a fit over several hours still gives an accurate
+  #rate. Sets are sent right on a second boundary (see main.py), so right
+  #after one the offset is known to be about 0.
+  #Note SpaceTime's own drift correction (ATST0=hh:mm:ss.cc) isn't used: it
+  #isn't finished in sw/timer.c, and ignores the time of every .cc set but
+  #the first.
+
+  maxSamples = 64       #Readings kept for the fit
+  minSpan = 1800        #Seconds of readings needed before the rate is trusted
+  firstCheck = 900      #Seconds after a set until the first reading
+  maxInterval = 86400   #Never go longer than this without a reading
+  minInterval = 60      #Never ask more often than this
+  margin = 0.8          #Check when this fraction of the threshold is reached
+  noise = 0.29          #Standard deviation of a reading: truncation, uniform over a second
+  golden = 0.6180339887 #Step between the fractions of a second readings are taken at
+
+  def __init__(self, threshold = 0.5):
+    self.threshold = threshold
+    self.samples = deque(maxlen = self.maxSamples) #(system time, offset)
+    self.setAt = None     #System time the clock was last set
+    self.probe = self.firstCheck
+    self.rate = None      #Drift, seconds per second
+    self.error = None     #Standard error of the rate
+    self.prior = None     #(rate, error) fitted before the last set
+    self.intercept = 0
+    self.lastResidual = None #Last reading minus what the fit predicted
+    self.rms = None          #RMS of the fit's residuals
+    self.phase = 0           #Fraction of a second for the next reading
+
+  def Offset(self, sysTime, boardTime):
+    #Offset in seconds of ClockTime boardTime (as SpaceTime printed it) from
+    #the system clock at time.time() sysTime. Positive if SpaceTime is ahead.
+    #SpaceTime truncates, so on average it's half a second past what it printed.
+    return ClockTime.FromEpoch(sysTime).Offset(boardTime) + 0.5
+
+  def Fitted(self):
+    #True if the rate comes from readings since the last set
+    return len(self.samples) >= 2 and self.samples[-1][0] - self.samples[0][0] >= self.minSpan
+
+  def Set(self, sysTime):
+    #SpaceTime's clock was set to the system time at sysTime
+    if self.Fitted():
+      self.prior = (self.rate, self.error)
+    self.samples.clear()
+    self.samples.append((sysTime, 0.0))
+    self.setAt = sysTime
+    self.probe = self.firstCheck
+    self.Fit()
+
+  def Observe(self, sysTime, boardTime):
+    #Records a reading of SpaceTime's clock. Returns its offset.
+    offset = self.Offset(sysTime, boardTime)
+    predicted = self.Predict(sysTime)
+    self.lastResidual = None if predicted == None else offset - predicted
+    self.samples.append((sysTime, offset))
+    self.probe = min(self.probe * 2, self.maxInterval)
+    self.Fit()
+    return offset
+
+  def Fit(self):
+    #Least squares line through the samples, or the prior rate through the
+    #last set if there aren't enough of them yet
+    n = len(self.samples)
+    if self.Fitted():
+      t0 = self.samples[0][0]
+      mt = sum(t - t0 for t, o in self.samples) / n
+      mo = sum(o for t, o in self.samples) / n
+      stt = sum((t - t0 - mt) ** 2 for t, o in self.samples)
+      sto = sum((t - t0 - mt) * (o - mo) for t, o in self.samples)
+      self.rate = sto / stt
+      self.error = self.noise / math.sqrt(stt)
+      self.intercept = mo - self.rate * (mt + t0)
+    elif self.prior != None and self.setAt != None:
+      self.rate, self.error = self.prior
+      self.intercept = -self.rate * self.setAt
+    else:
+      self.rate, self.error, self.rms = None, None, None
+      return
+    self.rms = math.sqrt(sum((o - self.Predict(t)) ** 2 for t, o in self.samples) / n)
+
+  def Save(self):
+    #What Restore() needs to pick up where this left off, as JSON-able data
+    return {'samples': list(self.samples), 'set_at': self.setAt, 'prior': self.prior,
+      'probe': self.probe, 'phase': self.phase, 'residual': self.lastResidual}
+
+  def Restore(self, saved):
+    #Takes up the readings Save() returned (ex: before a restart)
+    self.samples = deque((tuple(s) for s in saved['samples']), maxlen = self.maxSamples)
+    self.setAt = saved['set_at']
+    self.prior = None if saved['prior'] == None else tuple(saved['prior'])
+    self.probe = saved['probe']
+    self.phase = saved['phase']
+    self.lastResidual = saved['residual']
+    self.Fit()
+
+  def Predict(self, sysTime):
+    #Predicted offset at sysTime, or None until the rate is known
+    if self.rate == None:
+      return None
+    return self.intercept + self.rate * sysTime
+
+  def NeedsSet(self, sysTime, measured):
+    #Whether to set SpaceTime's clock, given a reading's offset at sysTime.
+    #A single reading is only trusted to within a second, so it has to be
+    #well off; the fit is used when the reading agrees with it. A reading
+    #that doesn't means the clock was changed (ex: from the keypad).
+    predicted = self.Predict(sysTime)
+    if predicted == None or abs(measured - predicted) > 1.5:
+      return abs(measured) > self.threshold + 0.5
+    return abs(predicted) >= self.threshold * self.margin
+
+  def NextCheck(self, now):
+    #time.time() at which SpaceTime's clock should next be read: just before
+    #the offset could reach the threshold if it drifts at the fitted rate
+    #plus two standard errors. The gaps between readings grow exponentially
+    #from the last set, so the fit has a few readings before it's relied on.
+    #Readings all taken at the same fraction of a second would be truncated
+    #the same way, so each one is taken at a different fraction.
+    wait = self.probe
+    if self.rate != None:
+      current = abs(self.Predict(now))
+      rate = abs(self.rate) + 2 * self.error
+      if rate > 0:
+        wait = min(wait, (self.threshold * self.margin - current) / rate)
+    when = math.floor(now + max(self.minInterval, min(wait, self.maxInterval)))
+    self.phase = (self.phase + self.golden) % 1
+    return when + self.phase
+
+  def Status(self, now):
+    #For monitoring (see /status)
+    predicted = self.Predict(now)
+    return {
+      'offset': None if predicted == None else round(predicted, 3),
+      'drift_ppm': None if self.rate == None else round(self.rate * 1e6, 3),
+      'drift_ppm_error': None if self.error == None else round(self.error * 1e6, 3),
+      'residual': None if self.lastResidual == None else round(self.lastResidual, 3),
+      'residual_rms': None if self.rms == None else round(self.rms, 3),
+      'samples': len(self.samples),
+      'set_at': self.setAt }
@@ -0,0 +1,274 @@
+import os
+import random
+import select
+import threading
+import time
+import tty
+from collections import deque
+
+#Emulates the SpaceTime board on a Linux pseudo-terminal, so the Python side
+#can be tested and benchmarked without hardware:
+#  emu = SpaceTimeEmulator().Start()
+#  st = SpaceTime(serialDeviceName = emu.device)
+#It implements the serial protocol in sw/serial.c and the messages printed by
+#sw/clock.c and sw/main.c: character echo, AT, AT?, ATDT, ATST<n>?,
+#ATST<n>=hh:mm[:ss[.cc]], ATST<n>=X, the boot banner, and clearing the
+#closing time when it expires.
+#With a link path, the device is a symlink to the pseudo-terminal, which
+#can be unplugged and plugged back in like a USB serial adapter:
+#  emu = SpaceTimeEmulator(link = '/tmp/spacetime').Start()
+#  emu.Unplug()   #Whoever has it open gets I/O errors
+#  emu.Replug()   #A new pseudo-terminal, at the same path
+
+clockIDs = '0123' #current, closing, cleanup, countdown
+
+def ParseTime(text):
+  #timer_parse() in sw/timer.c: returns (seconds since midnight, match length)
+  if len(text) < 5 or not (text[0:2].isdigit() and text[2] == ':' and text[3:5].isdigit()):
+    return None, 0
+  h, m = int(text[0:2]), int(text[3:5])
+  if h >= 24 or m >= 60:
+    return None, 0
+  secs, match = h * 3600 + m * 60, 5
+  if len(text) >= 8 and text[5] == ':' and text[6:8].isdigit() and int(text[6:8]) < 60:
+    secs, match = secs + int(text[6:8]), 8
+    if len(text) == 11 and text[8] == '.' and text[9:11].isdigit():
+      secs, match = secs + int(text[9:11]) / 100.0, 11
+  return secs, match
+
+def FormatTime(secs):
+  if secs == None:
+    return 'Not set'
+  secs = int(secs) % 86400
+  return '%02d:%02d:%02d' % (secs // 3600, secs // 60 % 60, secs % 60)
+
+class SpaceTimeEmulator:
+  BUFFER_SIZE = 20 #Command buffer size in sw/serial.c
+
+  def __init__(self, baud = 57600, latency = 0, jitter = 0, corruption = 0, drift = 0, boot = True, seed = None,
+      link = None):
+    #baud paces output like the real UART (10 bits per byte); 0 disables pacing.
+    #latency and jitter (seconds) delay each reply; jitter is a random extra.
+    #corruption is the probability that a line we send has a byte mangled or lost.
+    #drift is how fast the emulated clock runs, ex: 0.0001 gains ~8.6s a day.
+    #boot sends the boot banner when started.
+    #link is a path for a symlink to the device, which Replug() keeps.
+    self.baud = baud
+    self.latency = latency
+    self.jitter = jitter
+    self.corruption = corruption
+    self.drift = drift
+    self.boot = boot
+    self.random = random.Random(seed)
+    self.link = link
+    self.Open()
+    self.lock = threading.RLock()
+    self.cond = threading.Condition(self.lock)
+    self.output = deque()      #(bytes, not before) waiting to be sent
+    self.running = False
+    self.threads = []
+    self.received = 0          #Commands processed
+    self.Reset()
+
+  def Open(self):
+    #A new pseudo-terminal for the serial port
+    self.master, self.slave = os.openpty()
+    tty.setraw(self.slave)
+    self.device = os.ttyname(self.slave)
+    if self.link != None:
+      os.symlink(self.device, self.link)
+      self.device = self.link
+
+  def Reset(self):
+    #Power-on state: no clocks set
+    self.buffer = ''
+    self.clocks = {'0': None, '1': None, '2': None, '3': None}
+    self.setAt = 0             #time.time() when the current time was set
+
+  def Now(self):
+    #Seconds since midnight on the emulated current clock, or None if not set
+    if self.clocks['0'] == None:
+      return None
+    return (self.clocks['0'] + (time.time() - self.setAt) * (1 + self.drift)) % 86400
+
+  def Start(self):
+    self.StartIO()
+    if self.boot:
+      self.Send('\r\n*** BOOTED ***\r\nSpaceTime, yay!\r\n')
+    return self
+
+  def StartIO(self):
+    self.running = True
+    for target in (self.RunInput, self.RunOutput):
+      th = threading.Thread(target = target)
+      th.daemon = True
+      th.start()
+      self.threads.append(th)
+
+  def Stop(self):
+    with self.lock:
+      self.running = False
+      self.cond.notify()
+    for th in self.threads:
+      th.join()
+    self.threads = []
+    os.close(self.master)
+    os.close(self.slave)
+    if self.link != None:
+      os.remove(self.link)
+
+  def Unplug(self):
+    #Like pulling out a USB serial adapter: reads and writes fail for
+    #whoever has the port open, and it's gone until Replug(). The board
+    #itself carries on, clocks and all; what it was sending is lost.
+    self.Stop()
+    with self.lock:
+      self.output.clear()
+      self.buffer = ''
+
+  def Replug(self):
+    #Plugging it back in: a new pseudo-terminal, at the same link. The
+    #board wasn't reset, so it doesn't boot.
+    self.Open()
+    self.StartIO()
+
+  def Reboot(self):
+    #Like pressing reset on the board
+    with self.lock:
+      self.Reset()
+      self.output.clear()
+    self.Send('\r\n*** BOOTED ***\r\nSpaceTime, yay!\r\n')
+
+  def Keypad(self, clockID, timestr):
+    #Sets a clock from the keypad (see sw/edit.c). timestr None clears closing time.
+    with self.lock:
+      if timestr == None:
+        self.clocks['1'] = None
+        self.Send('Closing time: Not set\r\n')
+      else:
+        self.SetClock(clockID, ParseTime(timestr)[0])
+
+  def Send(self, text, delay = 0):
+    #Queues text for output, after delay seconds, without reordering
+    with self.lock:
+      when = time.time() + delay
+      if self.output and self.output[-1][1] > when:
+        when = self.output[-1][1]
+      self.output.append((text.encode('ascii'), when))
+      self.cond.notify()
+
+  def Corrupt(self, data):
+    #Only whole lines are corrupted, not the echo of single characters
+    if self.corruption <= 0 or not data.endswith(b'\n') or self.random.random() >= self.corruption:
+      return data
+    i = self.random.randrange(len(data))
+    if self.random.random() < 0.5:
+      return data[:i] + data[i+1:]                                #Lost byte
+    return data[:i] + bytes([self.random.randrange(256)]) + data[i+1:] #Noise
+
+  def RunOutput(self):
+    while 1:
+      with self.lock:
+        while self.running and (not self.output or self.output[0][1] > time.time()):
+          self.cond.wait(self.output[0][1] - time.time() if self.output else None)
+        if not self.running:
+          return
+        data = self.output.popleft()[0]
+      data = self.Corrupt(data)
+      try:
+        os.write(self.master, data)
+      except OSError:
+        return
+      if self.baud:
+        time.sleep(len(data) * 10.0 / self.baud)
+
+  def RunInput(self):
+    while self.running:
+      r, w, x = select.select([self.master], [], [], 0.1)
+      if r:
+        try:
+          data = os.read(self.master, 1024)
+        except OSError:
+          return
+        with self.lock:
+          for c in data.decode('ascii', 'replace'):
+            self.OnChar(c)
+      self.CheckClosing()
+
+  def CheckClosing(self):
+    #clock_update() in sw/clock.c: clear the closing time when it's reached
+    with self.lock:
+      now, closing = self.Now(), self.clocks['1']
+      if now != None and closing != None and int(now) // 60 == int(closing) // 60:
+        self.clocks['1'] = None
+        self.Send('Closing time: Not set\r\n')
+
+  def OnChar(self, c):
+    #serial_update() in sw/serial.c. Called with self.lock held.
+    if c == '\r' or c == '\n':
+      if self.buffer:
+        self.Process(self.buffer)
+        self.buffer = ''
+    elif len(self.buffer) < self.BUFFER_SIZE:
+      self.Send(c)
+      self.buffer += c.lower()
+
+  def Reply(self, text):
+    self.Send(text, self.latency + self.random.uniform(0, self.jitter))
+
+  def SetClock(self, clockID, secs):
+    #Called with self.lock held
+    self.clocks[clockID] = secs
+    if clockID == '0':
+      self.setAt = time.time()
+      self.Send('Current time: ' + FormatTime(secs) + '\r\n')
+    elif clockID == '1':
+      self.Send('Closing time: ' + FormatTime(secs) + '\r\n')
+
+  def Process(self, buf):
+    #process_buffer() in sw/serial.c. Called with self.lock held.
+    self.received += 1
+    out = '\r\n'
+    if buf.startswith('at?'):
+      out += ('SpaceTime commands:\r\n'
+        '  AT? - display this help\r\n'
+        '  ATSTn? - display time: n=0 - current, 1 - closing, 2 - cleanup, 3 - countdown\r\n'
+        '  ATSTn=hh:mm[:ss[.cc]] set a time - .cc is 100ths of a second\r\n'
+        '  ATSTn=x unset a time - intended fo clearing closing time\r\n'
+        '\r\nFor drift correction, set time with .cc twice, at least 1 hr apart.\r\n')
+    elif buf.startswith('atst') and len(buf) >= 6:
+      n, op = buf[4], buf[5]
+      if n not in clockIDs:
+        out += "ERROR: Out of range time selector '" + n + "'\r\n"
+      elif op == '?':
+        secs = self.Now() if n == '0' else self.clocks[n]
+        out += FormatTime(secs) + '\r\n'
+      elif op == '=':
+        if buf[6:] == 'x':
+          if n == '1':
+            self.clocks['1'] = None
+            out += 'Closing time: Not set\r\nOK\r\n'
+          else:
+            out += 'ERROR: Only closing time is clearable.\r\n'
+        else:
+          secs, match = ParseTime(buf[6:])
+          if match >= 5:
+            self.clocks[n] = secs
+            if n == '0':
+              self.setAt = time.time()
+            if n in '01':
+              out += ('Current' if n == '0' else 'Closing') + ' time: ' + FormatTime(secs) + '\r\n'
+            out += 'OK\r\n'
+          else:
+            out += 'ERROR: Time format problem.\r\n'
+      else:
+        out += "ERROR: operator '" + op + "' not recognized\r\n"
+    elif buf == 'at':
+      out += 'OK\r\n'
+    elif buf.startswith('atdt'):
+      out += 'BUSY\r\n'
+    else:
+      out += 'ERROR: Try AT?\r\n'
+    #The echo's line ending goes out right away; the reply after the latency
+    self.Send(out[:2])
+    self.Reply(out[2:])
@@ -0,0 +1,304 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from timeutil import ClockTime
+
+#Local history of what SpaceTime and this process did (closing time changes,
+#board reboots, clock syncs and sets, web API deliveries), so questions about
+#the past don't need the VHS API or the log (see restserv's /history).
+#Events are appended to fixed-width binary records in segment files of
+#segmentRecords records each, in a directory:
+#  00000000.evt, 00000001.evt, ...  the records, oldest first
+#  days.idx                         (UTC day, number of its first record) for each day with events
+#Record n is in segment n // segmentRecords, so finding it is arithmetic, and
+#the day index gives the first record of any day without a search. Segments
+#are read through mmap, and only the records asked for are unpacked, so a
+#query over a day takes the same time after years of events as after one.
+#Records are kept in time order: an event from before the last one (ex: the
+#system clock was stepped back) is recorded at the last one's time.
+#History older than maxDays before the newest event is dropped a whole
+#segment at a time, when a new segment is started, so the directory stays a
+#bounded size on the SD card. Record numbers don't change when it is.
+
+#Record: time.time(), type, ok, unused, value, source (board or sink name)
+record = struct.Struct('<dBBHi16s')
+dayEntry = struct.Struct('<iQ')
+types = ('closing', 'boot', 'sync', 'set', 'delivery')
+
+def Day(t):
+  #UTC day number of time t
+  return int(t // 86400)
+
+def ToDict(t, kind, ok, value, source):
+  #The event of a record, as served by /history
+  e = {'at': t, 'type': types[kind - 1] if 0 < kind <= len(types) else str(kind)}
+  name = source.rstrip(b'\0').decode('utf-8', 'replace')
+  if name:
+    e['source'] = name
+  if e['type'] == 'closing':
+    e['closing_time'] = None if value < 0 else ClockTime(value * 100).Format()
+  elif e['type'] == 'sync':
+    e['offset'] = value / 1000.0
+  elif e['type'] == 'delivery':
+    e['ok'] = bool(ok)
+    e['attempts'] = value
+  return e
+
+def LocalMidnight(t):
+  #time.time() of the local midnight starting the day of t
+  return time.mktime(time.localtime(t)[:3] + (0, 0, 0, 0, 0, -1))
+
+class EventLog:
+  segmentRecords = 32768 #1 MiB segments
+  maxDays = 730          #Days of history kept
+
+  def __init__(self, path, segmentRecords = None, maxDays = None):
+    self.path = path
+    if segmentRecords != None:
+      self.segmentRecords = segmentRecords
+    if maxDays != None:
+      self.maxDays = maxDays
+    os.makedirs(path, exist_ok = True)
+    self.lock = threading.Lock()
+    self.maps = {}      #Segment number -> (mmap, records it covers) for reads
+    self.out = None     #The last segment, open for appending
+    self.outSegment = None
+    self.days = []      #UTC day numbers with events, ascending
+    self.firsts = []    #Number of each day's first record
+    self.Load()
+
+  def SegmentPath(self, n):
+    return os.path.join(self.path, '%08d.evt' % n)
+
+  def IndexPath(self):
+    return os.path.join(self.path, 'days.idx')
+
+  def Load(self):
+    #Finds the number of records, the first one kept and the last time, and
+    #reads the day index
+    segments = sorted(int(f[:-4]) for f in os.listdir(self.path) if f.endswith('.evt') and f[:-4].isdigit())
+    self.count = 0
+    self.first = 0     #Number of the oldest record kept
+    self.last = 0
+    if segments:
+      self.first = segments[0] * self.segmentRecords
+      n = segments[-1]
+      size = os.path.getsize(self.SegmentPath(n))
+      if size % record.size:
+        #Half a record from a crash while writing
+        with open(self.SegmentPath(n), 'r+b') as f:
+          f.truncate(size - size % record.size)
+      self.count = n * self.segmentRecords + size // record.size
+      if self.count:
+        self.last = self.Record(self.count - 1)[0]
+    indexPath = self.IndexPath()
+    if os.path.exists(indexPath):
+      with open(indexPath, 'rb') as f:
+        data = f.read()
+      for i in range(len(data) // dayEntry.size):
+        day, first = dayEntry.unpack_from(data, i * dayEntry.size)
+        if first < self.count:
+          self.days.append(day)
+          self.firsts.append(first)
+    #In case the last prune was cut short before rewriting the index
+    self.TrimDays()
+    self.index = open(indexPath, 'ab')
+    with self.lock:
+      self.Prune(self.last)
+
+  def Prune(self, now):
+    #Called with self.lock held. Deletes the segments, other than the one
+    #being appended to, whose events are all more than maxDays before now,
+    #and the day index entries of the days they held.
+    cutoff = now - self.maxDays * 86400
+    first = self.first
+    while first // self.segmentRecords < self.count // self.segmentRecords:
+      segment = first // self.segmentRecords
+      end = (segment + 1) * self.segmentRecords
+      if self.Time(end - 1) >= cutoff:
+        break
+      have = self.maps.pop(segment, None)
+      if have != None:
+        have[0].close()
+      os.remove(self.SegmentPath(segment))
+      first = end
+    if first == self.first:
+      return
+    self.first = first
+    self.TrimDays()
+    tmp = self.IndexPath() + '.tmp'
+    with open(tmp, 'wb') as f:
+      for day, n in zip(self.days, self.firsts):
+        f.write(dayEntry.pack(day, n))
+    self.index.close()
+    os.replace(tmp, self.IndexPath())
+    self.index = open(self.IndexPath(), 'ab')
+
+  def TrimDays(self):
+    #Drops the days with no records left from the day index. A day that
+    #started in a deleted segment now starts at the first record kept.
+    keep = [i for i in range(len(self.days)) if i + 1 == len(self.days) or self.firsts[i + 1] > self.first]
+    self.days = [self.days[i] for i in keep]
+    self.firsts = [max(self.firsts[i], self.first) for i in keep]
+
+  def Append(self, kind, value = 0, source = '', ok = True, t = None):
+    #Records an event: kind is one of types, value an int whose meaning
+    #depends on it (see ToDict()). Returns its record number.
+    t = time.time() if t == None else t
+    data = (kind if isinstance(kind, int) else types.index(kind) + 1, 1 if ok else 0, 0, int(value),
+      source.encode('utf-8')[:16])
+    with self.lock:
+      t = max(t, self.last)
+      n = self.count
+      segment = n // self.segmentRecords
+      if segment != self.outSegment:
+        if self.out != None:
+          self.out.close()
+        self.out = open(self.SegmentPath(segment), 'ab')
+        self.outSegment = segment
+        self.Prune(t)
+      self.out.write(record.pack(t, *data))
+      self.out.flush()
+      day = Day(t)
+      if not self.days or day != self.days[-1]:
+        self.days.append(day)
+        self.firsts.append(n)
+        self.index.write(dayEntry.pack(day, n))
+        self.index.flush()
+      self.count = n + 1
+      self.last = t
+      return n
+
+  def Map(self, segment):
+    #Called with self.lock held. The mmap of segment, remapped if it has
+    #grown since.
+    have = self.maps.get(segment)
+    full = segment < self.count // self.segmentRecords
+    records = self.segmentRecords if full else self.count % self.segmentRecords
+    if have == None or have[1] < records:
+      if have != None:
+        have[0].close()
+      with open(self.SegmentPath(segment), 'rb') as f:
+        have = (mmap.mmap(f.fileno(), records * record.size, access = mmap.ACCESS_READ), records)
+      self.maps[segment] = have
+    return have[0]
+
+  def Record(self, n):
+    #Record n, unpacked: (time, type, ok, unused, value, source)
+    m = self.Map(n // self.segmentRecords)
+    return record.unpack_from(m, (n % self.segmentRecords) * record.size)
+
+  def Time(self, n):
+    m = self.Map(n // self.segmentRecords)
+    return struct.unpack_from('<d', m, (n % self.segmentRecords) * record.size)[0]
+
+  def Find(self, t):
+    #Called with self.lock held. Number of the first record at or after t.
+    i = bisect_right(self.days, Day(t)) - 1
+    lo = self.firsts[i] if i >= 0 else self.first
+    hi = self.firsts[i + 1] if i + 1 < len(self.firsts) else self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.Time(mid) < t:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def Between(self, start, end, kinds = None, limit = None):
+    #Events from time start up to (not including) end, oldest first, as
+    #dicts (see ToDict()), optionally only of kinds, and at most limit
+    wanted = None if kinds == None else set(types.index(k) + 1 for k in kinds)
+    events = []
+    with self.lock:
+      if not self.count:
+        return events
+      n = self.Find(start)
+      while n < self.count:
+        r = self.Record(n)
+        if r[0] >= end:
+          break
+        if wanted == None or r[1] in wanted:
+          events.append(ToDict(r[0], r[1], r[2], r[4], r[5]))
+          if limit != None and len(events) >= limit:
+            break
+        n += 1
+    return events
+
+  def LastBefore(self, t, kind):
+    #The last event of kind before time t, looking back at most 2 days, or None
+    code = types.index(kind) + 1
+    with self.lock:
+      n = self.Find(t) - 1
+      stop = self.Find(t - 2 * 86400)
+      while n >= stop:
+        r = self.Record(n)
+        if r[1] == code:
+          return ToDict(r[0], r[1], r[2], r[4], r[5])
+        n -= 1
+    return None
+
+  def OpenHours(self, start, end, now = None):
+    #Hours the space was open on each local day from the one of time start
+    #to the one of end, as [('YYYY-MM-DD', hours)], from the closing events.
+    #A closing time always runs out within a day, so whether it was open at
+    #the start is in the last closing event of the two days before.
+    now = time.time() if now == None else now
+    end = min(end, now)
+    days = []
+    t = LocalMidnight(start)
+    while t < end:
+      #Next local midnight, allowing for days of 23 or 25 hours
+      nxt = LocalMidnight(t + 86400 + 3600)
+      days.append([t, nxt, 0.0])
+      t = nxt
+    if not days:
+      return []
+    first, last = days[0][0], min(days[-1][1], end)
+    before = self.LastBefore(first, 'closing')
+    openedAt = first if before != None and before['closing_time'] != None else None
+    changes = self.Between(first, last, ('closing',))
+    intervals = []
+    for e in changes:
+      if e['closing_time'] != None and openedAt == None:
+        openedAt = e['at']
+      elif e['closing_time'] == None and openedAt != None:
+        intervals.append((openedAt, e['at']))
+        openedAt = None
+    if openedAt != None:
+      intervals.append((openedAt, last))
+    for day in days:
+      for a, b in intervals:
+        overlap = min(b, day[1]) - max(a, day[0])
+        if overlap > 0:
+          day[2] += overlap
+    return [(time.strftime('%Y-%m-%d', time.localtime(d[0] + 3600)), round(d[2] / 3600, 3)) for d in days]
+
+  def Size(self):
+    #Number of records kept
+    with self.lock:
+      return self.count - self.first
+
+  def Close(self):
+    with self.lock:
+      for m, records in self.maps.values():
+        m.close()
+      self.maps = {}
+      if self.out != None:
+        self.out.close()
+        self.out = None
+        self.outSegment = None
+      self.index.close()
+
+def ParseTime(text, default):
+  #A /history time parameter: seconds since the epoch, or a local date
+  #'YYYY-MM-DD' (its midnight). default if text is empty. Raises ValueError.
+  if not text:
+    return default
+  try:
+    return float(text)
+  except ValueError:
+    return time.mktime(time.strptime(text, '%Y-%m-%d'))
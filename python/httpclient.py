@@ -0,0 +1,120 @@
+import functools
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import metrics
+
+#Shared by the web API clients (see Instrumented())
+apiSeconds = metrics.Histogram('webapi_request_seconds',
+  'Time taken by web API calls, including retries on a new connection', ('api', 'call'))
+apiFailures = metrics.Counter('webapi_request_failures_total',
+  'Web API calls that failed', ('api', 'call'))
+connectRetries = metrics.Counter('webapi_connect_retries_total',
+  'Failed queries while waiting for a web API at startup', ('api',))
+
+def Instrumented(api, call):
+  #Decorator for a web API client method that returns False when it fails
+  #(ex: WebApi.Update): records its time and failures as api, call.
+  def Wrap(func):
+    seconds = apiSeconds.Labels(api, call)
+    failures = apiFailures.Labels(api, call)
+    @functools.wraps(func)
+    def Timed(*args, **kwargs):
+      start = time.perf_counter()
+      result = func(*args, **kwargs)
+      seconds.Observe(time.perf_counter() - start)
+      if result is False:
+        failures.Inc()
+      return result
+    return Timed
+  return Wrap
+
+def Unsent(e):
+  #Whether a requests ConnectionError happened before any of the request
+  #was sent: a new connection couldn't be made
+  reason = getattr(e.args[0], 'reason', None) if e.args else None
+  return isinstance(reason, NewConnectionError)
+
+class HttpClient:
+  #A pooled, keep-alive HTTP session shared by all requests of one API client.
+  #Reusing connections saves a TCP connect and a full TLS handshake on every
+  #heartbeat and status change, which is noticeable on a Raspberry Pi.
+  #If a pooled connection has gone stale (ex: the server or a NAT timed it out),
+  #the session is rebuilt and the request is tried once more on a new connection.
+  #Only requests that can safely be repeated are tried again, unless none of
+  #it was sent: a POST the server may already have acted on just fails.
+  #Several threads may share one client (ex: a Dispatcher worker and the
+  #heartbeat), so the session is only swapped and read under a lock.
+  #With a breaker (see breaker.py), requests fail with CircuitOpen right away
+  #while the server is down. Errors, timeouts and 5xx replies count as failures.
+
+  idempotent = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+  def __init__(self, poolSize = 2, breaker = None):
+    self.poolSize = poolSize
+    self.session = None
+    self.lock = threading.Lock()
+    self.resets = 0 #Number of times the session was rebuilt after a connection error
+    self.breaker = breaker
+
+  def NewSession(self):
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self.poolSize)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    return s
+
+  def Session(self):
+    with self.lock:
+      if self.session == None:
+        self.session = self.NewSession()
+      return self.session
+
+  def Reset(self, stale = None):
+    #Discards all pooled connections. With stale, only if the session is
+    #still that one (another thread may have replaced it already).
+    #The old session isn't closed: another thread may be using one of its
+    #connections, and they're closed once nobody is.
+    with self.lock:
+      if stale == None or self.session is stale:
+        self.session = None
+        return True
+      return False
+
+  def Request(self, method, url, **kwargs):
+    #Same as requests.request(), but on a pooled connection
+    if self.breaker == None:
+      return self.Send(method, url, **kwargs)
+    probe = self.breaker.Allow()
+    try:
+      r = self.Send(method, url, **kwargs)
+    except Exception:
+      self.breaker.Failure(probe)
+      raise
+    if r.status_code >= 500:
+      self.breaker.Failure(probe)
+    else:
+      self.breaker.Success(probe)
+    return r
+
+  def Send(self, method, url, **kwargs):
+    session = self.Session()
+    try:
+      return session.request(method, url, **kwargs)
+    except requests.exceptions.Timeout:
+      #Not retried: the server is slow, the connection isn't stale
+      raise
+    except requests.exceptions.ConnectionError as e:
+      if self.Reset(session):
+        self.resets += 1
+      if method.upper() not in self.idempotent and not Unsent(e):
+        raise
+      return self.Session().request(method, url, **kwargs)
+
+  def Get(self, url, **kwargs):
+    return self.Request('GET', url, **kwargs)
+
+  def Post(self, url, **kwargs):
+    return self.Request('POST', url, **kwargs)
@@ -0,0 +1,132 @@
+import select
+import socket
+import threading
+import metrics
+from logbuffer import log
+
+#Keeps track of this machine's local IP, so the VHS API hears about it when
+#it changes (ex: a new DHCP lease), not just at startup, and not at every
+#startup when it hasn't.
+#An IPWatcher asks an address source for the IP whenever the source says it
+#may have changed:
+#  NetlinkSource  Linux: the kernel tells us about every address, link and
+#                 route change (rtnetlink), so there's no polling at all
+#  PollSource     anywhere else: looks every interval seconds
+#Either way the IP is the one packets to the internet would leave from (see
+#LocalIP()), which doesn't send anything, so it's cheap to look.
+#Usage:
+#  watcher = IPWatcher(AddressSource(), lambda ip: print(ip), last = '10.0.0.2')
+#  watcher.Check()
+#  watcher.Start()
+
+changes = metrics.Counter('local_ip_changes_total', 'Times the local IP was found to have changed')
+
+def LocalIP(probe = ('8.8.8.8', 80)):
+  #The local IP address packets to probe would be sent from, or None if
+  #there's no route. Connecting a UDP socket picks the route without
+  #sending anything.
+  s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    s.connect(probe)
+    return s.getsockname()[0]
+  except OSError:
+    return None
+  finally:
+    s.close()
+
+class PollSource:
+  #Says the IP may have changed every interval seconds
+  def __init__(self, interval = 60):
+    self.interval = interval
+    self.stopped = threading.Event()
+
+  def Current(self):
+    return LocalIP()
+
+  def Wait(self, timeout):
+    #Waits until the IP may have changed, or timeout. Returns False if
+    #Close() was called.
+    return not self.stopped.wait(min(timeout, self.interval))
+
+  def Close(self):
+    self.stopped.set()
+
+class NetlinkSource(PollSource):
+  #Says the IP may have changed when the kernel reports an address, link or
+  #route change. Raises OSError where there's no netlink (not Linux).
+  groups = 0x1 | 0x10 | 0x40 | 0x100 #RTMGRP_LINK, _IPV4_IFADDR, _IPV4_ROUTE, _IPV6_IFADDR
+
+  def __init__(self):
+    PollSource.__init__(self)
+    self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0) #NETLINK_ROUTE
+    self.sock.bind((0, self.groups))
+    self.sock.setblocking(False)
+    self.wake = socket.socketpair() #Written to by Close()
+
+  def Wait(self, timeout):
+    ready = select.select([self.sock, self.wake[0]], [], [], timeout)[0]
+    if self.wake[0] in ready or self.stopped.is_set():
+      for sock in (self.sock,) + self.wake:
+        sock.close()
+      return False
+    #One change often comes as several messages (ex: link up, then address)
+    try:
+      while self.sock.recv(65536):
+        pass
+    except BlockingIOError:
+      pass
+    return True
+
+  def Close(self):
+    self.stopped.set()
+    self.wake[1].send(b'x')
+
+def AddressSource(pollInterval = 60):
+  #A NetlinkSource where there is netlink, or else a PollSource
+  try:
+    return NetlinkSource()
+  except (AttributeError, OSError) as e:
+    log.Info('No netlink, polling for local IP changes', interval = pollInterval, error = str(e))
+    return PollSource(pollInterval)
+
+class IPWatcher:
+  recheck = 3600 #Seconds between looks even if the source says nothing changed
+
+  def __init__(self, source, onChange, last = None):
+    self.source = source
+    self.onChange = onChange #Called with the new IP, from the watcher's thread after Start()
+    self.last = last         #The IP last reported, ex: before a restart
+    self.lock = threading.Lock()
+    self.thread = None
+
+  def Check(self):
+    #Looks at the IP now, and reports it if it changed. Returns whether it did.
+    ip = self.source.Current()
+    with self.lock:
+      if ip == None or ip == self.last:
+        return False
+      old, self.last = self.last, ip
+    changes.Inc()
+    log.Info('Local IP is ' + ip, was = old)
+    self.onChange(ip)
+    return True
+
+  def Run(self):
+    while True:
+      if not self.source.Wait(self.recheck):
+        return
+      try:
+        self.Check()
+      except Exception as e:
+        log.Error('Local IP check failed', error = str(e))
+
+  def Start(self):
+    self.thread = threading.Thread(target = self.Run, name = 'ipwatch')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Stop(self):
+    self.source.Close()
+    if self.thread != None:
+      self.thread.join()
+      self.thread = None
@@ -0,0 +1,86 @@
+import codecs
+import json
+
+#Incremental parsing of JSON documents that are mostly one long array (ex:
+#the VHS API's history of a variable), so they can be read as they're
+#downloaded without holding the whole document in memory.
+
+decoder = json.JSONDecoder()
+whitespace = ' \t\r\n'
+
+def FindArray(buf, state):
+  #Returns the index just past the first '[' in buf that isn't inside a
+  #string, or -1. state is [in string, after backslash], carried over
+  #between calls since a string can span chunks.
+  for i, c in enumerate(buf):
+    if state[1]:
+      state[1] = False
+    elif state[0]:
+      if c == '\\':
+        state[1] = True
+      elif c == '"':
+        state[0] = False
+    elif c == '"':
+      state[0] = True
+    elif c == '[':
+      return i + 1
+  return -1
+
+def IterArray(chunks, maxItem = 65536):
+  #Yields the items of the first array in the JSON document made of chunks
+  #(bytes or str, ex: from requests' iter_content()), as each one is
+  #complete. Whatever comes before the array (ex: '{"name": "door", ') is
+  #skipped, and whatever comes after it is ignored.
+  #Only one item is buffered at a time; an item longer than maxItem
+  #characters raises ValueError, as does malformed JSON.
+  utf8 = codecs.getincrementaldecoder('utf-8')()
+  buf = ''
+  pos = 0
+  inArray = False
+  prefix = [False, False]
+  chunks = iter(chunks)
+  ended = False
+  while True:
+    if not ended:
+      try:
+        chunk = next(chunks)
+        buf = buf[pos:] + (utf8.decode(chunk) if isinstance(chunk, bytes) else chunk)
+      except StopIteration:
+        ended = True
+        buf = buf[pos:] + utf8.decode(b'', True)
+      pos = 0
+    if not inArray:
+      start = FindArray(buf, prefix)
+      if start < 0:
+        if ended:
+          raise ValueError('No JSON array found')
+        pos = len(buf)
+        continue
+      inArray = True
+      pos = start
+    #Parse every complete item in buf
+    while True:
+      while pos < len(buf) and buf[pos] in whitespace:
+        pos += 1
+      if pos < len(buf) and buf[pos] == ',':
+        pos += 1
+        while pos < len(buf) and buf[pos] in whitespace:
+          pos += 1
+      if pos >= len(buf):
+        break
+      if buf[pos] == ']':
+        return
+      try:
+        item, end = decoder.raw_decode(buf, pos)
+      except ValueError:
+        if ended:
+          raise
+        if len(buf) - pos > maxItem:
+          raise ValueError('JSON array item longer than ' + str(maxItem) + ' characters')
+        break #Incomplete, wait for more
+      if not ended and (end == len(buf) or buf[end] not in ',]' + whitespace):
+        break #A number may go on in the next chunk (ex: '3' then '.5')
+      yield item
+      pos = end
+    if ended:
+      raise ValueError('Unterminated JSON array')
@@ -0,0 +1,172 @@
+import atexit
+import json
+import sys
+import threading
+import time
+from collections import deque
+import metrics
+
+#Structured log for everything this process has to say, instead of print().
+#Entries are kept in an in-memory ring buffer, which restserv's /log serves,
+#and written out (to stdout, or a file: see Open()) by a background thread
+#in batches, so a slow SD card never holds up the serial port or the REST
+#server.
+#A warning or error that repeats one logged less than dedupWindow seconds ago
+#(ex: the same exception every time the main loop retries) isn't logged
+#again; the number of repeats is logged once the window is over. INFO and
+#DEBUG entries are always logged, since a repeat there is news (ex: the
+#closing time set to the same time again).
+#Usage:
+#  from logbuffer import log
+#  log.Error('isvhsopen Update failed', error = str(e))
+
+levels = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+logged = metrics.Counter('log_messages_total', 'Log entries, by level', ('level',))
+suppressed = metrics.Counter('log_suppressed_total', 'Repeated log entries that were not logged again')
+dropped = metrics.Counter('log_dropped_total', 'Log entries not written out because the output was too slow')
+
+def FormatEntry(e):
+  #One line of text for entry e
+  line = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e['at'])) + ' ' + e['level'].ljust(7) + ' ' + e['msg']
+  fields = [k + '=' + (v if isinstance(v, str) else json.dumps(v)) for k, v in sorted(e.items())
+    if k not in ('seq', 'at', 'level', 'msg')]
+  return line + (' ' + ' '.join(fields) if fields else '')
+
+class LogBuffer:
+  maxEntries = 1000    #Entries kept for /log
+  maxPending = 10000   #Entries waiting to be written before the oldest are dropped
+  flushInterval = 1    #Seconds between writes
+  dedupWindow = 60     #Seconds during which a repeated entry isn't logged again
+  dedupLevels = ('WARNING', 'ERROR')
+
+  def __init__(self, out = None):
+    #out is a file object to write to; None is whatever sys.stdout is
+    self.out = out
+    self.path = None
+    self.cond = threading.Condition()
+    self.writeLock = threading.Lock() #Keeps batches in order
+    self.seq = 0
+    self.entries = deque(maxlen = self.maxEntries) #Oldest first
+    self.lost = 0        #seq of the newest entry that no longer fits in entries
+    self.pending = deque()
+    self.recent = {}     #Dedup key -> [time first logged, repeats since, fields]
+    self.thread = None
+    self.running = False
+
+  def Open(self, path):
+    #Appends to the file at path instead of writing to stdout
+    with self.cond:
+      if self.path != None and self.out != None:
+        self.out.close()
+      self.path = path
+      self.out = open(path, 'a', buffering = 1 << 16)
+
+  def Debug(self, msg, **fields):
+    return self.Log('DEBUG', msg, **fields)
+
+  def Info(self, msg, **fields):
+    return self.Log('INFO', msg, **fields)
+
+  def Warning(self, msg, **fields):
+    return self.Log('WARNING', msg, **fields)
+
+  def Error(self, msg, **fields):
+    return self.Log('ERROR', msg, **fields)
+
+  def Log(self, level, msg, **fields):
+    #Records an entry. Returns its seq, or None if it repeats a recent one.
+    #Field values should be JSON serializable.
+    now = time.time()
+    key = (level, msg, repr(sorted(fields.items()))) if level in self.dedupLevels else None
+    with self.cond:
+      seen = self.recent.get(key)
+      if seen != None and now - seen[0] < self.dedupWindow:
+        seen[1] += 1
+        suppressed.Inc()
+        return None
+      if key != None:
+        self.recent[key] = [now, 0, fields]
+      seq = self.Append(level, msg, now, fields)
+      if self.thread == None:
+        self.Start()
+    logged.Labels(level).Inc()
+    return seq
+
+  def Append(self, level, msg, now, fields):
+    #Called with self.cond held
+    self.seq += 1
+    entry = dict(fields)
+    entry.update(seq = self.seq, at = now, level = level, msg = msg)
+    if len(self.entries) == self.entries.maxlen:
+      self.lost = self.entries[0]['seq']
+    self.entries.append(entry)
+    if len(self.pending) == self.maxPending:
+      self.pending.popleft()
+      dropped.Inc()
+    self.pending.append(entry)
+    return self.seq
+
+  def Expire(self, now):
+    #Called with self.cond held. Forgets entries older than dedupWindow,
+    #logging how many times the ones that kept repeating did.
+    for key, (first, repeats, fields) in list(self.recent.items()):
+      if now - first >= self.dedupWindow:
+        del self.recent[key]
+        if repeats:
+          self.Append(key[0], key[1], now, dict(fields, repeats = repeats))
+
+  def EntriesSince(self, since, level = None):
+    #Returns (newest seq, entries after seq since at or above level, missed),
+    #where missed is True if some of them were already discarded
+    minLevel = levels.index(level) if level in levels else 0
+    with self.cond:
+      entries = [dict(e) for e in self.entries if e['seq'] > since and levels.index(e['level']) >= minLevel]
+      return self.seq, entries, since < self.lost
+
+  def Start(self):
+    #Called with self.cond held
+    self.running = True
+    self.thread = threading.Thread(target = self.Run, name = 'logbuffer')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Stop(self):
+    #Writes out everything pending and stops the thread
+    with self.cond:
+      thread, self.running = self.thread, False
+      self.cond.notify()
+    if thread != None:
+      thread.join()
+    self.thread = None
+
+  def Run(self):
+    while True:
+      with self.cond:
+        if self.running:
+          self.cond.wait(self.flushInterval)
+        self.Expire(time.time())
+        running = self.running
+      self.Flush()
+      if not running:
+        return
+
+  def Flush(self):
+    #Writes out the pending entries, in one write. Runs on the log's thread,
+    #but can be called from any.
+    with self.writeLock:
+      with self.cond:
+        batch = list(self.pending)
+        self.pending.clear()
+        out = self.out if self.out != None else sys.stdout
+      if not batch:
+        return
+      try:
+        out.write(''.join(FormatEntry(e) + '\n' for e in batch))
+        out.flush()
+      except Exception:
+        dropped.Inc(len(batch))
+
+#The log everything writes to
+log = LogBuffer()
+atexit.register(log.Flush)
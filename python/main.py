@@ -1,184 +1,485 @@
+import math
+import os
 import time
-import socket
-from spacetime import SpaceTime
+import threading
 from vhsapi import VHSApi #api.vanhack.ca
 from webapi import WebApi #isvhsopen.com/api/status/
 from restserv import RestServ #Webserver for REST API to allow updates from the VHS network 
-from timeutil import *
+from runtime import Runtime, loopSeconds
+from scheduler import Scheduler, InMinuteWindow
+from sinks import Dispatcher, WebApiSink, VHSApiSink, WebhookSink, FileSink, DoorEvent, IPEvent #Background delivery of status changes
+from statestore import StateStore #What we believe SpaceTime's state is, for /status
+from timeutil import ClockTime
+from boards import BoardManager, ParseDevices #Per-board state, and several boards at once
+from drift import DriftModel
+import metrics #Served by the REST API's /metrics
+from logbuffer import log #Served by the REST API's /log
+from milestones import Milestones #How long startup took, for /status and /metrics
+from eventlog import EventLog #Local history of closing times, boots, clock syncs, deliveries
+from snapshot import Snapshot, avoided #Saved state for warm restarts
+from ipwatch import IPWatcher, AddressSource #Notices when the local IP changes
 
 dbg_showAllSerial = False #If true, prints out all received serial messages
-lastClockSync   = 0       #Time of last clock sync with SpaceTime
-lastHeartbeat   = 0       #Time of last update with isvhsopen.com WebApi
 doorStatus_cache= ''      #The last known door status, to send periodic heartbeat to WebApi
+dispatcher      = None    #If set, status changes are published here instead of sent to the web API inline
+state           = StateStore() #Served by the REST API's /status
+scheduler       = Scheduler()  #Periodic jobs: clock sync, heartbeat
 api_var_ip      = 'spacetime_ip'
-max_clock_drift = 10 #Allowable error (in seconds) between SpaceTime clock and system clock
+max_clock_drift = 0.5 #Allowable error (in seconds) between SpaceTime clock and system clock
+manager         = BoardManager(max_clock_drift) #The SpaceTime boards, each with its own clock drift
+default_devices = '/dev/ttyAMA0' #Unless SPACETIME_DEVICES lists others (see boards.py)
+clock_sync_retry    = 10    #Seconds to wait for SpaceTime's reply before asking again
+serial_connect_timeout = 10 #Seconds setup() waits for each board to answer before carrying on without it
+connect_retry_max   = 60    #Longest wait between checks for the internet at startup
+startup             = Milestones() #Time from starting to the first serial reply, web API update...
+heartbeat_interval  = 900   #Send a heartbeat to isvhsopen.com every 15min
+history             = None  #If set, the EventLog events are recorded in, served by the REST API's /history
+default_history = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history') #Unless SPACETIME_HISTORY says where
+snapshot            = None  #If set, the Snapshot the state is saved in for warm restarts
+snapshot_max_age    = 1800  #Seconds a snapshot is trusted for at startup
+default_snapshot = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state.json') #Unless SPACETIME_SNAPSHOT says where
+restored            = {}    #What setup() took from the snapshot
+warm_door           = None  #(closing time, time.time() it was sent) isvhsopen.com had before a restart
+ip_watcher          = None  #If set, the IPWatcher that tells the VHS Api about local IP changes
+
+def ScheduleClockSync(st, when):
+  #Query SpaceTime's clock at when. Its response will trigger us to update it
+  #if necessary, and reschedule this for when the DriftModel expects it to
+  #need it next. Until it responds, ask again, at least clock_sync_retry
+  #seconds later.
+  #The query is sent when we're 41-50s into a minute, to minimize the chance
+  #of the clock jumping back 1min or forward 2min, keeping the fraction of a
+  #second the DriftModel picked.
+  scheduler.Schedule(manager.Get(st).Job('clock sync'), when, lambda: st.GetTime(0),
+    interval = clock_sync_retry, align = lambda t: InMinuteWindow(math.floor(t), 41, 49) + t % 1)
+
+def ScheduleClockSet(st):
+  #Sets SpaceTime's clock right on the next second boundary in the 41-50s
+  #window. SpaceTime only takes whole seconds (see drift.py for why not
+  #.cc), so that's when they're exact.
+  scheduler.Schedule(manager.Get(st).Job('clock set'), time.time(), lambda: SetClock(st),
+    align = lambda t: InMinuteWindow(math.ceil(t)))
+
+def SetClock(st):
+  board = manager.Get(st)
+  now = time.time()
+  curTime = ClockTime.FromEpoch(now)
+  log.Info('Synchronizing SpaceTime\'s clock to ' + str(curTime), board = board.name)
+  #SpaceTime Current clockID = 0
+  st.SetTime(0, curTime)
+  board.drift.Set(now)
+  Record('set', source = board.name)
+  UpdateBoardState(board, now)
+  ScheduleClockSync(st, board.drift.NextCheck(now))
+
+def Record(kind, value = 0, source = '', ok = True):
+  #Appends an event to the local history, if there is one (see eventlog.py)
+  if history != None:
+    history.Append(kind, value, source, ok)
+
+def UpdateBoardState(board, now):
+  #The top-level fields of /status are the primary board's
+  if board is manager.Primary():
+    state.Update(current_time = board.current_time, last_sync = board.last_sync,
+      clock = board.drift.Status(now))
+  state.Update(boards = manager.Status(now))
+
+def SendHeartbeat(webApi):
+  log.Info('Sending Heartbeat to Web API...')
+  if dispatcher != None and dispatcher.Depth() > 0:
+    log.Warning('Status updates still pending', pending = dispatcher.Depth(),
+      oldest = int(dispatcher.OldestAge()))
+  UpdateDoorStatus(webApi, doorStatus_cache)
 
 def UpdateDoorStatus(webApi, closing_time):
   #Save current time and door status to send periodic heartbeats to WebAPI
-  global lastHeartbeat, doorStatus_cache
-  lastHeartbeat = time.time()
+  global doorStatus_cache, warm_door
+  now = time.time()
   doorStatus_cache = closing_time
+  warm_door = None #Whatever isvhsopen.com had before a restart is out of date
+  state.Update(closing_time = closing_time, last_heartbeat = now)
+  #The next heartbeat is due heartbeat_interval after this update
+  scheduler.Schedule('heartbeat', now + heartbeat_interval, lambda: SendHeartbeat(webApi),
+    interval = heartbeat_interval)
   #Update WebAPI with door status. WebAPI is smart enough
   #to ignore duplicate submissions, so unnecessary updates
   #aren't harmful and do not affect the timestamp.
   if closing_time == None:
-    webApi.Update('closed')
+    args = ('closed',)
   else:
     #Removing seconds part
-    closing_time = closing_time[:5]
-    webApi.Update('open', closing_time)
+    args = ('open', closing_time[:5])
+  if dispatcher != None:
+    #To every sink, isvhsopen.com included; only the latest door status is
+    #kept for a sink that is slow
+    dispatcher.Publish(DoorEvent(closing_time))
+  else:
+    state.RecordDelivery('isvhsopen', webApi.Update(*args) != False)
     
+def RestoreDoorStatus(webApi, closing_time, sentAt):
+  #Takes up the door status isvhsopen.com got before a restart, without
+  #sending it again: the next heartbeat is due heartbeat_interval after it
+  global doorStatus_cache
+  doorStatus_cache = closing_time
+  state.Update(closing_time = closing_time, last_heartbeat = sentAt)
+  scheduler.Schedule('heartbeat', sentAt + heartbeat_interval, lambda: SendHeartbeat(webApi),
+    interval = heartbeat_interval)
+
 def ProcessSerialMsg(msg, webApi, st):
+  board = manager.Get(st)
   
   if msg.type == 'Current' or msg.type == 'AmbiguousTime':
     #SpaceTime is telling us what it thinks is the current time
     #It's telling us either because the user just set it, or
     #because we asked it.
-    #Currently, we never ask for the Closing time, so if we receive
-    #an AmbiguousTime, we can safely assume it is the Current time.
+    #Replies to our queries are labelled with the clock we asked for, so an
+    #AmbiguousTime is a reply to a query we didn't send (ex: typed in a
+    #serial console). We can safely assume it is the Current time.
 
-    global lastClockSync
-    lastClockSync = time.time()
-    curTime = time.localtime(lastClockSync)
-    
-    shouldUpdate = True
-    if msg.val != None:
-      #Check if SpaceTime time is close to current system time
-      SpaceTimeDrift = TimeOffsetSeconds(curTime, StrToTime(msg.val))
-      #Don't bother updating SpaceTime if time is within 10s of system time
-      shouldUpdate = abs(SpaceTimeDrift) > max_clock_drift
-    if shouldUpdate:
-      print('Synchronizing SpaceTime\'s clock to ' + TimeToStr(curTime))
-      #SpaceTime Current clockID = 0
-      st.SetTime(0, curTime)
+    now = time.time()
+    board.current_time, board.last_sync = msg.val, now
+    UpdateBoardState(board, now)
+    if msg.command != None and not msg.command.query:
+      #The reply to our own SetTime()
+      return
+    #When SpaceTime read its clock: right after it got our query
+    readAt = msg.command.sent if msg.command != None else now
+    spaceTime = ClockTime.Parse(msg.val) if msg.val != None else None
+    offset = None
+    if spaceTime != None:
+      offset = board.drift.Observe(readAt, spaceTime)
+      Record('sync', round(offset * 1000), board.name)
+    if offset == None or board.drift.NeedsSet(readAt, offset):
+      #SetClock() schedules the next query
+      scheduler.Cancel(board.Job('clock sync'))
+      ScheduleClockSet(st)
+    else:
+      #Check again just before it's expected to be off by too much
+      ScheduleClockSync(st, board.drift.NextCheck(now))
+    UpdateBoardState(board, now)
     
   elif msg.type == 'Closing':
     #SpaceTime is telling us the status of closing time.
     #It's telling us because the user just set it, because
-    #we asked for it, or because it just expired.
+    #we asked for it, because we set it, or because it just expired.
     
-    print('SpaceTime reports that Closing time is ' + ('not set' if msg.val == None else msg.val))
-    #Update WebAPI
-    UpdateDoorStatus(webApi, msg.val)
+    log.Info('SpaceTime reports that Closing time is ' + ('not set' if msg.val == None else msg.val),
+      board = board.name)
+    board.closing_time = msg.val
+    primary = manager.Primary()
+    if msg.command != None and msg.command.query and board is not primary:
+      #Another board's closing time at startup. The primary's wins.
+      if primary.heard and msg.val != primary.closing_time:
+        manager.SetClosing(board, primary.closing_time)
+      board.heard = True
+      UpdateBoardState(board, time.time())
+      return
+    board.heard = True
+    UpdateBoardState(board, time.time())
+    #With several boards, each one reports the same change, so only the
+    #first report of it goes on
+    if len(manager.boards) == 1 or msg.val != manager.closing_time:
+      manager.closing_time = msg.val
+      closing = ClockTime.Parse(msg.val) if msg.val != None else None
+      Record('closing', -1 if closing == None else closing.Seconds(), board.name)
+      if msg.command != None and msg.command.query and warm_door != None and warm_door[0] == msg.val:
+        #Our startup query, and isvhsopen.com already has it (see setup())
+        avoided.Labels('isvhsopen').Inc()
+      else:
+        #Update WebAPI
+        UpdateDoorStatus(webApi, msg.val)
+      #Push to /events subscribers
+      state.Publish('closing', closing_time = msg.val)
+    if msg.command == None or msg.command.query:
+      #Set on its keypad or expired, or the primary board's closing time
+      #at startup: the other boards should show it too
+      manager.Propagate(board, msg.val)
   elif msg.type == 'OK':
     return #Can ignore 'OK' responses
   elif msg.type == 'Echo':
     return #SpaceTime echoes all commands sent to it, so we can ignore these
+  elif msg.type == 'Banner':
+    return #SpaceTime prints this just before its 'Boot' message
+  elif msg.type == 'Error':
+    log.Error('SpaceTime reported an error: "' + msg.val.rstrip() + '"', board = board.name)
   elif msg.type == 'Boot':
-    print('SpaceTime has just been reset!')
-    print('Resetting Web API variables and setting SpaceTime\'s clock')
-    UpdateDoorStatus(webApi, None)
+    log.Warning('SpaceTime has just been reset!', board = board.name)
+    Record('boot', source = board.name)
+    board.closing_time = None
+    board.heard = True
+    if manager.closing_time != None and len(manager.boards) > 1:
+      #The other boards still have the closing time it lost
+      log.Info('Restoring its Closing time and setting SpaceTime\'s clock', board = board.name)
+      manager.SetClosing(board, manager.closing_time)
+    else:
+      log.Info('Resetting Web API variables and setting SpaceTime\'s clock')
+      manager.Propagate(board, None)
+      manager.closing_time = None
+      UpdateDoorStatus(webApi, None)
+    state.Publish('boot', board = board.name)
     #Query SpaceTime's clock. Its response will trigger us to update it if necessary.
     st.GetTime(0)
     return
   else:
-    print('Serial message ignored: "' + msg.val + '"')
+    log.Debug('Serial message ignored: "' + str(msg.val) + '"')
+
+def ConfiguredSinks():
+  #Sinks besides the web APIs, from environment variables:
+  # SPACETIME_WEBHOOK      URL to POST every event to, as JSON
+  # SPACETIME_STATUS_FILE  file to keep the latest door status in, as JSON
+  sinks = []
+  if os.environ.get('SPACETIME_WEBHOOK'):
+    sinks.append(WebhookSink(os.environ['SPACETIME_WEBHOOK']))
+  if os.environ.get('SPACETIME_STATUS_FILE'):
+    sinks.append(FileSink(os.environ['SPACETIME_STATUS_FILE']))
+  return sinks
+
+def SnapshotState():
+  #What a warm restart needs (see setup()): what isvhsopen.com and the VHS
+  #API last got, or else what they had at startup, and each board's clock
+  web = dispatcher.LastDelivered('isvhsopen') if dispatcher != None else None
+  ip = dispatcher.LastDelivered('vhsapi') if dispatcher != None else None
+  return {
+    'isvhsopen': restored.get('isvhsopen') if web == None else {'closing_time': web['closing_time'], 'at': web['at']},
+    'vhsapi_ip': restored.get('vhsapi_ip') if ip == None else ip['ip'],
+    'boards': dict((b.name, {'closing_time': b.closing_time, 'current_time': b.current_time,
+      'last_sync': b.last_sync, 'drift': b.drift.Save()}) for b in manager.boards) }
+
+def CheckSnapshotState(saved):
+  #Snapshot check: raises KeyError or TypeError if saved lacks anything
+  #setup() takes up from it
+  for board in saved['boards'].values():
+    for key in ('closing_time', 'current_time', 'last_sync'):
+      board[key]
+    DriftModel().Restore(board['drift'])
+  if saved['isvhsopen'] != None:
+    saved['isvhsopen']['closing_time'], saved['isvhsopen']['at']
+
+def RestoreBoards(boards):
+  #Takes up each board's clock readings from the snapshot. Returns the
+  #boards it had some for.
+  warm = []
+  for board in boards:
+    saved = restored.get('boards', {}).get(board.name)
+    if saved != None and saved['last_sync'] != None:
+      board.drift.Restore(saved['drift'])
+      board.current_time, board.last_sync = saved['current_time'], saved['last_sync']
+      UpdateBoardState(board, time.time())
+      warm.append(board)
+  return warm
+
+def CheckConnectivity(web, dispatcher):
+  #Runs on its own thread from setup(): waits for the internet, then lets
+  #the web API updates queued in dispatcher meanwhile go out
+  log.Info('Connecting to the internet...')
+  web.WaitForConnect(connect_retry_max)
+  log.Info('Connected!')
+  startup.Reach('online')
+  dispatcher.SetOnline(True)
 
-def GetLocalIP():
-  #Returns the machine's local IP address as a string, or 'unknown' if error.
-  ip = 'unknown'
+def OnConnection(st, connected):
+  #SpaceTime.listeners handler. Once a board's serial port is back, asks it
+  #for its closing time and clock again, since either may have changed
+  #meanwhile (ex: set on its keypad, or it was reset). The replies are
+  #handled like the ones to setup()'s queries.
+  board = manager.Get(st)
+  UpdateBoardState(board, time.time())
+  if connected:
+    log.Info('Re-syncing SpaceTime after reconnecting', board = board.name, seconds = round(st.reconnectTime, 3))
+    st.GetTime(1) #Closing time is ID 1
+    st.GetTime(0) #Current time is ID 0
+    #Until it replies
+    ScheduleClockSync(st, time.time() + clock_sync_retry)
+
+def ConnectSerial(board):
+  #Runs on its own thread for each board from setup(). Returns whether the
+  #board answered within serial_connect_timeout. One that didn't is left to
+  #reconnect in the background, like a board whose port drops out later
+  #(see SpaceTime.Lost()), and OnConnection() catches it up once it answers.
+  st = board.st
+  if not st.connected:
+    return False #Its port couldn't be opened; it's already reconnecting
+  log.Info('Initializing Serial connection with SpaceTime (' + st.serial.name + ')...')
   try:
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.connect(('8.8.8.8', 80))
-    ip = s.getsockname()[0]
-    s.close()
-  except Exception as e:
-    print('IP lookup failed: ', e)
-  return ip
-
-def ShouldSyncClock():
-  #Sync the clock every 24h, and do it when we're around 
-  #40-50s in the current minute (to minimize the chance of the clock
-  #jumping back 1min or forward 2min).
-  _24h = 86400 #seconds in 24h
-  curTime = time.time()
-  if curTime - lastClockSync > _24h:
-    curTime = time.localtime(curTime)
-    if 40 < curTime.tm_sec < 50:
+    if st.IsConnected(timeout = serial_connect_timeout):
+      startup.Reach('serial')
       return True
+    error = 'No reply to AT'
+  except OSError as e:
+    error = e
+  log.Error('Failed to init Serial connection with SpaceTime. Carrying on without it.', board = board.name)
+  st.Lost(error)
   return False
+
+def OnDelivery(target, ok, attempts):
+  #Dispatcher.onResult handler
+  state.RecordDelivery(target, ok, attempts)
+  Record('delivery', attempts, target, ok)
+  if ok and target == 'isvhsopen':
+    startup.Reach('web_update')
+
+def setup(devices = None, web = None, vhs = None, port = None):
+  #Starts the webserver for the REST API, connects to SpaceTime Serial,
+  #queries SpaceTime's closing time and clock (to trigger an update upon
+  #its response), and updates the local IP address on VHS Api, all without
+  #waiting for the internet: that's checked in the background, and web API
+  #updates are queued until it's there. Time to each step is in /status.
+  #The boards are the devices listed in devices (see boards.py), or in the
+  #SPACETIME_DEVICES environment variable, or just /dev/ttyAMA0.
+  #web and vhs default to the live WebApi and VHSApi, and port to the one
+  #on the command line.
+  #After a restart, whatever the state snapshot (see snapshot.py) already
+  #has isn't asked or sent again: the IP if it's still the same, each
+  #board's clock and the door status if the board's closing time agrees.
+  #returns initialized (WebAPI, the first board's SpaceTime)
   
-def ShouldSendHeartbeat():
-  #Send a heartbeat to isvhsopen.com every 15min
-  _15min = 900 #seconds in 15min
-  curTime = time.time()
-  return (curTime - lastHeartbeat > _15min)
-
-def setup():
-  #Connects to the internet, updates local IP address 
-  #on VHS Api, connects to SpaceTime Serial, updates
-  #Web Api variables, and queries SpaceTime's clock
-  #(to trigger an update upon its response).
-  #returns initialized (WebAPI, SpaceTime)
-  
-  print('Initializing SpaceTime...')
-  vhs = VHSApi()
-  web = WebApi()
-  st = SpaceTime()
-
-  print('Connecting to the internet...')
-  web.WaitForConnect()
-  print('Connected!')
-  #Update the machine's local IP on the VHS Api. The timestamp can serve as a boot history.
-  vhs.Update(api_var_ip, GetLocalIP())
-  
-  print('Initializing Serial connection with SpaceTime (' + st.serial.name + ')...')
-  while not st.IsConnected():
-    print('Failed to init Serial connection with SpaceTime. Trying again...')
-  print('Initialized!')
+  log.Info('Initializing SpaceTime...')
+  global dispatcher, history, snapshot, restored, warm_door, ip_watcher
+  startup.onReached = lambda reached: state.Update(startup = reached)
+  vhs = vhs if vhs != None else VHSApi()
+  web = web if web != None else WebApi()
+  dispatcher = Dispatcher([WebApiSink(web), VHSApiSink(vhs, api_var_ip)] + ConfiguredSinks())
+  dispatcher.onResult = OnDelivery
+  dispatcher.SetOnline(False) #Until CheckConnectivity() says otherwise
+  dispatcher.Start()
+  if devices == None:
+    devices = ParseDevices(os.environ.get('SPACETIME_DEVICES') or default_devices)
+  boards = manager.Open(devices)
+  st = boards[0].st
+  if snapshot == None:
+    snapshot = Snapshot(os.environ.get('SPACETIME_SNAPSHOT') or default_snapshot, SnapshotState,
+      CheckSnapshotState)
+  for board in boards:
+    board.st.listeners.append(OnConnection)
+  restored = snapshot.Load(snapshot_max_age) or {}
+  warmClocks = RestoreBoards(boards)
+  if restored.get('isvhsopen') != None:
+    warm_door = (restored['isvhsopen']['closing_time'], restored['isvhsopen']['at'])
+    RestoreDoorStatus(web, *warm_door)
+  snapshot.Start()
+  state.listeners.append(lambda version: snapshot.Changed())
+  metrics.Gauge('sink_events_pending', 'Status updates waiting to be delivered to sinks', func = dispatcher.Depth)
+  metrics.Gauge('spacetime_commands_inflight', 'Commands sent to SpaceTime awaiting a reply',
+    func = lambda: sum(b.st.tracker.Pending() for b in manager.boards))
+  metrics.Gauge('spacetime_commands_queued', 'Commands waiting for room in SpaceTime\'s buffer',
+    func = lambda: sum(b.st.commands.Pending() for b in manager.boards))
+
+  log.Info('Initializing webserver for REST API (only available to LAN)')
+  if history == None:
+    history = EventLog(os.environ.get('SPACETIME_HISTORY') or default_history)
+  #Given the BoardManager, /set/ sets the closing time on every board
+  RestServ(manager, port, state = state, history = history)
+  startup.Reach('rest')
+
+  th = threading.Thread(target = CheckConnectivity, args = (web, dispatcher), name = 'connectivity')
+  th.daemon = True
+  th.start()
+  #Update the machine's local IP on the VHS Api now and whenever it changes,
+  #unless it already has it (see the snapshot)
+  if ip_watcher == None:
+    ip_watcher = IPWatcher(AddressSource(), lambda ip: dispatcher.Publish(IPEvent(ip)))
+  ip_watcher.last = restored.get('vhsapi_ip')
+  if not ip_watcher.Check() and ip_watcher.last != None:
+    avoided.Labels('vhsapi').Inc()
+  ip_watcher.Start()
   
-  print('Initializing webserver for REST API (only available to LAN)')
-  RestServ(st)
+  #All boards at once, so one that's slow to answer doesn't hold up the
+  #rest. Each gives up after serial_connect_timeout, and the boards that
+  #didn't answer are queried once they reconnect (see OnConnection()).
+  answered = []
+  def Connect(board):
+    if ConnectSerial(board):
+      answered.append(board)
+  threads = [threading.Thread(target = Connect, args = (board,)) for board in boards]
+  for th in threads:
+    th.daemon = True
+    th.start()
+  for th in threads:
+    th.join()
+  absent = [board for board in boards if board not in answered]
+  log.Info('Initialized!', absent = [board.name for board in absent])
   
   #Query Closing time (this is the only time we do this)
-  #in case RPi was rebooted but SpaceTime wasn't.
-  st.GetTime(1)    #Closing time is ID 1
-  st.Read()        #Ignore the echo of the GetTime command
-  ct = st.Read()   #Read the response
-  #It is an unlabeled time, but we know it should be Closing time
-  if ct.type == 'AmbiguousTime':
-    ct.type = 'Closing'
-    #Update Web Api if necessary
-    ProcessSerialMsg(ct, web, st)
-  
-  #Query SpaceTime's clock. Its response will trigger us to update it if necessary.
-  st.GetTime(0)  #Current time is ID 0
+  #in case RPi was rebooted but SpaceTime wasn't, and SpaceTime's clock.
+  #Both queries go out at once. Their replies are matched to them, so the
+  #Closing time reply is labelled 'Closing' and will update the Web Api, and
+  #the Current time reply will trigger us to update the clock if necessary.
+  #The replies are processed by loop() or run(). The first board's Closing
+  #time is passed on to the others.
+  #A board whose clock readings came from the snapshot is only asked for
+  #its clock if its Closing time isn't what the snapshot says (ex: it was
+  #reset meanwhile); otherwise its clock is checked when it's due.
+  present = [board for board in boards if board not in absent]
+  queries = []
+  for board in present:
+    queries.append(board.st.GetTime(1)) #Closing time is ID 1
+    if board not in warmClocks:
+      board.st.GetTime(0)               #Current time is ID 0
+  for board, closing in zip(present, queries):
+    reply = closing.Wait()
+    if reply == None:
+      log.Warning('SpaceTime did not reply to Closing time query', error = str(closing.error),
+        board = board.name)
+    if board in warmClocks:
+      if reply != None and reply.val == restored['boards'][board.name]['closing_time']:
+        ScheduleClockSync(board.st, max(time.time(), board.drift.NextCheck(board.last_sync)))
+        avoided.Labels('clock_query').Inc()
+      else:
+        board.st.GetTime(0)
+  #Until each board replies, keep asking for its clock, and send the door
+  #status we know (none yet). Replies push these back.
+  for board in boards:
+    if scheduler.When(board.Job('clock sync')) == None:
+      ScheduleClockSync(board.st, time.time() + clock_sync_retry)
+  if scheduler.When('heartbeat') == None:
+    scheduler.Schedule('heartbeat', time.time(), lambda: SendHeartbeat(web), interval = heartbeat_interval)
+  startup.Reach('ready')
+  log.Info('Ready', warm = bool(restored), board_clocks_restored = len(warmClocks))
   return web, st
 
 def loop(web, st):
-  #Check for new Serial messages every second.
   #If there is a Serial message to read, read and process it.
+  #Otherwise run the scheduled jobs that are due, and wait for serial data
+  #until the next one is (or for at most a second).
+  start = time.perf_counter()
   if st.CanRead():
     msg = st.Read()
     if dbg_showAllSerial:
-      dbgmsg = 'SerialDbg ' + msg.type + ': ' + str(msg.val)
-      print(dbgmsg if not dbgmsg.endswith('\r\n') else dbgmsg[:-2])
+      log.Debug('SerialDbg ' + msg.type + ': ' + str(msg.val).rstrip('\r\n'))
     ProcessSerialMsg(msg, web, st)
-  elif ShouldSyncClock():
-    #Query SpaceTime's clock. Its response will trigger us to update it if necessary.
-    st.GetTime(0)
-    #Give SpaceTime enough time to respond so that we only send one st.GetTime(0) per sync period.
-    time.sleep(0.5)
-  elif ShouldSendHeartbeat():
-    print('Sending Heartbeat to Web API...')
-    UpdateDoorStatus(web, doorStatus_cache);
+    loopSeconds.Labels('serial').Observe(time.perf_counter() - start)
   else:
-    time.sleep(1)
+    scheduler.RunDue()
+    st.tracker.Expire()
+    loopSeconds.Labels('jobs').Observe(time.perf_counter() - start)
+    due = scheduler.NextDeadline()
+    st.Pump(1 if due == None else min(1, max(0, due - time.time())))
+
+def run(web, st):
+  #Event-driven equivalent of calling loop() forever: serial messages are
+  #processed as soon as they arrive, and the process sleeps until the next
+  #message or the next clock sync/heartbeat is due.
+  def OnBoardMsg(msg, st):
+    if dbg_showAllSerial:
+      log.Debug('SerialDbg ' + msg.type + ': ' + str(msg.val).rstrip('\r\n'), board = manager.Get(st).name)
+    ProcessSerialMsg(msg, web, st)
+  OnMsg = lambda msg: OnBoardMsg(msg, st)
+  
+  #Runs the clock sync and heartbeat jobs set up by setup() and ProcessSerialMsg()
+  rt = Runtime(st, OnMsg, scheduler)
+  #Every other board is read by the same loop
+  for board in manager.Others(manager.Get(st)):
+    rt.Add(board.st, lambda msg, st = board.st: OnBoardMsg(msg, st))
+  rt.Run()
 
 def main():
-  #Run setup and then loop indefinitely
+  #Run setup and then process events indefinitely.
+  #Unhandled exceptions are caught and reported by the Runtime,
+  #which tries to keep going anyway.
+  if os.environ.get('SPACETIME_LOG'):
+    log.Open(os.environ['SPACETIME_LOG'])
   web, st = setup()
-  
-  #Loop indefinitely - Catch and report any unhandled exceptions,
-  #but try to keep going anyway.
-  while 1:
-    try:
-      loop(web, st)
-    except Exception as e:
-      print('Exception in main loop! ', e)
-      #Give some time for whatever caused the error to go away.
-      #Also don't want to flood a log file with identical exceptions.
-      time.sleep(5)
+  run(web, st)
 
 if __name__ == '__main__': 
   main()
@@ -0,0 +1,229 @@
+import threading
+from bisect import bisect_left
+from collections import deque
+
+#Counters, gauges and histograms for what this process does (serial traffic,
+#web API calls, the main loop), served in Prometheus text format by
+#restserv's /metrics.
+#Counters and histograms record a value by appending it to a deque, which
+#is thread-safe without a lock, and add them up when they're read or when
+#enough have piled up. That keeps recording well under a microsecond, so
+#metrics can stay on in the hot path: see bench_metrics.py.
+#Metrics are usually created once at the top of the module that records
+#them, in the default registry:
+#  serialMsgs = metrics.Counter('spacetime_serial_messages_total', 'Messages from SpaceTime', ('type',))
+#  serialMsgs.Labels('Current').Inc()
+
+latencyBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def EscapeLabel(val):
+  return str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def FormatValue(val):
+  if val == float('inf'):
+    return '+Inf'
+  if isinstance(val, float) and val.is_integer() and abs(val) < 1e15:
+    return str(int(val))
+  return repr(val)
+
+class Metric:
+  #Base for Counter, Gauge and Histogram. A metric with label names holds a
+  #child metric for each combination of label values (see Labels()); one
+  #without labels records values itself.
+  kind = None
+
+  def __init__(self, name, help, labels = (), registry = None):
+    #registry None is the default one; False doesn't register it anywhere
+    self.name = name
+    self.help = help
+    self.labelNames = tuple(labels)
+    self.labelValues = ()
+    self.lock = threading.Lock()
+    self.children = {} #Label values tuple -> child metric
+    self.pending = deque() #Values recorded but not added up yet (see Fold())
+    if registry is None:
+      registry = DefaultRegistry()
+    if registry is not False:
+      registry.Register(self)
+
+  def Labels(self, *values):
+    #The child metric for these label values, created on first use
+    child = self.children.get(values)
+    if child is None:
+      if len(values) != len(self.labelNames):
+        raise ValueError(self.name + ' has labels ' + str(self.labelNames))
+      with self.lock:
+        child = self.children.get(values)
+        if child is None:
+          child = self.NewChild()
+          child.labelNames = self.labelNames
+          child.labelValues = tuple(str(v) for v in values)
+          self.children[values] = child
+    return child
+
+  def NewChild(self):
+    return type(self)(self.name, self.help, registry = False)
+
+  def Fold(self):
+    #Adds up the pending values. Values recorded meanwhile are either added
+    #now or left for next time.
+    with self.lock:
+      pending = self.pending
+      for i in range(len(pending)):
+        self.Add(pending.popleft())
+
+  def LabelText(self, extra = ()):
+    pairs = list(zip(self.labelNames, self.labelValues)) + list(extra)
+    if not pairs:
+      return ''
+    return '{' + ','.join(n + '="' + EscapeLabel(v) + '"' for n, v in pairs) + '}'
+
+  def Series(self):
+    #The metrics that hold values: the children, or this one if unlabelled
+    if self.labelNames:
+      with self.lock:
+        return list(self.children.values())
+    return [self]
+
+  def Render(self):
+    out = ['# HELP ' + self.name + ' ' + self.help.replace('\\', '\\\\').replace('\n', '\\n'),
+      '# TYPE ' + self.name + ' ' + self.kind]
+    for series in self.Series():
+      out.extend(series.Samples())
+    return '\n'.join(out) + '\n'
+
+class Counter(Metric):
+  #A count that only goes up (ex: messages received)
+  kind = 'counter'
+  foldAt = 1024 #Pending increments that get added up right away
+
+  def __init__(self, name, help, labels = (), registry = None):
+    Metric.__init__(self, name, help, labels, registry)
+    self.value = 0
+
+  def Inc(self, amount = 1):
+    self.pending.append(amount)
+    if len(self.pending) > self.foldAt:
+      self.Fold()
+
+  def Add(self, amount):
+    #Called with self.lock held
+    self.value += amount
+
+  def Get(self):
+    self.Fold()
+    return self.value
+
+  def Samples(self):
+    return [self.name + self.LabelText() + ' ' + FormatValue(self.Get())]
+
+class Gauge(Metric):
+  #A value that can go up and down (ex: commands in flight). With func, the
+  #value is func() at the time it's served, so it costs nothing until then.
+  kind = 'gauge'
+
+  def __init__(self, name, help, labels = (), registry = None, func = None):
+    Metric.__init__(self, name, help, labels, registry)
+    self.value = 0
+    self.func = func
+
+  def Set(self, value):
+    self.value = value
+
+  def Inc(self, amount = 1):
+    with self.lock:
+      self.value += amount
+
+  def Dec(self, amount = 1):
+    self.Inc(-amount)
+
+  def Get(self):
+    return self.func() if self.func != None else self.value
+
+  def Samples(self):
+    try:
+      value = self.Get()
+    except Exception:
+      return [] #Not available right now (ex: the serial port is closed)
+    if value is None:
+      return []
+    return [self.name + self.LabelText() + ' ' + FormatValue(value)]
+
+class Histogram(Metric):
+  #Counts observations (ex: latencies in seconds) in fixed buckets, each
+  #with an upper bound, plus their count and sum.
+  kind = 'histogram'
+  foldAt = 1024 #Pending observations that get added up right away
+
+  def __init__(self, name, help, labels = (), registry = None, buckets = latencyBuckets):
+    Metric.__init__(self, name, help, labels, registry)
+    self.bounds = tuple(sorted(buckets))
+    self.counts = [0] * (len(self.bounds) + 1) #The last one is +Inf
+    self.sum = 0
+    self.count = 0
+
+  def NewChild(self):
+    return Histogram(self.name, self.help, registry = False, buckets = self.bounds)
+
+  def Observe(self, value):
+    self.pending.append(value)
+    if len(self.pending) > self.foldAt:
+      self.Fold()
+
+  def Add(self, value):
+    #Called with self.lock held
+    self.counts[bisect_left(self.bounds, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  def Get(self):
+    #Returns (bucket counts, sum, count); the last count is for +Inf
+    self.Fold()
+    with self.lock:
+      return list(self.counts), self.sum, self.count
+
+  def Samples(self):
+    counts, total, count = self.Get()
+    out = []
+    cumulative = 0
+    for bound, n in zip(self.bounds + (float('inf'),), counts):
+      cumulative += n
+      out.append(self.name + '_bucket' + self.LabelText([('le', FormatValue(float(bound)))])
+        + ' ' + str(cumulative))
+    out.append(self.name + '_sum' + self.LabelText() + ' ' + FormatValue(total))
+    out.append(self.name + '_count' + self.LabelText() + ' ' + str(count))
+    return out
+
+class Registry:
+  #The metrics served together by /metrics
+
+  contentType = 'text/plain; version=0.0.4; charset=utf-8'
+
+  def __init__(self):
+    self.metrics = {} #Name -> Metric
+    self.lock = threading.Lock()
+
+  def Register(self, metric):
+    #Replaces any metric with the same name (ex: a gauge read from a new
+    #SpaceTime object)
+    with self.lock:
+      self.metrics[metric.name] = metric
+
+  def Unregister(self, name):
+    with self.lock:
+      self.metrics.pop(name, None)
+
+  def Get(self, name):
+    return self.metrics.get(name)
+
+  def Render(self):
+    #Prometheus text exposition format
+    with self.lock:
+      metrics = sorted(self.metrics.values(), key = lambda m: m.name)
+    return ''.join(m.Render() for m in metrics)
+
+#Where metrics go unless they're given a registry
+registry = Registry()
+
+def DefaultRegistry():
+  return registry
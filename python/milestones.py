@@ -0,0 +1,41 @@
+import threading
+import time
+import metrics
+from logbuffer import log
+
+#How long startup took to get to each point that matters (ex: the first reply
+#from SpaceTime, the first update that reached isvhsopen.com), for /status,
+#/metrics and the log. Each milestone is only recorded the first time.
+#Usage:
+#  startup = Milestones()
+#  startup.Reach('serial')
+
+reachedSeconds = metrics.Gauge('spacetime_startup_seconds',
+  'Seconds from startup to each milestone, once reached', ('milestone',))
+
+class Milestones:
+  def __init__(self, start = None):
+    self.start = start if start != None else time.time()
+    self.reached = {}    #Milestone name -> seconds after start
+    self.lock = threading.Lock()
+    self.onReached = None #Called with a copy of self.reached after each new milestone
+
+  def Reach(self, name, when = None):
+    #Records milestone name as reached at when (default now), unless it
+    #already was. Returns whether it's new.
+    secs = round((when if when != None else time.time()) - self.start, 3)
+    with self.lock:
+      if name in self.reached:
+        return False
+      self.reached[name] = secs
+      reached = dict(self.reached)
+    reachedSeconds.Labels(name).Set(secs)
+    log.Info('Startup milestone reached', milestone = name, seconds = secs)
+    if self.onReached != None:
+      self.onReached(reached)
+    return True
+
+  def Get(self, name):
+    #Seconds after start that milestone name was reached, or None
+    with self.lock:
+      return self.reached.get(name)
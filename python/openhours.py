@@ -0,0 +1,186 @@
+import io
+import os
+import sys
+import time
+import numpy as np
+from vhsapi import VHSApi
+
+#How often and how long the space is open, from the history of the door
+#variable on the VHS API (see VHSApi.History()).
+#The history is kept as two NumPy arrays, the time of each change and
+#whether the space was open after it, and cached in a compressed .npz
+#file. Update() only adds the changes since the last one in the cache.
+#Everything else works on whole arrays, so years of history take
+#milliseconds.
+#To update the cache and print a summary from command line:
+#python openhours.py [cache file]
+
+hour = 3600
+#Upper bounds of the open-duration histogram's bins, in seconds
+durationBins = (0, hour / 2, hour, 2 * hour, 3 * hour, 4 * hour, 6 * hour, 8 * hour, 12 * hour, 24 * hour, np.inf)
+
+def IsOpen(value):
+  #Whether a door variable value means open
+  return str(value).strip().lower() in ('open', 'true', '1', 'yes')
+
+def LocalOffsets(times):
+  #UTC offset in seconds of local time at each of times. localtime() is
+  #only called once per day, and for every time on days that change it
+  #(ex: daylight saving time).
+  times = np.asarray(times, dtype = np.float64)
+  if times.size == 0:
+    return np.zeros(0)
+  days, index = np.unique(np.floor(times / 86400), return_inverse = True)
+  start = np.array([time.localtime(d * 86400).tm_gmtoff for d in days])
+  end = np.array([time.localtime(d * 86400 + 86399).tm_gmtoff for d in days])
+  offsets = start[index].astype(np.float64)
+  changing = (start != end)[index]
+  for i in np.flatnonzero(changing):
+    offsets[i] = time.localtime(times[i]).tm_gmtoff
+  return offsets
+
+def HourOfWeek(times):
+  #Local hour of the week (0 is Monday 00:00-01:00) of each of times
+  local = np.asarray(times, dtype = np.float64) + LocalOffsets(times)
+  #The Unix epoch was a Thursday, day 3 of a week starting on Monday
+  return ((np.floor(local / hour) + 3 * 24) % (7 * 24)).astype(np.int64)
+
+def TimeOfDay(times):
+  #Local seconds since midnight of each of times
+  return (np.asarray(times, dtype = np.float64) + LocalOffsets(times)) % 86400
+
+class History:
+  def __init__(self, times = None, states = None):
+    self.times = np.asarray(times if times is not None else [], dtype = np.float64)
+    self.states = np.asarray(states if states is not None else [], dtype = np.int8)
+
+  def Last(self):
+    #Time of the newest change, or None
+    return float(self.times[-1]) if self.times.size else None
+
+  def Append(self, times, states):
+    #Adds changes newer than the newest one
+    times = np.asarray(times, dtype = np.float64)
+    states = np.asarray(states, dtype = np.int8)
+    if self.times.size:
+      keep = times > self.times[-1]
+      times, states = times[keep], states[keep]
+    order = np.argsort(times, kind = 'stable')
+    self.times = np.concatenate([self.times, times[order]])
+    self.states = np.concatenate([self.states, states[order]])
+    return times.size
+
+  def Update(self, api, dataname = 'door'):
+    #Adds the changes since the newest one from api (a VHSApi). Returns how many.
+    times, states = [], []
+    for t, val in api.History(dataname, since = self.Last()):
+      times.append(t)
+      states.append(IsOpen(val))
+    return self.Append(times, states)
+
+  @classmethod
+  def Load(cls, path):
+    #An empty History if there's no cache file at path yet
+    if not os.path.exists(path):
+      return cls()
+    with np.load(path) as f:
+      return cls(f['times'], f['states'])
+
+  def Save(self, path):
+    #Replaces the file at path in one step, so a crash never leaves half a cache
+    buf = io.BytesIO()
+    np.savez_compressed(buf, times = self.times, states = self.states)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(buf.getvalue())
+    os.replace(tmp, path)
+
+  def Intervals(self, now = None):
+    #Returns (starts, ends) of each time the space was open. If it's open
+    #now, the last interval ends at now, or is left out without it.
+    keep = np.ones(self.states.size, dtype = bool)
+    keep[1:] = self.states[1:] != self.states[:-1] #Only actual changes
+    times, states = self.times[keep], self.states[keep]
+    opened = np.flatnonzero(states == 1)
+    closed = opened + 1
+    ongoing = closed == times.size
+    ends = times[np.minimum(closed, times.size - 1)] if times.size else times
+    ends = np.where(ongoing, np.inf if now is None else now, ends)
+    starts = times[opened]
+    if now is None:
+      starts, ends = starts[~ongoing], ends[~ongoing]
+    return starts, ends
+
+def DurationHistogram(starts, ends, bins = durationBins):
+  #Number of open intervals whose length falls in each bin (see durationBins)
+  return np.histogram(ends - starts, bins = bins)[0]
+
+def OpenBefore(edges, starts, ends):
+  #Total seconds open before each of edges, for sorted, non-overlapping intervals
+  if starts.size == 0:
+    return np.zeros(len(edges))
+  cumulative = np.concatenate([[0], np.cumsum(ends - starts)])
+  k = np.searchsorted(starts, edges, side = 'right') #Intervals started before each edge
+  last = np.maximum(k - 1, 0)
+  overshoot = np.where(k > 0, np.maximum(ends[last] - edges, 0), 0)
+  return cumulative[k] - overshoot
+
+def Heatmap(starts, ends):
+  #7x24 array (Monday first, local time) of the fraction of each hour of
+  #the week the space was open, over the whole history
+  grid = np.zeros((7, 24))
+  if starts.size == 0:
+    return grid
+  edges = np.arange(np.floor(starts[0] / hour) * hour, np.ceil(ends[-1] / hour) * hour + 1, hour)
+  openSecs = np.diff(OpenBefore(edges, starts, ends))
+  which = HourOfWeek(edges[:-1])
+  total = np.bincount(which, weights = openSecs, minlength = 7 * 24)
+  seen = np.bincount(which, minlength = 7 * 24) * hour
+  return (total / np.maximum(seen, 1)).reshape(7, 24)
+
+def LikelyClosing(starts, ends, opened, window = hour, sameWeekday = False):
+  #Predicts when the space will close if it opened at time opened, from the
+  #intervals that started within window seconds (of local time of day) of
+  #it, on any day or only the same weekday. Returns a dict with the median
+  #closing time and the 25th and 75th percentiles, or None without any.
+  if starts.size == 0:
+    return None
+  diff = np.abs(TimeOfDay(starts) - TimeOfDay([opened])[0])
+  match = np.minimum(diff, 86400 - diff) <= window
+  if sameWeekday:
+    match &= HourOfWeek(starts) // 24 == HourOfWeek([opened])[0] // 24
+  durations = (ends - starts)[match]
+  if durations.size == 0:
+    return None
+  q25, q50, q75 = np.percentile(durations, [25, 50, 75])
+  return {'closing': opened + q50, 'early': opened + q25, 'late': opened + q75,
+    'samples': int(durations.size)}
+
+def Summary(history):
+  starts, ends = history.Intervals()
+  durations = ends - starts
+  return {
+    'changes': int(history.times.size),
+    'openings': int(starts.size),
+    'open_hours': float(durations.sum() / hour),
+    'median_open_hours': float(np.median(durations) / hour) if durations.size else None,
+    'first': float(history.times[0]) if history.times.size else None,
+    'last': history.Last() }
+
+def main(path = 'door_history.npz'):
+  history = History.Load(path)
+  added = history.Update(VHSApi())
+  history.Save(path)
+  print(str(added) + ' new changes, ' + str(history.times.size) + ' in ' + path)
+  for k, v in sorted(Summary(history).items()):
+    print('%-18s %s' % (k, v))
+  starts, ends = history.Intervals()
+  print('Open for          count')
+  for lo, hi, n in zip(durationBins[:-1], durationBins[1:], DurationHistogram(starts, ends)):
+    print('%5.1fh - %5.1fh   %d' % (lo / hour, hi / hour, n))
+  print('% open    ' + ''.join('%3d' % h for h in range(24)))
+  for day, row in zip(('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'), Heatmap(starts, ends)):
+    print(day + '       ' + ''.join('%3d' % round(f * 100) for f in row))
+
+if __name__ == '__main__':
+  main(*sys.argv[1:])
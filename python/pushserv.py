@@ -0,0 +1,273 @@
+import asyncio
+import io
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote
+
+#HTTP server for the REST API that pushes door status changes to LAN clients
+#(ex: lobby displays) as they happen, instead of them polling isvhsopen.com:
+#  GET /events/stream         Server-Sent Events, one per transition
+#  GET /events?since=<ver>    Long-poll: the events after version <ver>,
+#                             waiting up to ?timeout= seconds for one
+#Versions are the StateStore's, so a client can GET /status and then ask for
+#everything since its version. SSE event ids are '<StateStore.id>-<version>',
+#so a client reconnecting after a restart is told what it missed instead of
+#resuming from a version of the old process. All connections, including idle subscribers,
+#are handled by one asyncio event loop, so hundreds of them don't need
+#hundreds of threads. Every other request is handed to a WSGI app (the
+#web.py app in restserv.py) on a small thread pool.
+
+class Request:
+  def __init__(self, method, target, version, headers, body = b''):
+    self.method = method
+    self.path, _, self.query = target.partition('?')
+    self.version = version
+    self.headers = headers #Lower case names
+    self.body = body
+
+  def Param(self, name, default = None):
+    vals = parse_qs(self.query).get(name)
+    return vals[0] if vals else default
+
+  def KeepAlive(self):
+    conn = self.headers.get('connection', '').lower()
+    if self.version == 'HTTP/1.0':
+      return conn == 'keep-alive'
+    return conn != 'close'
+
+def ParseHead(head):
+  #Returns a Request for the request line and headers, or None if malformed
+  lines = head.decode('latin-1').split('\r\n')
+  parts = lines[0].split(' ')
+  if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+    return None
+  headers = {}
+  for line in lines[1:]:
+    name, sep, val = line.partition(':')
+    if sep:
+      headers[name.strip().lower()] = val.strip()
+  return Request(parts[0], parts[1], parts[2], headers)
+
+class PushServer:
+  maxHead = 8192           #Longest request line and headers we accept
+  keepaliveInterval = 15   #Seconds between SSE comments that keep proxies from timing out
+  longPollTimeout = 30     #Default and maximum seconds a long-poll waits
+  retry = 3000             #Milliseconds SSE clients wait before reconnecting
+
+  def __init__(self, app, state, workers = 4):
+    #app is a WSGI application for requests other than /events.
+    #state is the StateStore whose events are pushed; None disables /events.
+    self.app = app
+    self.state = state
+    self.executor = ThreadPoolExecutor(workers)
+    self.loop = None
+    self.server = None
+    self.port = None
+    self.ready = threading.Event()
+    self.thread = None
+    self.changed = None      #asyncio.Event, replaced after it's set
+    self.subscribers = 0     #Connections waiting for events
+
+  def Run(self, host, port):
+    #Serves until Stop() is called. port 0 picks a free port (see self.port).
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.changed = asyncio.Event()
+    if self.state != None:
+      self.state.listeners.append(self.OnChange)
+    try:
+      self.server = self.loop.run_until_complete(asyncio.start_server(
+        self.Handle, host, port, limit = self.maxHead))
+      self.port = self.server.sockets[0].getsockname()[1]
+      self.ready.set()
+      self.loop.run_forever()
+    finally:
+      if self.state != None:
+        self.state.listeners.remove(self.OnChange)
+      if self.server != None:
+        self.server.close()
+      #Hang up on subscribers
+      tasks = asyncio.all_tasks(self.loop)
+      for task in tasks:
+        task.cancel()
+      self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions = True))
+      self.loop.close()
+      self.executor.shutdown(wait = False)
+
+  def Start(self, host = '127.0.0.1', port = 0):
+    #Runs the server in a background thread; returns once it's listening
+    self.thread = threading.Thread(target = self.Run, args = (host, port))
+    self.thread.daemon = True
+    self.thread.start()
+    self.ready.wait(5)
+    return self
+
+  def Stop(self):
+    #Can be called from any thread
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    if self.thread != None:
+      self.thread.join()
+
+  def OnChange(self, version):
+    #StateStore listener; called from whichever thread changed it
+    self.loop.call_soon_threadsafe(self.Wake)
+
+  def Wake(self):
+    #Wakes every waiting subscriber at once
+    self.changed.set()
+    self.changed = asyncio.Event()
+
+  async def WaitForChange(self, timeout, gone = None):
+    #Returns False if nothing changed within timeout seconds, or if gone
+    #(a task reading from the client) finished first: the client hung up
+    changed = self.loop.create_task(self.changed.wait())
+    done, pending = await asyncio.wait([changed] if gone == None else [changed, gone],
+      timeout = timeout, return_when = asyncio.FIRST_COMPLETED)
+    changed.cancel()
+    return changed in done
+
+  async def Handle(self, reader, writer):
+    #One connection, which may carry several requests (keep-alive)
+    try:
+      while True:
+        try:
+          head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+          await self.Respond(writer, '431 Request Header Fields Too Large', [], b'', False)
+          return
+        req = ParseHead(head[:-4])
+        if req == None:
+          await self.Respond(writer, '400 Bad Request', [], b'', False)
+          return
+        length = req.headers.get('content-length', '0')
+        req.body = await reader.readexactly(int(length)) if length.isdigit() else b''
+        keepAlive = req.KeepAlive()
+        if self.state != None and req.path == '/events/stream':
+          await self.Stream(req, reader, writer)
+          return
+        if self.state != None and req.path == '/events':
+          status, headers, body = await self.LongPoll(req)
+        else:
+          status, headers, body = await self.loop.run_in_executor(
+            self.executor, self.CallApp, req, writer.get_extra_info('peername'))
+        await self.Respond(writer, status, headers, body, keepAlive)
+        if not keepAlive:
+          return
+    except (asyncio.IncompleteReadError, ConnectionError):
+      pass
+    finally:
+      writer.close()
+
+  async def Respond(self, writer, status, headers, body, keepAlive):
+    out = ['HTTP/1.1 ' + status]
+    for name, val in headers:
+      if name.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+        out.append(name + ': ' + val)
+    out.append('Content-Length: ' + str(len(body)))
+    out.append('Connection: ' + ('keep-alive' if keepAlive else 'close'))
+    writer.write(('\r\n'.join(out) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+
+  def CallApp(self, req, peer):
+    #Runs on the thread pool. Returns (status, headers, body) from the WSGI app.
+    host = req.headers.get('host', 'localhost')
+    environ = {
+      'REQUEST_METHOD': req.method,
+      'SCRIPT_NAME': '',
+      'PATH_INFO': unquote(req.path),
+      'QUERY_STRING': req.query,
+      'SERVER_NAME': host.partition(':')[0],
+      'SERVER_PORT': str(self.port),
+      'SERVER_PROTOCOL': req.version,
+      'REMOTE_ADDR': peer[0] if peer else '',
+      'CONTENT_TYPE': req.headers.get('content-type', ''),
+      'CONTENT_LENGTH': str(len(req.body)),
+      'wsgi.version': (1, 0),
+      'wsgi.url_scheme': 'http',
+      'wsgi.input': io.BytesIO(req.body),
+      'wsgi.errors': sys.stderr,
+      'wsgi.multithread': True,
+      'wsgi.multiprocess': False,
+      'wsgi.run_once': False,
+    }
+    for name, val in req.headers.items():
+      if name not in ('content-type', 'content-length'):
+        environ['HTTP_' + name.upper().replace('-', '_')] = val
+    started = []
+    def StartResponse(status, headers, exc_info = None):
+      started[:] = [status, headers]
+    result = self.app(environ, StartResponse)
+    try:
+      body = b''.join(c if isinstance(c, bytes) else c.encode('utf-8') for c in result)
+    finally:
+      if hasattr(result, 'close'):
+        result.close()
+    return started[0], started[1], body
+
+  def EventsSince(self, req):
+    #The version the client has seen, from ?since= or an SSE reconnection.
+    #Without one, only events from now on. An id from another process (ex:
+    #before a restart) is -1: everything kept, and missed.
+    since = req.Param('since', req.headers.get('last-event-id'))
+    if since != None and '-' in since:
+      process, _, since = since.rpartition('-')
+      if process != self.state.id:
+        return -1
+    try:
+      return int(since)
+    except (TypeError, ValueError):
+      return self.state.version
+
+  async def LongPoll(self, req):
+    since = self.EventsSince(req)
+    try:
+      timeout = min(float(req.Param('timeout', self.longPollTimeout)), self.longPollTimeout)
+    except ValueError:
+      timeout = self.longPollTimeout
+    end = self.loop.time() + timeout
+    self.subscribers += 1
+    try:
+      while True:
+        version, events, missed = self.state.EventsSince(since)
+        remaining = end - self.loop.time()
+        if events or missed or remaining <= 0:
+          break
+        await self.WaitForChange(remaining)
+    finally:
+      self.subscribers -= 1
+    body = json.dumps({'version': version, 'events': events, 'missed': missed}, sort_keys = True)
+    return '200 OK', [('Content-Type', 'application/json'), ('Cache-Control', 'no-cache')], body.encode('ascii')
+
+  async def Stream(self, req, reader, writer):
+    #Server-Sent Events until the client goes away. Clients don't send
+    #anything more, so a read finishing means they hung up.
+    since = self.EventsSince(req)
+    gone = self.loop.create_task(reader.read(1))
+    writer.write(('HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+      'Cache-Control: no-cache\r\nConnection: close\r\n\r\n'
+      'retry: ' + str(self.retry) + '\r\n\r\n').encode('ascii'))
+    await writer.drain()
+    self.subscribers += 1
+    try:
+      while True:
+        version, events, missed = self.state.EventsSince(since)
+        out = ''
+        if missed:
+          #Some events were discarded before this client saw them
+          out += 'event: missed\r\ndata: {}\r\n\r\n'
+        for e in events:
+          out += 'id: ' + self.state.id + '-' + str(e['version']) + '\r\nevent: ' + e['type'] + '\r\ndata: ' \
+            + json.dumps(e, sort_keys = True) + '\r\n\r\n'
+        since = version
+        if not out and not await self.WaitForChange(self.keepaliveInterval, gone):
+          if gone.done():
+            return
+          out = ': keepalive\r\n\r\n'
+        if out:
+          writer.write(out.encode('ascii'))
+          await writer.drain()
+    finally:
+      gone.cancel()
+      self.subscribers -= 1
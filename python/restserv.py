@@ -1,50 +1,175 @@
 import web
+import json
+import sys
 import threading
-from timeutil import *
+import time
+from pushserv import PushServer
+from timeutil import ClockTime
+from eventlog import ParseTime, types as eventTypes
+import metrics
+from logbuffer import log
 
-#SpaceTime object, defined when RestServ() is called
+#SpaceTime or BoardManager object, defined when RestServ() is called
 spacetime = None
+#StateStore served by /status, defined when RestServ() is called
+statestore = None
+#EventLog served by /history, defined when RestServ() is called
+eventlog = None
+#Seconds /set/ waits for SpaceTime to confirm. A command that couldn't be
+#sent by then (ex: the serial port is reconnecting) is still sent later.
+commandTimeout = 5
   
 urls = (
   '/', 'index',
   r'/set/open/(\d\d?):?(\d\d)', 'setopen',
-  '/set/closed?/?', 'setclosed'
+  '/set/closed?/?', 'setclosed',
+  '/status/?', 'status',
+  '/metrics/?', 'metricsText',
+  '/log/?', 'logEntries',
+  '/history/?', 'history',
+  '/history/open/?', 'historyOpen'
 )
 
 #Initializes a webserver with a restful API to control the SpaceTime board.
 #Intended to be made available on the local VHS network, but not over the internet.
-#Parameter st should be an initialized SpaceTime object.
-def RestServ(st):
-  global spacetime
+#Parameter st should be an initialized SpaceTime object, or a BoardManager
+#(see boards.py) to set the closing time on all of its boards.
+#The port is taken from the command line (see README.md) unless one is given.
+#Parameter state is the StateStore to serve on /status, and history the
+#EventLog (see eventlog.py) to serve on /history.
+def RestServ(st, port = None, host = '0.0.0.0', state = None, history = None):
+  global spacetime, statestore, eventlog
   spacetime = st
-  th = RestServThread()
+  statestore = state
+  eventlog = history
+  th = RestServThread(port, host)
   th.daemon = True
   th.start()
 
 #The web server runs in a thread so that app.run() doesn't block all other execution.
 class RestServThread(threading.Thread):
+  def __init__(self, port = None, host = '0.0.0.0'):
+    threading.Thread.__init__(self)
+    self.port = port
+    self.host = host
+
   def run(self):
     app = web.application(urls, globals())
-    app.run()
+    if self.port == None:
+      #Same command line as app.run(): [host:]port, default 8080
+      self.host, self.port = web.validaddr(web.listget(sys.argv, 1, ''))
+    #Serves /events itself, and everything else through app
+    PushServer(app.wsgifunc(), statestore).Run(self.host, self.port)
 
 class index:
   def GET(self):
     return "SpaceTime REST API\r\n" \
        + "/set/open/15:30 - Sets SpaceTime to stay open until 15:30\r\n" \
-       + "/set/closed     - Sets SpaceTime to closed"
+       + "/set/closed     - Sets SpaceTime to closed\r\n" \
+       + "/status         - What we believe SpaceTime's state is, as JSON\r\n" \
+       + "/metrics        - Counters and latencies, in Prometheus text format\r\n" \
+       + "/log?since=0    - Recent log entries after seq 0, as JSON (&level=ERROR for errors only)\r\n" \
+       + "/history?from=2024-01-01&to=2024-02-01 - Events in that time, as JSON (&type=closing for one type)\r\n" \
+       + "/history/open?from=2024-01-01 - Hours open on each day since, as JSON\r\n" \
+       + "/events?since=1 - Waits for the space to open or close after /status version 1\r\n" \
+       + "/events/stream  - The same, as Server-Sent Events"
+
+def Confirmed(reply, requested):
+  #What SpaceTime says its closing time now is. A command replaced by a
+  #newer one before it was sent gets that one's reply, so this can differ
+  #from what was requested.
+  if reply.type != 'Closing':
+    return "SpaceTime set to " + requested + "."
+  return "SpaceTime set to " + (reply.val if reply.val != None else "closed") + "."
 
 class setopen:
   def GET(self, hours, mins):
     #Make a HH:MM:SS time string
     timestr = hours.zfill(2) + ":" + mins + ":00"
-    if IsTimeStr(timestr):
+    t = ClockTime.Parse(timestr)
+    if t != None:
       #Closing time is ID 1
-      spacetime.SetTime(1, StrToTime(timestr))
-      return "SpaceTime set to " + timestr + "."
+      reply = spacetime.SetTime(1, t).Wait(commandTimeout)
+      if reply == None:
+        return "SpaceTime did not confirm " + timestr + "."
+      return Confirmed(reply, timestr)
     return timestr + " is not a valid time."
 
 class setclosed:
   def GET(self):
     #Closing time is ID 1
-    spacetime.ClearTime(1)
-    return "SpaceTime set to closed."
\ No newline at end of file
+    reply = spacetime.ClearTime(1).Wait(commandTimeout)
+    if reply == None:
+      return "SpaceTime did not confirm closed."
+    return Confirmed(reply, "closed")
+
+class status:
+  def GET(self):
+    #Served from the StateStore's precomputed bytes; never asks SpaceTime
+    if statestore == None:
+      raise web.notfound()
+    etag, body = statestore.Body()
+    web.header('ETag', etag)
+    web.header('Cache-Control', 'no-cache')
+    if web.ctx.env.get('HTTP_IF_NONE_MATCH') == etag:
+      raise web.notmodified()
+    web.header('Content-Type', 'application/json')
+    return body
+
+class metricsText:
+  def GET(self):
+    web.header('Content-Type', metrics.registry.contentType)
+    web.header('Cache-Control', 'no-cache')
+    return metrics.registry.Render()
+
+class logEntries:
+  def GET(self):
+    #Entries from the log's ring buffer, newest last
+    params = web.input(since = '0', level = None)
+    try:
+      since = int(params.since)
+    except ValueError:
+      raise web.badrequest()
+    seq, entries, missed = log.EntriesSince(since, params.level)
+    web.header('Content-Type', 'application/json')
+    web.header('Cache-Control', 'no-cache')
+    return json.dumps({'seq': seq, 'entries': entries, 'missed': missed}, sort_keys = True)
+
+def HistoryRange(params):
+  #The from and to parameters of a /history request, as time.time()s.
+  #from defaults to a day before to, and to to now.
+  try:
+    end = ParseTime(params.to, time.time())
+    return ParseTime(getattr(params, 'from'), end - 86400), end
+  except ValueError:
+    raise web.badrequest()
+
+class history:
+  def GET(self):
+    #Events from the local history, oldest first
+    if eventlog == None:
+      raise web.notfound()
+    params = web.input(to = '', type = None, limit = '1000', **{'from': ''})
+    start, end = HistoryRange(params)
+    try:
+      limit = int(params.limit)
+    except ValueError:
+      raise web.badrequest()
+    if params.type != None and params.type not in eventTypes:
+      raise web.badrequest()
+    events = eventlog.Between(start, end, None if params.type == None else (params.type,), limit)
+    web.header('Content-Type', 'application/json')
+    web.header('Cache-Control', 'no-cache')
+    return json.dumps({'from': start, 'to': end, 'events': events}, sort_keys = True)
+
+class historyOpen:
+  def GET(self):
+    #Hours open on each local day, from the closing times in the local history
+    if eventlog == None:
+      raise web.notfound()
+    params = web.input(to = '', **{'from': ''})
+    start, end = HistoryRange(params)
+    days = eventlog.OpenHours(start, end)
+    web.header('Content-Type', 'application/json')
+    web.header('Cache-Control', 'no-cache')
+    return json.dumps({'days': [{'date': d, 'hours': h} for d, h in days]}, sort_keys = True)
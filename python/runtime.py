@@ -0,0 +1,152 @@
+import asyncio
+import time
+from scheduler import Scheduler
+import metrics
+from logbuffer import log
+
+loopSeconds = metrics.Histogram('spacetime_loop_seconds',
+  'Time the main loop spent handling serial messages or running due jobs, per wake-up',
+  ('event',), buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+class Runtime:
+  #Event-driven replacement for polling SpaceTime in a loop.
+  #The serial port's file descriptor is watched by the asyncio event loop,
+  #so each message is handled as soon as its line is complete, and the
+  #loop wakes for the scheduler's jobs only when the next one is actually
+  #due. While idle, the process sleeps in the event loop instead of waking
+  #every second.
+  #Several boards share the one loop (see Add() and boards.py): each
+  #port is just another file descriptor, so there's no thread per board.
+  #A board whose port is lost stops being watched until SpaceTime has
+  #reconnected it, then its new port is watched instead.
+
+  errorDelay = 5 #Seconds to stop reading serial after an unhandled exception
+
+  def __init__(self, st, handler, scheduler = None):
+    #st is an initialized SpaceTime object.
+    #handler is called with each SerialMsg received from SpaceTime.
+    #scheduler holds the jobs to run (see scheduler.py); jobs can be added
+    #to it from any thread, before or while the Runtime runs.
+    #More boards can be watched by the same loop with Add(); st can be None
+    #to only have those.
+    self.scheduler = scheduler if scheduler != None else Scheduler()
+    self.loop = asyncio.new_event_loop()
+    self.handle = None #Wakes the loop for the next job
+    self.boards = []   #(SpaceTime, handler, expiry job name, SpaceTime listener), in the order added
+    self.watched = {}  #id(SpaceTime) -> file descriptor being watched
+    self.st = st
+    if st != None:
+      self.Add(st, handler)
+
+  def Add(self, st, handler):
+    #Watches another SpaceTime board, calling handler with its messages.
+    #Call before Run().
+    job = 'expire commands' if not self.boards else 'expire commands ' + str(len(self.boards))
+    board = (st, handler, job, lambda st, connected: self.OnConnection(board, connected))
+    self.boards.append(board)
+    if self.st == None:
+      self.st = st
+
+  def Arm(self):
+    #Schedules a wake-up for the scheduler's next deadline
+    if self.handle != None:
+      self.handle.cancel()
+      self.handle = None
+    when = self.scheduler.NextDeadline()
+    if when != None:
+      self.handle = self.loop.call_later(max(0, when - time.time()), self.RunDue)
+
+  def RunDue(self):
+    start = time.perf_counter()
+    self.handle = None
+    self.scheduler.RunDue()
+    self.ScheduleExpiry()
+    self.Arm()
+    loopSeconds.Labels('jobs').Observe(time.perf_counter() - start)
+
+  def ScheduleExpiry(self, board = None):
+    #Gives up on commands SpaceTime never replied to, so they don't hold up
+    #the rest. Replies and new commands move the deadline, so it's updated
+    #after both. Without board, for every board.
+    for st, handler, job, listener in ([board] if board != None else self.boards):
+      self.scheduler.Schedule(job, st.tracker.NextExpiry(), st.tracker.Expire)
+
+  def OnReadable(self, board):
+    #Called by the event loop when a board's serial port has data for us
+    start = time.perf_counter()
+    st, handler, job, listener = board
+    try:
+      for msg in st.ReadAvailable():
+        handler(msg)
+    except Exception as e:
+      log.Error('Exception in main loop!', error = str(e))
+      #Give some time for whatever caused the error to go away.
+      #Also don't want to flood a log file with identical exceptions.
+      self.Unwatch(board)
+      self.loop.call_later(self.errorDelay, self.WatchSerial, board)
+    #Handling a message can queue commands for any board (ex: passing a
+    #closing time on)
+    self.ScheduleExpiry()
+    self.Arm()
+    loopSeconds.Labels('serial').Observe(time.perf_counter() - start)
+
+  def WatchSerial(self, board):
+    st = board[0]
+    self.Unwatch(board)
+    if not st.connected:
+      return #OnConnection() will when it's back
+    fd = st.fileno()
+    self.loop.add_reader(fd, self.OnReadable, board)
+    self.watched[id(st)] = fd
+    #Anything that arrived before we started watching won't wake us up
+    if st.CanRead():
+      self.loop.call_soon(self.OnReadable, board)
+
+  def Unwatch(self, board):
+    #The port may already be closed, so its old descriptor is used
+    fd = self.watched.pop(id(board[0]), None)
+    if fd != None:
+      self.loop.remove_reader(fd)
+
+  def OnConnection(self, board, connected):
+    #SpaceTime.listeners handler, called from any thread
+    self.loop.call_soon_threadsafe(self.WatchSerial if connected else self.Unwatch, board)
+
+  def OnSubmit(self):
+    #A command was queued, maybe from another thread
+    self.loop.call_soon_threadsafe(self.ScheduleExpiry)
+
+  def Run(self):
+    #Runs until Stop() is called.
+    #Replies to commands are read here, so ATCommand.Wait() mustn't read them.
+    for board in self.boards:
+      board[0].pumpOnWait = False
+      board[0].commands.onSubmit = self.OnSubmit
+      board[0].listeners.append(board[3])
+    self.scheduler.onChange = self.Wake
+    for board in self.boards:
+      self.WatchSerial(board)
+    self.ScheduleExpiry()
+    self.Arm()
+    try:
+      self.loop.run_forever()
+    finally:
+      for board in self.boards:
+        st, handler, job, listener = board
+        st.pumpOnWait = True
+        st.commands.onSubmit = None
+        st.listeners.remove(listener)
+        self.scheduler.Cancel(job)
+        self.Unwatch(board)
+      self.scheduler.onChange = None
+      if self.handle != None:
+        self.handle.cancel()
+        self.handle = None
+
+  def Wake(self):
+    #Re-arms for the scheduler's next deadline. Can be called from any thread.
+    self.loop.call_soon_threadsafe(self.Arm)
+
+  def Stop(self):
+    #Can be called from any thread
+    self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,134 @@
+import heapq
+import threading
+import time
+from logbuffer import log
+
+def InMinuteWindow(t, start = 41, end = 50):
+  #Returns the first time.time() at or after t whose local time is between
+  #start and end seconds into a minute (ex: to set SpaceTime's clock well
+  #away from a minute boundary, see ProcessSerialMsg in main.py)
+  sec = time.localtime(t).tm_sec + (t - int(t))
+  if start <= sec < end:
+    return t
+  if sec < start:
+    return t + start - sec
+  return t + 60 - sec + start
+
+class Job:
+  def __init__(self, name, action, when, interval = None, align = None):
+    self.name = name
+    self.action = action
+    self.when = when         #time.time() at which to run next
+    self.interval = interval #If set, runs again this many seconds after each run
+    self.align = align       #If set, maps a candidate time to the actual deadline
+    self.entry = None        #This job's current heap entry
+    self.lastRun = None
+    self.runs = 0
+
+class Scheduler:
+  #Runs named jobs at their deadlines. Jobs are kept in a heap ordered by
+  #deadline, so whoever runs the scheduler (the Runtime, or loop() in main.py)
+  #can sleep until exactly NextDeadline() instead of checking every job
+  #every second.
+  #Scheduling a job with the name of a pending one replaces it, so a job is
+  #rescheduled by scheduling it again (ex: the heartbeat is pushed back
+  #every time the door status is sent). Replaced and cancelled jobs are left
+  #in the heap and skipped when they reach the top.
+  #Can be used from any thread.
+
+  def __init__(self):
+    self.heap = []  #(when, seq, job)
+    self.jobs = {}  #name -> Job
+    self.seq = 0
+    self.lock = threading.RLock()
+    self.onChange = None #Called when the next deadline moved earlier (ex: to wake the Runtime)
+
+  def Schedule(self, name, when, action, interval = None, align = None):
+    #Schedules action() to run at time.time() when (or align(when)), and
+    #then every interval seconds if given. Replaces any pending job named
+    #name. when None just cancels it. Returns the Job.
+    #Callers pass a new lambda each time, so a pending job with the same
+    #deadline and interval is kept as it is, taking the new action.
+    if when == None:
+      self.Cancel(name)
+      return None
+    with self.lock:
+      old = self.jobs.get(name)
+      if old != None and old.when == (when if align == None else align(when)) and old.interval == interval:
+        old.action, old.align = action, align
+        return old #Nothing to move
+      job = Job(name, action, when, interval, align)
+      if old != None:
+        old.entry = None
+        job.lastRun, job.runs = old.lastRun, old.runs
+      self.jobs[name] = job
+      self.Push(job, when)
+    return job
+
+  def Reschedule(self, name, when):
+    #Moves pending job name to time.time() when. Returns False if there's no such job.
+    with self.lock:
+      job = self.jobs.get(name)
+      if job == None:
+        return False
+      if when == None:
+        self.Cancel(name)
+      else:
+        self.Push(job, when)
+      return True
+
+  def Cancel(self, name):
+    with self.lock:
+      job = self.jobs.pop(name, None)
+      if job != None:
+        job.entry = None
+
+  def Push(self, job, when):
+    #Called with self.lock held
+    if job.align != None:
+      when = job.align(when)
+    first = self.NextDeadline()
+    job.when = when
+    self.seq += 1
+    job.entry = (when, self.seq, job)
+    heapq.heappush(self.heap, job.entry)
+    if self.onChange != None and (first == None or when < first):
+      self.onChange()
+
+  def When(self, name):
+    #The deadline of job name, or None if it isn't scheduled
+    with self.lock:
+      job = self.jobs.get(name)
+      return job.when if job != None else None
+
+  def NextDeadline(self):
+    #The earliest deadline, or None if there are no jobs
+    with self.lock:
+      heap = self.heap
+      while heap and heap[0][2].entry is not heap[0]:
+        heapq.heappop(heap)
+      return heap[0][0] if heap else None
+
+  def RunDue(self, now = None):
+    #Runs the jobs whose deadline has passed. Returns how many ran.
+    #Jobs run without the lock held, so they can (re)schedule jobs themselves.
+    ran = 0
+    while True:
+      with self.lock:
+        t = time.time() if now == None else now
+        due = self.NextDeadline()
+        if due == None or due > t:
+          return ran
+        job = heapq.heappop(self.heap)[2]
+        job.entry = None
+        job.lastRun = t
+        job.runs += 1
+        if job.interval != None:
+          self.Push(job, t + job.interval)
+        else:
+          del self.jobs[job.name]
+      ran += 1
+      try:
+        job.action()
+      except Exception as e:
+        log.Error('Exception in scheduled job "' + job.name + '"!', error = str(e))
@@ -0,0 +1,139 @@
+import re
+
+CRLF = '\r\n'
+
+class SerialMsg:
+  def __init__(self, msgtype, msgval):
+    self.type = msgtype
+    self.val = msgval
+    self.command = None #The ATCommand this is a reply to, if any (see CommandTracker)
+
+#Everything SpaceTime can send us (see sw/serial.c, sw/clock.c and sw/main.c).
+#Each entry is a line prefix and the handler that turns a matching line into a
+#SerialMsg. Lines are matched by their first byte, then by the longest prefix.
+#Message types:
+# Current, Closing (a labelled time, val is 'HH:MM:SS' or None if not set)
+# AmbiguousTime (reply to ATSTn?, which doesn't say which clock it refers to)
+# OK, Error, Busy (command results, val is the full line)
+# Echo (SpaceTime echoes all AT commands we send to it)
+# Boot (SpaceTime says 'SpaceTime, yay!' on boot/reset), Banner ('*** BOOTED ***' before it)
+# Help (the lines printed in reply to AT?)
+# Unknown (for any other serial message)
+#For types without a time, val = the full line received, with CRLF.
+
+timeRe = re.compile(rb'([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]')
+
+def LabelledTime(line):
+  #'Closing time: HH:MM:SS' or 'Current time: Not set'
+  #Both 'Current' and 'Closing' are 7 chars long, followed by ' time: '
+  val = line[14:]
+  if val == b'Not set':
+    return SerialMsg(line[:7].decode('ascii'), None)
+  if timeRe.fullmatch(val):
+    return SerialMsg(line[:7].decode('ascii'), val.decode('ascii'))
+  return Unknown(line)
+
+def BareTime(line):
+  if timeRe.fullmatch(line):
+    return SerialMsg('AmbiguousTime', line.decode('ascii'))
+  return Unknown(line)
+
+def NotSet(line):
+  #Reply to ATSTn? for a clock that isn't set
+  if line == b'Not set':
+    return SerialMsg('AmbiguousTime', None)
+  return Unknown(line)
+
+def Whole(msgtype):
+  #Handler for messages whose val is the whole line
+  def Handler(line):
+    return SerialMsg(msgtype, line.decode('ascii', 'replace') + CRLF)
+  return Handler
+
+def Exact(msgtype, text):
+  #Handler for messages that must match text exactly
+  def Handler(line):
+    if line == text:
+      return SerialMsg(msgtype, line.decode('ascii') + CRLF)
+    return Unknown(line)
+  return Handler
+
+Unknown = Whole('Unknown')
+
+prefixes = [
+  (b'OK', Whole('OK')),
+  (b'AT', Whole('Echo')),
+  (b'at', Whole('Echo')),
+  (b'ERROR', Whole('Error')),
+  (b'BUSY', Whole('Busy')),
+  (b'Current time: ', LabelledTime),
+  (b'Closing time: ', LabelledTime),
+  (b'Not set', NotSet),
+  (b'SpaceTime, yay!', Exact('Boot', b'SpaceTime, yay!')),
+  (b'*** BOOTED ***', Exact('Banner', b'*** BOOTED ***')),
+  (b'SpaceTime commands:', Whole('Help')),
+  (b'  AT', Whole('Help')),
+  (b'For drift correction', Whole('Help')),
+]
+#Replies to ATSTn? are a bare time, whose hour starts with 0, 1 or 2
+for d in b'012':
+  prefixes.append((bytes([d]), BareTime))
+
+#First byte -> [(prefix, handler)], longest prefixes first
+dispatch = {}
+for prefix, handler in sorted(prefixes, key = lambda p: -len(p[0])):
+  dispatch.setdefault(prefix[0], []).append((prefix, handler))
+
+def ParseLine(line):
+  #Returns the SerialMsg for one line (bytes, without line ending)
+  for prefix, handler in dispatch.get(line[0], ()):
+    if line.startswith(prefix):
+      return handler(line)
+  return Unknown(line)
+
+class SerialParser:
+  #Incremental parser for the bytes SpaceTime sends us.
+  #Feed() it whatever has been read, in chunks of any size, and it returns a
+  #SerialMsg for every line completed so far. Partial lines are kept in a
+  #reusable buffer until the rest arrives. Lines may end with CR, LF or both,
+  #so a lost CR or LF doesn't merge two messages, and blank lines are skipped.
+
+  maxLine = 128   #Longer lines are noise; SpaceTime never sends more than ~80 chars
+  cacheSize = 256 #SpaceTime repeats itself a lot (OK, echoes), so results are cached
+
+  def __init__(self):
+    self.buf = bytearray()
+    self.cache = {} #line -> (type, val)
+
+  def Reset(self):
+    #Discards any partial line
+    del self.buf[:]
+
+  def Feed(self, data):
+    buf = self.buf
+    buf += data
+    #Everything up to the last line ending is complete
+    end = max(buf.rfind(b'\n'), buf.rfind(b'\r')) + 1
+    msgs = []
+    if end:
+      cache = self.cache
+      for line in bytes(buf[:end]).replace(b'\r', b'\n').split(b'\n'):
+        if not line:
+          continue
+        hit = cache.get(line)
+        if hit == None:
+          if len(line) > self.maxLine:
+            msg = Unknown(line)
+          else:
+            msg = ParseLine(line)
+            if len(cache) >= self.cacheSize:
+              cache.clear()
+            cache[line] = (msg.type, msg.val)
+          msgs.append(msg)
+        else:
+          msgs.append(SerialMsg(*hit))
+      del buf[:end]
+    if len(buf) > self.maxLine:
+      msgs.append(Unknown(bytes(buf)))
+      del buf[:]
+    return msgs
@@ -0,0 +1,368 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from httpclient import HttpClient
+from logbuffer import log
+import metrics
+
+#Where status changes go: isvhsopen.com, the VHS API, and anything else that
+#wants them (a webhook, a file for signage, a message queue).
+#Each of those is a Sink. A Dispatcher delivers every event published to it
+#to all the sinks that take it, from a small pool of worker threads, so a
+#slow or unreachable sink never holds up the serial port or the other sinks.
+#Events are dicts with a 'type':
+#  {'type': 'door', 'status': 'open', 'until': '21:30', 'closing_time': '21:30:00', 'at': ...}
+#  {'type': 'door', 'status': 'closed', 'until': None, 'closing_time': None, 'at': ...}
+#  {'type': 'ip', 'ip': '10.0.0.2', 'at': ...}
+#Usage:
+#  d = Dispatcher([WebApiSink(WebApi()), FileSink('/run/spacetime/status.json')])
+#  d.Start()
+#  d.Publish(DoorEvent('21:30:00'))
+
+deliverySeconds = metrics.Histogram('sink_delivery_seconds',
+  'Time taken to deliver an event to a sink, by sink', ('sink',))
+deliveryLatency = metrics.Histogram('sink_event_latency_seconds',
+  'Time from publishing an event to its delivery, including queueing and retries, by sink', ('sink',))
+deliveries = metrics.Counter('sink_deliveries_total',
+  'Delivery attempts, by sink and result (ok, failed, timeout)', ('sink', 'result'))
+discarded = metrics.Counter('sink_dropped_total',
+  'Events not delivered because a sink\'s queue was full, by sink', ('sink',))
+
+def DoorEvent(closing_time):
+  #The event for a closing time ('HH:MM:SS', or None if closed)
+  if closing_time == None:
+    return {'type': 'door', 'status': 'closed', 'until': None, 'closing_time': None, 'at': time.time()}
+  return {'type': 'door', 'status': 'open', 'until': closing_time[:5], 'closing_time': closing_time,
+    'at': time.time()}
+
+def IPEvent(ip):
+  return {'type': 'ip', 'ip': ip, 'at': time.time()}
+
+class Sink:
+  #Base for everything a Dispatcher delivers to. Subclasses set name and
+  #implement Deliver().
+  name = None
+  events = None     #Event types it takes, or None for all of them
+  coalesce = False  #Only the latest event matters (ex: the door status), so
+                    #an undelivered one is replaced by the next
+  timeout = 10      #Seconds a delivery may take before it counts as failed
+  network = False   #Needs the internet, so waits while the Dispatcher is offline
+  maxlen = 100      #Undelivered events kept before the oldest are dropped
+
+  def Accepts(self, event):
+    return self.events == None or event['type'] in self.events
+
+  def Deliver(self, event):
+    #Delivers event, giving up after self.timeout. Returns False or raises
+    #on failure.
+    raise NotImplementedError
+
+  def RetryAt(self):
+    #After a failure, time.time() before which retrying is pointless (ex:
+    #its circuit breaker is open), or None
+    return None
+
+class WebApiSink(Sink):
+  #The door status on isvhsopen.com (see webapi.py)
+  name = 'isvhsopen'
+  events = ('door',)
+  coalesce = True
+  network = True
+
+  def __init__(self, web):
+    self.web = web
+    self.timeout = web.timeout
+
+  def Deliver(self, event):
+    if event['status'] == 'closed':
+      return self.web.Update('closed')
+    return self.web.Update('open', event['until'])
+
+  def RetryAt(self):
+    return self.web.breaker.RetryAt()
+
+class VHSApiSink(Sink):
+  #This machine's local IP in a VHS API variable (see vhsapi.py). It's only
+  #written if it holds something else, so its timestamp is when it changed.
+  name = 'vhsapi'
+  events = ('ip',)
+  coalesce = True
+  network = True
+
+  def __init__(self, vhs, dataname = 'spacetime_ip'):
+    self.vhs = vhs
+    self.dataname = dataname
+    #UpdateIfNecessary() makes up to two calls: a Query, then an Update
+    self.timeout = 2 * vhs.timeout
+
+  def Deliver(self, event):
+    return self.vhs.UpdateIfNecessary(self.dataname, event['ip'])
+
+  def RetryAt(self):
+    return self.vhs.breaker.RetryAt()
+
+class WebhookSink(Sink):
+  #POSTs every event as JSON to url
+  network = True
+
+  def __init__(self, url, timeout = 5, name = 'webhook', events = None):
+    self.url = url
+    self.timeout = timeout
+    self.name = name
+    self.events = events
+    self.http = HttpClient(1)
+
+  def Deliver(self, event):
+    r = self.http.Post(self.url, data = json.dumps(event, sort_keys = True),
+      headers = {'Content-Type': 'application/json'}, timeout = self.timeout)
+    if not 200 <= r.status_code < 300:
+      log.Error('Webhook delivery failed', url = self.url, status = r.status_code)
+      return False
+    return True
+
+class FileSink(Sink):
+  #Keeps the latest door status in a JSON file (ex: for signage to read).
+  #The file is replaced in one step, so readers never see half of it.
+  #Unlike the others it has no timeout of its own: a write that hangs (ex: a
+  #dying SD card) ties up its worker until it returns.
+  name = 'file'
+  events = ('door',)
+  coalesce = True
+
+  def __init__(self, path, name = 'file'):
+    self.path = path
+    self.name = name
+
+  def Deliver(self, event):
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(event, f, sort_keys = True)
+    os.replace(tmp, self.path)
+    return True
+
+class QueueSink(Sink):
+  #Stand-in for a message queue: events are put on self.queue, in order, for
+  #a consumer to Get(). Delivery fails if the queue stays full for timeout.
+  name = 'queue'
+
+  def __init__(self, maxsize = 1000, timeout = 1, name = 'queue', events = None):
+    self.queue = queue.Queue(maxsize)
+    self.timeout = timeout
+    self.name = name
+    self.events = events
+
+  def Deliver(self, event):
+    try:
+      self.queue.put(event, timeout = self.timeout)
+    except queue.Full:
+      return False
+    return True
+
+  def Get(self, timeout = None):
+    #The next event, or None after timeout
+    try:
+      return self.queue.get(timeout = timeout)
+    except queue.Empty:
+      return None
+
+class Pending:
+  #An event waiting to be delivered to one sink
+  def __init__(self, event):
+    self.event = event
+    self.queued = time.time()  #When it, or the oldest one it replaced, was published
+    self.attempts = 0
+    self.nextAttempt = 0       #Don't retry before this time
+
+class SinkQueue:
+  #A sink and the events waiting for it, oldest first
+  def __init__(self, sink):
+    self.sink = sink
+    self.pending = deque()
+    self.busy = False  #A worker is delivering to it
+    self.delivered = 0
+    self.failed = 0    #Failed attempts, including ones that were retried
+    self.dropped = 0
+    self.last = None   #The last event delivered
+    self.seconds = deliverySeconds.Labels(sink.name)
+    self.latency = deliveryLatency.Labels(sink.name)
+
+class Dispatcher:
+  #Delivers events to sinks from a bounded pool of worker threads.
+  #Each sink has its own queue, and only one worker delivers to a sink at a
+  #time, so every sink gets its events in the order they were published,
+  #and a sink that hangs only ever ties up one worker: the others carry on
+  #with the rest. A sink that coalesces only gets the latest event.
+  #Failed deliveries are retried with jittered exponential backoff, ahead of
+  #the sink's later events, until they succeed or are replaced. A delivery
+  #that returns after the sink's timeout counts as failed unless it
+  #succeeded: the sink itself is expected to give up on time (ex: its HTTP
+  #timeout), since a thread can't be interrupted.
+  #While offline (see SetOnline()), sinks that need the internet keep their
+  #events queued instead of failing and backing off, and get them as soon
+  #as it's back.
+
+  def __init__(self, sinks = (), workers = 4, backoffMin = 1, backoffMax = 300):
+    self.workers = workers
+    self.backoffMin = backoffMin
+    self.backoffMax = backoffMax
+    self.queues = [] #SinkQueue for each sink, in the order added
+    self.cond = threading.Condition()
+    self.threads = []
+    self.running = False
+    self.online = True
+    self.onResult = None #Called with (sink name, ok, attempts) after each delivery attempt
+    for sink in sinks:
+      self.Add(sink)
+
+  def Add(self, sink):
+    with self.cond:
+      if any(q.sink.name == sink.name for q in self.queues):
+        raise ValueError('Already have a sink named ' + sink.name)
+      self.queues.append(SinkQueue(sink))
+
+  def Sink(self, name):
+    for q in self.queues:
+      if q.sink.name == name:
+        return q.sink
+    return None
+
+  def SetOnline(self, online):
+    #Holds (False) or releases (True) the events for sinks that need the
+    #internet. Released ones are delivered right away, whatever their backoff.
+    with self.cond:
+      self.online = online
+      if online:
+        for q in self.queues:
+          if q.sink.network and q.pending:
+            q.pending[0].nextAttempt = 0
+      self.cond.notify_all()
+
+  def Publish(self, event):
+    #Queues event for every sink that takes it. Never blocks on a sink.
+    with self.cond:
+      for q in self.queues:
+        if not q.sink.Accepts(event):
+          continue
+        item = Pending(event)
+        if q.sink.coalesce and q.pending:
+          #Keep the original queue time so OldestAge() stays honest
+          item.queued = q.pending[0].queued
+          q.pending.clear()
+        elif len(q.pending) >= q.sink.maxlen:
+          q.pending.popleft()
+          q.dropped += 1
+          discarded.Labels(q.sink.name).Inc()
+          log.Warning('Sink queue full, dropping its oldest event', sink = q.sink.name)
+        q.pending.append(item)
+      self.cond.notify_all()
+
+  def Depth(self):
+    #Number of events waiting to be delivered, over all sinks
+    with self.cond:
+      return sum(len(q.pending) for q in self.queues)
+
+  def OldestAge(self):
+    #Seconds since the oldest undelivered event was published, or 0 if none
+    with self.cond:
+      queued = [q.pending[0].queued for q in self.queues if q.pending]
+      return time.time() - min(queued) if queued else 0
+
+  def Stats(self, name):
+    #(delivered, failed attempts, dropped) for the sink called name
+    with self.cond:
+      for q in self.queues:
+        if q.sink.name == name:
+          return q.delivered, q.failed, q.dropped
+    return None
+
+  def LastDelivered(self, name):
+    #The last event delivered to the sink called name, or None
+    with self.cond:
+      for q in self.queues:
+        if q.sink.name == name:
+          return q.last
+    return None
+
+  def Backoff(self, attempts):
+    #Full jitter: a random delay up to the exponential backoff
+    delay = min(self.backoffMax, self.backoffMin * 2 ** (attempts - 1))
+    return random.uniform(self.backoffMin, max(self.backoffMin, delay))
+
+  def Next(self):
+    #Waits for a sink that nobody is delivering to, with an event that is
+    #due, and claims it. Returns (SinkQueue, Pending), or (None, None) if
+    #the Dispatcher was stopped.
+    with self.cond:
+      while self.running:
+        now = time.time()
+        due = None
+        for q in self.queues:
+          if q.busy or not q.pending or (q.sink.network and not self.online):
+            continue
+          item = q.pending[0]
+          if item.nextAttempt <= now:
+            q.busy = True
+            q.pending.popleft()
+            return q, item
+          if due == None or item.nextAttempt < due:
+            due = item.nextAttempt
+        self.cond.wait(None if due == None else due - now)
+      return None, None
+
+  def Deliver(self, q, item):
+    sink = q.sink
+    item.attempts += 1
+    start = time.time()
+    try:
+      ok = sink.Deliver(item.event) != False
+    except Exception as e:
+      log.Error('Delivery to "' + sink.name + '" failed', error = str(e))
+      ok = False
+    elapsed = time.time() - start
+    q.seconds.Observe(elapsed)
+    timedOut = not ok and elapsed >= sink.timeout
+    deliveries.Labels(sink.name, 'ok' if ok else 'timeout' if timedOut else 'failed').Inc()
+    if ok:
+      q.latency.Observe(time.time() - item.queued)
+    if self.onResult != None:
+      self.onResult(sink.name, ok, item.attempts)
+    with self.cond:
+      q.busy = False
+      if ok:
+        q.delivered += 1
+        q.last = item.event
+      else:
+        q.failed += 1
+        if not (sink.coalesce and q.pending):
+          #Retried before anything published since; unless it coalesces
+          #and a newer event already replaces it
+          item.nextAttempt = max(time.time() + self.Backoff(item.attempts), sink.RetryAt() or 0)
+          q.pending.appendleft(item)
+      self.cond.notify_all()
+
+  def Run(self):
+    while True:
+      q, item = self.Next()
+      if item == None:
+        return
+      self.Deliver(q, item)
+
+  def Start(self):
+    self.running = True
+    for i in range(self.workers):
+      th = threading.Thread(target = self.Run, name = 'dispatcher-' + str(i))
+      th.daemon = True
+      th.start()
+      self.threads.append(th)
+
+  def Stop(self):
+    with self.cond:
+      self.running = False
+      self.cond.notify_all()
+    for th in self.threads:
+      th.join()
+    self.threads = []
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+import metrics
+from logbuffer import log
+
+#Warm restarts: what this process knows that a restart would otherwise have
+#to find out again by asking SpaceTime and posting to the web APIs (what
+#isvhsopen.com and the VHS API last got, each board's clock drift), kept in
+#a small JSON file.
+#A background thread rewrites it soon after every change (see Changed()),
+#so the serial port never waits on the SD card. It's written to a temporary
+#file that then replaces it in one step, so a crash or power cut leaves the
+#old or the new one, never half of either.
+#main.setup() only trusts a snapshot that is recent (see Load()), and only
+#the parts SpaceTime's own replies agree with. One it can't use (ex: from an
+#older version, or cut short) means a cold start, never a failed one.
+#Usage:
+#  snap = Snapshot('/var/lib/spacetime/state.json', collect, check)
+#  saved = snap.Load(maxAge = 1800)
+#  snap.Start()
+#  state.listeners.append(lambda version: snap.Changed())
+
+writes = metrics.Counter('snapshot_writes_total', 'State snapshots written, for warm restarts')
+avoided = metrics.Counter('warm_restart_calls_avoided_total',
+  'Calls not made at startup because the state snapshot already had the answer, by call', ('call',))
+
+class Snapshot:
+  version = 1        #Of the file's format; a file of another one is ignored
+  minInterval = 0.5  #Seconds between writes
+
+  def __init__(self, path, collect, check = None):
+    self.path = path
+    self.collect = collect #Returns the state to save, as JSON-able data
+    #If set, raises KeyError, TypeError or ValueError for a state that lacks
+    #something its user needs
+    self.check = check
+    self.cond = threading.Condition()
+    self.dirty = False
+    self.running = False
+    self.thread = None
+    self.last = None       #JSON of the state last written
+
+  def Load(self, maxAge, now = None):
+    #The state saved, if it was saved less than maxAge seconds ago, or None
+    now = time.time() if now == None else now
+    try:
+      with open(self.path) as f:
+        saved = json.load(f)
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError) as e:
+      log.Warning('State snapshot unreadable, starting cold', path = self.path, error = str(e))
+      return None
+    if not isinstance(saved, dict) or saved.get('version') != self.version:
+      log.Warning('State snapshot of another version, starting cold', path = self.path)
+      return None
+    try:
+      age = now - saved['saved_at']
+      state = saved['state']
+      if self.check != None:
+        self.check(state)
+    except (KeyError, TypeError, ValueError) as e:
+      log.Warning('State snapshot incomplete, starting cold', path = self.path, error = repr(e))
+      return None
+    if not 0 <= age < maxAge:
+      log.Info('State snapshot too old, starting cold', age = round(age))
+      return None
+    log.Info('State snapshot loaded', age = round(age, 1))
+    return state
+
+  def Save(self):
+    #Writes the state now, unless it's what was last written. Returns
+    #whether it wrote.
+    state = self.collect()
+    body = json.dumps(state, sort_keys = True)
+    if body == self.last:
+      return False
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({'version': self.version, 'saved_at': time.time(), 'state': state}, f, sort_keys = True)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp, self.path)
+    self.last = body
+    writes.Inc()
+    return True
+
+  def Changed(self):
+    #Something in the state changed: it's saved soon. Only hands the news
+    #over, so it can be a StateStore listener.
+    with self.cond:
+      self.dirty = True
+      self.cond.notify()
+
+  def Run(self):
+    while True:
+      with self.cond:
+        while self.running and not self.dirty:
+          self.cond.wait()
+        if not self.running:
+          return
+        self.dirty = False
+      try:
+        self.Save()
+      except Exception as e:
+        log.Error('State snapshot write failed', path = self.path, error = str(e))
+      time.sleep(self.minInterval)
+
+  def Start(self):
+    if self.thread != None:
+      return
+    self.running = True
+    self.thread = threading.Thread(target = self.Run, name = 'snapshot')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Stop(self):
+    #Stops the thread, after writing any change it hadn't yet
+    with self.cond:
+      self.running = False
+      self.cond.notify()
+    if self.thread != None:
+      self.thread.join()
+      self.thread = None
+    with self.cond:
+      dirty, self.dirty = self.dirty, False
+    if dirty:
+      self.Save()
@@ -1,35 +1,152 @@
 import serial
+import select
+import threading
 import time
-from timeutil import *
+from collections import deque
+from serialparser import SerialMsg, SerialParser, CRLF
+from atcommand import ATCommand, CommandTracker, CommandQueue
+import metrics
+from logbuffer import log
 
-CRLF = '\r\n'
-  
-class SerialMsg:
-  def __init__(self, msgtype, msgval):
-    self.type = msgtype
-    self.val = msgval
+ENCODING = 'ascii'
 
+serialMsgs = metrics.Counter('spacetime_serial_messages_total',
+  'Messages received from SpaceTime, by type (see serialparser.py)', ('type',))
+serialBytes = metrics.Counter('spacetime_serial_read_bytes_total', 'Bytes read from SpaceTime')
+disconnects = metrics.Counter('spacetime_serial_disconnects_total',
+  'Times a SpaceTime serial port failed or went away, by device', ('device',))
+reconnectSeconds = metrics.Histogram('spacetime_serial_reconnect_seconds',
+  'Time from losing a SpaceTime serial port to it answering again', buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+  
 class SpaceTime:
   #See Serial protocol for communicating with SpaceTime at:
   #https://github.com/BruceFletcher/SpaceTime/blob/master/sw/serial.c
+  #If the serial port fails or goes away (ex: a loose UART, or a USB adapter
+  #re-enumerating), it's reopened in the background, retrying with
+  #backoff, until SpaceTime answers the IsConnected() handshake again.
+  #Meanwhile commands are queued, and the ones that weren't answered are
+  #sent again once it's back (see CommandQueue.Pause()). Listeners are told
+  #when it's lost and when it's back. A port that can't be opened at all
+  #(ex: the board isn't plugged in yet) is treated the same way.
   BAUD = 57600
+  reconnectMin = 0.1  #Seconds before the first attempt to reopen, doubling after each
+  reconnectMax = 5    #Longest wait between attempts
   
   def __init__(self, serialDeviceName = '/dev/ttyAMA0'):
-    self.serial = serial.Serial(serialDeviceName, self.BAUD, timeout=1)
+    self.device = serialDeviceName
+    try:
+      self.serial = serial.Serial(serialDeviceName, self.BAUD, timeout=1)
+      openError = None
+    except OSError as e:
+      #Not opened, but still named after the device
+      self.serial = serial.Serial(None, self.BAUD, timeout=1)
+      self.serial.port = serialDeviceName
+      openError = e
+    self.connected = True
+    self.closed = False    #Close() was called: don't reconnect
+    self.lostAt = None     #time.time() the port was last lost
+    self.reconnectTime = None #Seconds the last reconnect took
+    #Called with (self, connected) when the port is lost (False) or back
+    #(True), from whichever thread noticed, or the reconnecting thread
+    self.listeners = []
+    self.stateLock = threading.Lock()
+    #Parses received bytes into SerialMsgs
+    self.parser = SerialParser()
+    #Messages parsed but not returned by Read() or ReadAvailable() yet
+    self.msgs = deque()
+    #Matches replies to the commands we sent
+    self.tracker = CommandTracker(self.PumpForCommand)
+    #True if ATCommand.Wait() may read the serial port itself. The Runtime
+    #clears this while its event loop is doing the reading.
+    self.pumpOnWait = True
+    self.readLock = threading.Lock()
+    self.writeLock = threading.Lock()
+    #All commands are written by this queue, one batch at a time
+    self.commands = CommandQueue(self.WriteCommand, self.tracker)
+    if openError != None:
+      self.Lost(openError)
+  
+  def fileno(self):
+    #File descriptor of the serial port, so an event loop can watch it for
+    #input. It changes when the port is reopened.
+    return self.serial.fileno()
+
+  def Lost(self, error):
+    #The serial port failed: stop using it and reconnect in the background
+    with self.stateLock:
+      if not self.connected or self.closed:
+        return
+      self.connected = False
+      self.lostAt = time.time()
+    disconnects.Labels(self.device).Inc()
+    log.Error('Lost the serial connection with SpaceTime. Reconnecting...', device = self.device, error = str(error))
+    self.commands.Pause()
+    for listener in self.listeners:
+      listener(self, False)
+    try:
+      self.serial.close()
+    except OSError:
+      pass
+    th = threading.Thread(target = self.Reconnect, name = 'reconnect ' + self.device)
+    th.daemon = True
+    th.start()
+
+  def Reconnect(self):
+    #Reopens the serial port until SpaceTime answers, then sends what was
+    #queued meanwhile
+    delay = self.reconnectMin
+    while True:
+      time.sleep(delay)
+      delay = min(delay * 2, self.reconnectMax)
+      if self.closed:
+        return
+      try:
+        with self.readLock:
+          self.serial = serial.Serial(self.device, self.BAUD, timeout=1)
+          if self.IsConnected(timeout = 1):
+            break
+        self.serial.close()
+      except OSError as e:
+        log.Debug('SpaceTime serial port not back yet', device = self.device, error = str(e))
+    with self.stateLock:
+      self.connected = True
+      self.reconnectTime = time.time() - self.lostAt
+    reconnectSeconds.Observe(self.reconnectTime)
+    log.Info('Reconnected to SpaceTime', device = self.device, seconds = round(self.reconnectTime, 3))
+    self.commands.Resume()
+    for listener in self.listeners:
+      listener(self, True)
+
+  def Close(self):
+    #Closes the serial port for good
+    with self.stateLock:
+      self.closed = True
+    self.serial.close()
   
   def ClearSerial(self):
     #Clear the local Serial buffers as well as SpaceTime's buffer
     
     #Send a newline to ensure SpaceTime buffer is emptied
-    self.serial.write(CRLF)
+    self.serial.write(CRLF.encode(ENCODING))
     self.serial.flush()      #Ensure the CRLF is sent
     time.sleep(0.25)         #Give SpaceTime some time to respond
     self.serial.flushOutput()#Discard any data in the out buffer
     self.serial.flushInput() #Discard any data in the input buffer
+    self.parser.Reset()
+    self.msgs.clear()
+    self.tracker.Clear()
     
   def CanRead(self):
     #Checks whether there is serial data waiting to be read from SpaceTime
-    return self.serial.inWaiting() > 0
+    if len(self.msgs) > 0:
+      return True
+    if not self.connected:
+      return False
+    try:
+      return self.serial.inWaiting() > 0
+    except OSError as e:
+      self.Lost(e)
+      return False
     
   def IsConnected(self, timeout = 10, writedelay = 0.25):
     #Queries SpaceTime over Serial connection and waits for proper acknowledgement.
@@ -39,10 +156,10 @@ class SpaceTime:
     start_time = time.time()
     while 1:
       #'AT' should trigger SpaceTime to respond with 'OK'
-      self.serial.write('AT' + CRLF)
-      while self.CanRead():
+      self.serial.write(('AT' + CRLF).encode(ENCODING))
+      while self.serial.inWaiting() > 0:
         #Check if received value is expected acknowledgement from SpaceTime
-        if self.serial.readline() == 'OK' + CRLF:
+        if self.ReadLine() == 'OK' + CRLF:
           #We have verified the serial connection!
           self.ClearSerial()
           return True;
@@ -52,65 +169,107 @@ class SpaceTime:
       #Add small delay between writes in case SpaceTime is offline or busy
       time.sleep(writedelay)
       
+  def ReadLine(self):
+    #Returns the next raw line received from SpaceTime, including its CRLF,
+    #bypassing the parser. Blocks for up to the serial timeout, and may
+    #return a partial line.
+    return self.serial.readline().decode(ENCODING, 'replace')
+  
+  def Pump(self, timeout = 0):
+    #Reads whatever serial data arrives within timeout seconds (at least one
+    #byte if timeout > 0), matches the messages to our commands and queues
+    #them for Read() and ReadAvailable().
+    if not self.connected:
+      time.sleep(timeout)
+      return 0
+    with self.readLock:
+      try:
+        n = self.serial.inWaiting()
+        if n == 0:
+          readable = select.select([self.serial.fileno()], [], [], timeout)[0]
+          n = self.serial.inWaiting()
+          if readable and n == 0:
+            #Readable with nothing to read: read() will say why (ex: the device is gone)
+            n = 1
+        data = self.serial.read(n) if n > 0 else b''
+      except OSError as e:
+        data = b''
+        self.Lost(e)
+      if data:
+        serialBytes.Inc(len(data))
+      for msg in self.parser.Feed(data):
+        self.msgs.append(self.tracker.Feed(msg))
+        serialMsgs.Labels(msg.type).Inc()
+      return len(data)
+  
+  def PumpForCommand(self, timeout):
+    #Used by ATCommand.Wait() to read replies when nobody else is
+    if not self.pumpOnWait or not self.connected:
+      return False
+    self.Pump(timeout)
+    return True
+  
   def Read(self):
-    #Returns a SerialMsg with type as 'Current' or 'Closing' time, and
-    #val as a struct_time or None if time is cleared. Other types:
-    # AmbiguousTime (for time queries that reply without clock name. Similar to above.)
-    # OK (for 'OK' response)
-    # AT Command Echo (for our commands that were echoed back by SpaceTime)
-    # Boot (for the message that SpaceTime sends upon startup)
-    # Unknown (for any other serial message)
-    #For all of these, val = the full message received
-    
-    data = self.serial.readline()
-    if data.startswith('OK'):
-      return SerialMsg('OK', data)
-    elif data.startswith('AT'):
-      #SpaceTime echoes all AT Commands that we sent to it
-      return SerialMsg('Echo', data)
-    elif data.startswith('Closing time: ') or data.startswith('Current time: '):
-      msgtype = data[:7]    #Both 'Current' and 'Closing' are 7 chars long
-      timeval = None
-      if not data.endswith('Not set' + CRLF):
-        timeval = data[14:-2] #Refers to all the text after 'Closing time: ' and before \r\n
-      return SerialMsg(msgtype, timeval)
-      
-    #SpaceTime says this on boot/reset
-    elif data == 'SpaceTime, yay!' + CRLF:
-      return SerialMsg('Boot', data)
-    #If we query SpaceTime for a particular clock's time, it returns with
-    #either 'Not set' or an 'HH:MM:SS' time, but no label specifying which
-    #clock it refers to.
-    elif data.startswith('Not set'):
-      return SerialMsg('AmbiguousTime', None)
-    else:
-      if IsTimeStr(data[0:-2]): #[0:-2] removes the \r\n
-        return SerialMsg('AmbiguousTime', data[0:-2])
-      return SerialMsg('Unknown', data)
+    #Returns the next SerialMsg from SpaceTime (see serialparser.py).
+    #Blocks for up to the serial timeout waiting for a complete line,
+    #and returns an 'Unknown' message with val '' if none arrives.
+    if not self.msgs:
+      deadline = time.time() + (self.serial.timeout or 0)
+      while not self.msgs:
+        remaining = deadline - time.time()
+        if self.Pump(max(remaining, 0)) == 0 and remaining <= 0:
+          break
+      if not self.msgs:
+        return SerialMsg('Unknown', '')
+    return self.msgs.popleft()
+  
+  def ReadAvailable(self):
+    #Returns a list of SerialMsg for every complete line waiting to be read,
+    #without blocking. Partial lines are kept until the rest arrives.
+    self.Pump()
+    msgs = []
+    while self.msgs:
+      msgs.append(self.msgs.popleft())
+    return msgs
       
-  def SerialCommand(self, cmd):
-    #Sends serial command to SpaceTime
-    self.serial.write(cmd + CRLF)
+  def WriteCommand(self, cmd):
+    #Called by the CommandQueue; use SerialCommand() instead
+    with self.writeLock:
+      try:
+        self.serial.write((cmd.text + CRLF).encode(ENCODING))
+      except OSError as e:
+        #Pauses the queue, which sends cmd again once reconnected
+        self.Lost(e)
   
-  def SetTime(self, clockID, timestruct):
+  def SerialCommand(self, cmd, timeout = None):
+    #Sends serial command to SpaceTime. Returns an ATCommand handle that
+    #collects SpaceTime's reply; call its Wait() to get the reply.
+    #Safe to call from any thread. Commands can be pipelined: their replies
+    #are matched in order. If the command has to wait for room in SpaceTime's
+    #buffer, a newer command for the same clock replaces it (see CommandQueue).
+    return self.commands.Submit(ATCommand(cmd, timeout))
+  
+  def SetTime(self, clockID, clocktime, timeout = None, hundredths = False):
     #ATST<n>=04:23:11
-    #Triggers SpaceTime to set selected clock's time and return it, ex:
+    #Triggers SpaceTime to set selected clock's time (a ClockTime) and return it, ex:
     # Current time: hh:mm:ss\r\n
     # OK\r\n
-    t = TimeToStr(timestruct)
-    self.SerialCommand('ATST' + str(clockID) + '=' + t)
+    #With hundredths, sends ATST<n>=04:23:11.25, which SpaceTime also uses
+    #for drift correction (see AT? on the board).
+    return self.SerialCommand('ATST' + str(clockID) + '=' + clocktime.Format(hundredths), timeout)
   
-  def GetTime(self, clockID):
+  def GetTime(self, clockID, timeout = None):
     #ATST<n>?
-    #Triggers SpaceTime to return selected clock's time, ex:
-    # Current time: hh:mm:ss\r\n
-    # OK\r\n
-    self.SerialCommand('ATST' + str(clockID) + '?')
+    #Triggers SpaceTime to return selected clock's time, without a label or OK:
+    # hh:mm:ss\r\n
+    #The reply is relabelled with the clock's name (ex: 'Current') when it's
+    #matched to the returned ATCommand.
+    return self.SerialCommand('ATST' + str(clockID) + '?', timeout)
   
-  def ClearTime(self, clockID):
+  def ClearTime(self, clockID, timeout = None):
     #ATST<n>=X
     #Triggers SpaceTime to clear clock's time, ex:
     # Closing time: Not set\r\n
     # OK\r\n
-    self.SerialCommand('ATST' + str(clockID) + '=X')
+    return self.SerialCommand('ATST' + str(clockID) + '=X', timeout)
   
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+class StateStore:
+  #What this process currently believes about SpaceTime and the web APIs,
+  #so it can be served (ex: by restserv's /status) without touching the
+  #serial port or the network.
+  #Every change bumps the version and re-renders the JSON body once, so
+  #reads only hand out precomputed bytes. The ETag is made from the version
+  #and a random id for this process, so it changes whenever the body does,
+  #including across restarts.
+  #Fields:
+  # current_time   SpaceTime's clock when it last reported it ('HH:MM:SS' or None)
+  # closing_time   SpaceTime's closing time ('HH:MM:SS', or None if closed)
+  # last_sync      time.time() when SpaceTime last reported its clock
+  # last_heartbeat time.time() when the door status was last sent to isvhsopen.com
+  # last_delivery  result of the last delivery to a sink (see sinks.py): target, ok, attempts, at
+  # clock          SpaceTime's clock drift, as estimated by drift.py
+  # boards         the above for each board, by name (see boards.py)
+  # startup        seconds from startup to each milestone reached (see main.setup())
+  #Transitions worth pushing to clients (ex: the space opening) are also
+  #kept as events, numbered with the version they created, so a client that
+  #has seen version N can ask for everything since (see pushserv.py).
+
+  fields = ('current_time', 'closing_time', 'last_sync', 'last_heartbeat', 'last_delivery', 'clock', 'boards', 'startup')
+
+  def __init__(self, maxEvents = 100):
+    self.cond = threading.Condition()
+    self.id = os.urandom(4).hex()
+    self.version = 0
+    self.state = dict((f, None) for f in self.fields)
+    self.events = deque(maxlen = maxEvents) #Most recent events, oldest first
+    self.lost = 0        #Version of the newest event that no longer fits in events
+    self.listeners = []  #Called with the new version after every change
+    self.Render()
+
+  def Render(self):
+    #Called with self.cond held
+    doc = dict(self.state)
+    doc['version'] = self.version
+    self.body = json.dumps(doc, sort_keys = True).encode('ascii')
+    self.etag = '"' + self.id + '-' + str(self.version) + '"'
+
+  def Update(self, **changes):
+    #Sets the given fields. Returns the new version, which only changes if
+    #a value did.
+    with self.cond:
+      changed = False
+      for name, val in changes.items():
+        if name not in self.state:
+          raise KeyError('Unknown state field: ' + name)
+        if self.state[name] != val:
+          self.state[name] = val
+          changed = True
+      if changed:
+        self.Changed()
+      return self.version
+
+  def Changed(self):
+    #Called with self.cond held. Listeners can be called from any thread, so
+    #they should only hand the news over (ex: loop.call_soon_threadsafe).
+    self.version += 1
+    self.Render()
+    self.cond.notify_all()
+    for listener in self.listeners:
+      listener(self.version)
+
+  def Publish(self, eventType, **data):
+    #Records an event (ex: 'closing', 'boot') and returns its version
+    with self.cond:
+      if len(self.events) == self.events.maxlen:
+        self.lost = self.events[0]['version']
+      event = dict(data)
+      event.update(type = eventType, version = self.version + 1, at = time.time())
+      self.events.append(event)
+      self.Changed()
+      return self.version
+
+  def EventsSince(self, since):
+    #Returns (version, events newer than version since, missed), where missed
+    #is True if some of the events since then were already discarded.
+    #Versions start again from 0 in every process, so a since from the future
+    #is from before a restart: all the events kept are news, and the ones
+    #between the two processes are missed.
+    with self.cond:
+      if since > self.version:
+        since = -1
+      return self.version, [e for e in self.events if e['version'] > since], since < self.lost
+
+  def Get(self, name):
+    with self.cond:
+      return self.state[name]
+
+  def Snapshot(self):
+    #Returns (version, copy of all fields)
+    with self.cond:
+      return self.version, dict(self.state)
+
+  def Body(self):
+    #Returns (ETag, JSON bytes) for the current version
+    with self.cond:
+      return self.etag, self.body
+
+  def RecordDelivery(self, target, ok, attempts = 1):
+    #Dispatcher.onResult handler (see sinks.py)
+    self.Update(last_delivery = {'target': target, 'ok': ok, 'attempts': attempts, 'at': time.time()})
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import random
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+#A local stand-in for the isvhsopen.com Web API and the VHS API, for tests
+#and benchmarks that shouldn't touch the live servers. It understands the
+#requests made by WebApi and VHSApi (see webapi.py and vhsapi.py):
+#  GET  /api/status/
+#  POST /api/status/open and /api/status/closed
+#  GET  /s/vhs/data/<dataname>.json
+#  GET  /s/vhs/data/<dataname>/update?value=<datavalue>
+#  POST /hook, with a JSON body, for webhooks (see sinks.py)
+#Connections are kept alive (HTTP/1.1) so connection reuse can be measured.
+#Like the real server, GET replies have an ETag, and a GET with a matching
+#If-None-Match is answered with 304 Not Modified.
+#Replies can be delayed, made to fail at random, or replaced with responses
+#recorded from the real servers (see LoadRecording).
+
+class StubHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  wbufsize = -1  #Send each response in one write, flushed after the request
+  disable_nagle_algorithm = True
+
+  def log_message(self, format, *args):
+    pass #Keep test and benchmark output quiet
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    self.server.stub.OnConnect(self.connection)
+
+  def finish(self):
+    BaseHTTPRequestHandler.finish(self)
+    self.server.stub.OnDisconnect(self.connection)
+
+  def Reply(self, code, obj, etag = False):
+    body = json.dumps(obj).encode('utf-8')
+    tag = None
+    if etag and code == 200:
+      tag = 'W/"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+      if self.headers.get('If-None-Match') == tag:
+        code, body = 304, b''
+    self.send_response(code)
+    if tag != None:
+      self.send_header('ETag', tag)
+    if code != 304:
+      self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    url = urlparse(self.path)
+    self.Reply(*self.server.stub.Handle('GET', url.path, parse_qs(url.query)), etag = True)
+
+  def do_POST(self):
+    url = urlparse(self.path)
+    n = int(self.headers.get('Content-Length', 0))
+    body = self.rfile.read(n).decode('utf-8')
+    if self.headers.get('Content-Type') == 'application/json':
+      form = {'json': [body]}
+    else:
+      form = parse_qs(body)
+    self.Reply(*self.server.stub.Handle('POST', url.path, form))
+
+def IsoNow():
+  return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+
+def MakeCert(directory):
+  #Creates a self-signed certificate for localhost, returns (certfile, keyfile).
+  #Point REQUESTS_CA_BUNDLE at certfile so requests trusts it.
+  certfile = os.path.join(directory, 'stub.crt')
+  keyfile = os.path.join(directory, 'stub.key')
+  subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+    '-days', '1', '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+    '-keyout', keyfile, '-out', certfile], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+  return certfile, keyfile
+
+class StubServer:
+  def __init__(self, port = 0, certfile = None, keyfile = None, apiKey = 'ISVHSOPEN_API_KEY',
+               delay = 0, failureRate = 0, seed = None):
+    #port 0 picks a free port. If certfile is given, the server speaks HTTPS.
+    #delay is added to every request, in seconds. failureRate is the
+    #probability of answering a request with a 500 error.
+    self.apiKey = apiKey
+    self.delay = delay
+    self.failureRate = failureRate
+    self.random = random.Random(seed)
+    self.recorded = {}       #'METHOD path' -> (status code, json object)
+    self.log = []            #(time.time() when answered, method, path, status code)
+    self.status = {'status': 'closed', 'last': IsoNow()}
+    self.data = {}           #VHS API variables: dataname -> value
+    self.hooks = []          #JSON bodies POSTed to /hook
+    self.requests = 0        #Requests handled
+    self.connections = 0     #Connections accepted
+    self.open = set()        #Sockets currently connected
+    self.lock = threading.Lock()
+    self.httpd = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    self.httpd.daemon_threads = True
+    self.httpd.stub = self
+    scheme = 'http'
+    if certfile != None:
+      ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+      ctx.load_cert_chain(certfile, keyfile)
+      self.httpd.socket = ctx.wrap_socket(self.httpd.socket, server_side = True)
+      scheme = 'https'
+    host = 'localhost' if certfile != None else '127.0.0.1'
+    self.url = scheme + '://' + host + ':' + str(self.httpd.server_address[1])
+    #Base URLs to pass to WebApi(dataURL = ...) and VHSApi(dataURL = ...)
+    self.webURL = self.url + '/api/status/'
+    self.vhsURL = self.url + '/s/vhs/data/'
+    self.thread = None
+
+  def Start(self):
+    self.thread = threading.Thread(target = self.httpd.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    return self
+
+  def Stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+    self.DropConnections()
+
+  def OnConnect(self, sock):
+    with self.lock:
+      self.connections += 1
+      self.open.add(sock)
+
+  def OnDisconnect(self, sock):
+    with self.lock:
+      self.open.discard(sock)
+
+  def DropConnections(self):
+    #Closes all kept-alive connections from the server side, leaving
+    #clients holding stale connections in their pools.
+    with self.lock:
+      socks = list(self.open)
+    for s in socks:
+      try:
+        s.shutdown(2)
+      except OSError:
+        pass
+
+  def LoadRecording(self, filename):
+    #Loads recorded responses from a json file in the format:
+    #{"GET /api/status/": {"code": 200, "body": {...}}, ...}
+    #Recorded responses are replayed instead of the stub's own.
+    with open(filename) as f:
+      for key, r in json.load(f).items():
+        self.recorded[key] = (r['code'], r['body'])
+
+  def Handle(self, method, path, params):
+    #Returns (status code, json object) for a request
+    if self.delay:
+      time.sleep(self.delay)
+    with self.lock:
+      self.requests += 1
+      if self.failureRate and self.random.random() < self.failureRate:
+        reply = 500, {'error': 'Internal Server Error'}
+      elif method + ' ' + path in self.recorded:
+        reply = self.recorded[method + ' ' + path]
+      else:
+        reply = self.Route(method, path, params)
+      self.log.append((time.time(), method, path, reply[0]))
+      return reply
+
+  def Route(self, method, path, params):
+    if path == '/api/status/' and method == 'GET':
+      return 200, self.status
+    if path in ('/api/status/open', '/api/status/closed') and method == 'POST':
+      if params.get('key', [''])[0] != self.apiKey:
+        return 401, {'result': 'error', 'message': 'Invalid key'}
+      status = path.rsplit('/', 1)[1]
+      if status != self.status['status'] or status == 'open':
+        self.status = {'status': status, 'last': IsoNow()}
+        if status == 'open':
+          #until is local time today, sent back in UTC
+          until = time.strptime(params.get('until', [''])[0], '%H:%M')
+          t = time.mktime(time.localtime()[:3] + (until.tm_hour, until.tm_min, 0, 0, 0, -1))
+          self.status['openUntil'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(t))
+      reply = {'result': 'ok'}
+      reply.update(self.status)
+      return 200, reply
+    if path == '/hook' and method == 'POST':
+      self.hooks.append(json.loads(params['json'][0]))
+      return 200, {'result': 'ok'}
+    if path.startswith('/s/vhs/data/') and method == 'GET':
+      name = path[len('/s/vhs/data/'):]
+      if name.endswith('/update'):
+        name = name[:-len('/update')]
+        value = params.get('value', [''])[0]
+        self.data[name] = value
+        return 200, {'status': 'OK', 'result': {'name': name, 'value': value, 'last_updated': int(time.time())}}
+      if name.endswith('.json') and name[:-5] in self.data:
+        name = name[:-5]
+        return 200, {'name': name, 'value': self.data[name], 'last_updated': int(time.time())}
+    return 404, {'error': 'Not found'}
@@ -0,0 +1,229 @@
+import unittest
+import os
+import select
+import threading
+import time
+from serialparser import SerialParser
+from atcommand import ATCommand, CommandTracker, CommandQueue
+
+#To run these unit tests from command line:
+#python -m unittest test_atcommand
+
+class TestCommandTracker(unittest.TestCase):
+
+  def setUp(self):
+    self.parser = SerialParser()
+    self.tracker = CommandTracker()
+
+  def Send(self, text, timeout = None):
+    cmd = ATCommand(text, timeout)
+    self.tracker.Sent(cmd)
+    return cmd
+
+  def Receive(self, data):
+    #Returns the messages as the application would see them
+    return [self.tracker.Feed(m) for m in self.parser.Feed(data)]
+
+  def test_Query(self):
+    cmd = self.Send('ATST1?')
+    msgs = self.Receive(b'ATST1?\r\n21:30:00\r\n')
+    self.assertTrue(cmd.Ok())
+    self.assertEqual(cmd.Wait().val, '21:30:00')
+    #The bare time is labelled with the clock that was queried
+    self.assertEqual([(m.type, m.val) for m in msgs], [('Echo', 'ATST1?\r\n'), ('Closing', '21:30:00')])
+    self.assertEqual(self.tracker.Pending(), 0)
+
+  def test_Query_NotSet(self):
+    cmd = self.Send('ATST1?')
+    msgs = self.Receive(b'ATST1?\r\nNot set\r\n')
+    self.assertEqual((msgs[1].type, msgs[1].val), ('Closing', None))
+    self.assertEqual(cmd.Wait().type, 'Closing')
+
+  def test_Set(self):
+    cmd = self.Send('ATST0=14:56:05')
+    self.Receive(b'ATST0=14:56:05\r\nCurrent time: 14:56:05\r\n')
+    self.assertFalse(cmd.done)
+    self.Receive(b'OK\r\n')
+    self.assertEqual(cmd.Wait().val, '14:56:05')
+    self.assertEqual([m.type for m in cmd.replies], ['Current', 'OK'])
+    self.assertEqual(cmd.result.type, 'OK')
+
+  def test_Clear(self):
+    cmd = self.Send('ATST1=X')
+    self.Receive(b'ATST1=X\r\nClosing time: Not set\r\nOK\r\n')
+    r = cmd.Wait()
+    self.assertEqual((r.type, r.val), ('Closing', None))
+
+  def test_Error(self):
+    cmd = self.Send('ATST0=X')
+    self.Receive(b'ATST0=X\r\nERROR: Only closing time is clearable.\r\n')
+    self.assertEqual(cmd.Wait(), None)
+    self.assertEqual(cmd.error, 'ERROR: Only closing time is clearable.')
+
+  def test_Pipelined(self):
+    #A batch of commands in one round-trip; replies come back in order
+    at = self.Send('AT')
+    current = self.Send('ATST0?')
+    closing = self.Send('ATST1?')
+    clear = self.Send('ATST1=X')
+    msgs = self.Receive(b'AT\r\nOK\r\nATST0?\r\n14:56:05\r\nATST1?\r\n21:30:00\r\n'
+      b'ATST1=X\r\nClosing time: Not set\r\nOK\r\n')
+    self.assertEqual(at.Wait().type, 'OK')
+    self.assertEqual((current.Wait().type, current.value.val), ('Current', '14:56:05'))
+    self.assertEqual((closing.Wait().type, closing.value.val), ('Closing', '21:30:00'))
+    self.assertEqual((clear.Wait().type, clear.value.val), ('Closing', None))
+    self.assertNotIn('AmbiguousTime', [m.type for m in msgs])
+
+  def test_Unsolicited(self):
+    #A closing time set on the keypad while we're setting the clock isn't our reply
+    cmd = self.Send('ATST0=14:56:05')
+    msgs = self.Receive(b'ATST0=14:56:05\r\nClosing time: 22:00:00\r\nCurrent time: 14:56:05\r\nOK\r\n')
+    self.assertEqual(cmd.Wait().type, 'Current')
+    self.assertEqual(msgs[1].type, 'Closing')
+    self.assertEqual(len(cmd.replies), 2)
+    #With nothing in flight, messages pass through untouched
+    msgs = self.Receive(b'Closing time: Not set\r\n12:00:00\r\n')
+    self.assertEqual([m.type for m in msgs], ['Closing', 'AmbiguousTime'])
+
+  def test_TruncatedEcho(self):
+    #SpaceTime only echoes the first 20 characters of a command
+    cmd = self.Send('ATST0=14:56:05.25' + 'x' * 10)
+    self.Receive(b'ATST0=14:56:05.25xxx\r\nERROR: Time format problem.\r\n')
+    self.assertTrue(cmd.done)
+
+  def test_Timeout(self):
+    cmd = self.Send('ATST0?', timeout = 0.1)
+    start = time.time()
+    self.assertEqual(cmd.Wait(), None)
+    self.assertLess(time.time() - start, 0.3)
+    self.assertEqual(cmd.error, 'Timeout')
+    self.assertEqual(self.tracker.Pending(), 0)
+
+  def test_LostReply(self):
+    #If a reply is lost, the next command's echo finishes the earlier one
+    lost = self.Send('ATST0?')
+    cmd = self.Send('AT')
+    self.Receive(b'ATST0?\r\nAT\r\nOK\r\n')
+    self.assertEqual(lost.error, 'No reply')
+    self.assertTrue(cmd.Ok())
+
+  def test_Help(self):
+    help = self.Send('AT?')
+    cmd = self.Send('AT')
+    self.Receive(b'AT?\r\nSpaceTime commands:\r\n  AT? - display this help\r\n')
+    self.assertFalse(help.done)
+    self.Receive(b'AT\r\nOK\r\n')
+    self.assertTrue(help.Ok())
+    self.assertEqual(len(help.replies), 2)
+
+class TestCommandQueue(unittest.TestCase):
+
+  def setUp(self):
+    self.parser = SerialParser()
+    self.tracker = CommandTracker()
+    self.written = []
+    self.queue = CommandQueue(lambda c: self.written.append(c.text), self.tracker)
+
+  def Receive(self, data):
+    return [self.tracker.Feed(m) for m in self.parser.Feed(data)]
+
+  def test_Window(self):
+    #Only as much as fits in SpaceTime's 20 byte buffer is written at once
+    first = self.queue.Submit(ATCommand('ATST1=22:00'))
+    second = self.queue.Submit(ATCommand('ATST0?'))
+    self.assertEqual(self.written, ['ATST1=22:00'])
+    self.assertEqual(self.queue.Pending(), 1)
+    self.Receive(b'ATST1=22:00\r\nClosing time: 22:00:00\r\nOK\r\n')
+    self.assertTrue(first.Ok())
+    self.assertEqual(self.written, ['ATST1=22:00', 'ATST0?'])
+    self.Receive(b'ATST0?\r\n14:56:05\r\n')
+    self.assertEqual(second.Wait().val, '14:56:05')
+
+  def test_Pipelined(self):
+    #Short commands that fit are written together
+    for text in ('AT', 'ATST0?', 'ATST1?'):
+      self.queue.Submit(ATCommand(text))
+    self.assertEqual(self.written, ['AT', 'ATST0?', 'ATST1?'])
+
+  def test_Coalesce(self):
+    busy = self.queue.Submit(ATCommand('ATST1=21:00'))
+    old = self.queue.Submit(ATCommand('ATST1=21:30'))
+    clear = self.queue.Submit(ATCommand('ATST1=X'))
+    new = self.queue.Submit(ATCommand('ATST1=22:00'))
+    self.assertEqual(self.queue.coalesced, 2)
+    self.Receive(b'ATST1=21:00\r\nClosing time: 21:00:00\r\nOK\r\n')
+    self.assertEqual(self.written, ['ATST1=21:00', 'ATST1=22:00'])
+    self.Receive(b'ATST1=22:00\r\nClosing time: 22:00:00\r\nOK\r\n')
+    #Everyone whose command was replaced gets the outcome of the last one
+    for cmd in (old, clear, new):
+      self.assertEqual(cmd.Wait().val, '22:00:00')
+    self.assertEqual(busy.Wait().val, '21:00:00')
+
+  def test_Timeout(self):
+    #A command that never gets a reply doesn't hold up the queue forever
+    lost = self.queue.Submit(ATCommand('ATST1=21:00', 0.1))
+    cmd = self.queue.Submit(ATCommand('ATST0=14:56:05'))
+    self.assertEqual(lost.Wait(), None)
+    self.assertEqual(lost.error, 'Timeout')
+    self.assertEqual(self.written, ['ATST1=21:00', 'ATST0=14:56:05'])
+    self.assertFalse(cmd.done)
+
+  def test_Wait_Paused(self):
+    #Waiting for a command that can't be sent (ex: the serial port is
+    #reconnecting) gives up after queueTimeout
+    self.queue.Pause()
+    cmd = ATCommand('ATST1=X', 0.1)
+    cmd.queueTimeout = 0.2
+    self.queue.Submit(cmd)
+    start = time.time()
+    self.assertEqual(cmd.Wait(), None)
+    self.assertLess(time.time() - start, 1)
+    self.assertFalse(cmd.done)
+    #And it's still sent once it can be
+    self.queue.Resume()
+    self.assertEqual(self.written, ['ATST1=X'])
+
+class TestSpaceTimeCommands(unittest.TestCase):
+  #SpaceTime over a pseudo-terminal, with replies written by the test
+
+  def setUp(self):
+    from spacetime import SpaceTime
+    self.master, slave = os.openpty()
+    self.st = SpaceTime(os.ttyname(slave))
+    os.close(slave)
+
+  def tearDown(self):
+    self.st.serial.close()
+    os.close(self.master)
+
+  def test_Wait_ReadsReplies(self):
+    closing = self.st.GetTime(1)
+    current = self.st.GetTime(0)
+    self.assertEqual(os.read(self.master, 100), b'ATST1?\r\nATST0?\r\n')
+    os.write(self.master, b'ATST1?\r\nNot set\r\nATST0?\r\n14:56:05\r\n')
+    self.assertEqual(closing.Wait().type, 'Closing')
+    self.assertEqual(current.Wait().val, '14:56:05')
+    #The replies are still there for whoever processes serial messages
+    self.assertEqual([m.type for m in self.st.ReadAvailable()], ['Echo', 'Closing', 'Echo', 'Current'])
+
+  def test_ConcurrentWriters(self):
+    #Commands from several threads are never interleaved on the wire
+    def Send(n):
+      for i in range(5):
+        self.st.SerialCommand('ATST2=%02d:%02d' % (n, i), timeout = 0.05)
+    threads = [threading.Thread(target = Send, args = (n,)) for n in range(4)]
+    for th in threads:
+      th.start()
+    for th in threads:
+      th.join()
+    #Nothing replies, so each batch is written when the one before times out
+    data = b''
+    while self.st.commands.Pending() or self.st.tracker.Pending():
+      self.st.tracker.Expire()
+      if select.select([self.master], [], [], 0.01)[0]:
+        data += os.read(self.master, 1000)
+    for line in data.split(b'\r\n')[:-1]:
+      self.assertRegex(line, rb'^ATST2=\d\d:\d\d$')
+
+if __name__ == '__main__':
+  unittest.main()
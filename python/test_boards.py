@@ -0,0 +1,148 @@
+import unittest
+import shutil
+import tempfile
+import threading
+import time
+import web
+import main
+import restserv
+from boards import BoardManager, ParseDevices
+from emulator import SpaceTimeEmulator
+from eventlog import EventLog
+from runtime import Runtime
+from scheduler import Scheduler
+from spacetime import SpaceTime
+from statestore import StateStore
+from timeutil import ClockTime
+from testutil import WaitFor
+
+#To run these unit tests from command line:
+#python -m unittest test_boards
+
+#These tests drive several emulated boards (emulator.py) through main's
+#ProcessSerialMsg(), so they need Linux but no hardware.
+
+class FakeWebApi:
+  def __init__(self):
+    self.updates = []
+
+  def Update(self, *args):
+    self.updates.append(args)
+    return True
+
+class TestParseDevices(unittest.TestCase):
+
+  def test_ParseDevices(self):
+    self.assertEqual(ParseDevices('/dev/ttyAMA0'), [(None, '/dev/ttyAMA0')])
+    self.assertEqual(ParseDevices(' front=/dev/ttyAMA0, back=/dev/ttyUSB0 ,'),
+      [('front', '/dev/ttyAMA0'), ('back', '/dev/ttyUSB0')])
+
+class TestBoards(unittest.TestCase):
+  names = ('front', 'back', 'side')
+
+  def setUp(self):
+    self.saved = main.manager, main.state, main.scheduler, main.dispatcher, main.history
+    self.dir = tempfile.mkdtemp()
+    main.history = EventLog(self.dir)
+    main.manager = BoardManager()
+    main.state = StateStore()
+    main.scheduler = Scheduler()
+    main.dispatcher = None
+    self.web = FakeWebApi()
+    self.emus = []
+    self.rt = Runtime(None, None, main.scheduler)
+    for name in self.names:
+      emu = SpaceTimeEmulator(boot = False).Start()
+      st = SpaceTime(emu.device)
+      self.emus.append(emu)
+      main.manager.Add(st, name)
+      self.rt.Add(st, lambda msg, st = st: main.ProcessSerialMsg(msg, self.web, st))
+    self.th = threading.Thread(target = self.rt.Run)
+    self.th.daemon = True
+    self.th.start()
+
+  def tearDown(self):
+    self.rt.Stop()
+    self.th.join(2)
+    for board, emu in zip(main.manager.boards, self.emus):
+      board.st.serial.close()
+      emu.Stop()
+    main.history.Close()
+    shutil.rmtree(self.dir)
+    main.manager, main.state, main.scheduler, main.dispatcher, main.history = self.saved
+
+  def Closings(self):
+    return [emu.clocks['1'] for emu in self.emus]
+
+  def Events(self):
+    return [e for e in main.state.EventsSince(0)[1] if e['type'] == 'closing']
+
+  def test_Keypad_Propagates(self):
+    self.emus[1].Keypad('1', '21:30')
+    secs = ClockTime.Parse('21:30:00').Seconds()
+    self.assertTrue(WaitFor(lambda: self.Closings() == [secs] * 3))
+    self.assertTrue(WaitFor(lambda: all(b.closing_time == '21:30:00' for b in main.manager.boards)))
+    time.sleep(0.1)
+    #The web API and /events hear about it once, not from every board
+    self.assertEqual(self.web.updates, [('open', '21:30')])
+    self.assertEqual([e['closing_time'] for e in self.Events()], ['21:30:00'])
+    self.assertEqual(main.state.Get('closing_time'), '21:30:00')
+    self.assertEqual(main.state.Get('boards')['side']['closing_time'], '21:30:00')
+    #And the local history records it once
+    history = main.history.Between(0, time.time() + 1, ('closing',))
+    self.assertEqual([(e['source'], e['closing_time']) for e in history], [('back', '21:30:00')])
+
+  def test_Keypad_Clear(self):
+    self.emus[0].Keypad('1', '22:00')
+    self.assertTrue(WaitFor(lambda: None not in self.Closings()))
+    self.emus[2].Keypad('1', None)
+    self.assertTrue(WaitFor(lambda: self.Closings() == [None] * 3))
+    self.assertTrue(WaitFor(lambda: len(self.web.updates) == 2))
+    self.assertEqual(self.web.updates[-1], ('closed',))
+
+  def test_SetTime_AllBoards(self):
+    #What restserv's /set/open does with a BoardManager
+    reply = main.manager.SetTime(1, ClockTime.Parse('20:15:00')).Wait()
+    self.assertEqual(reply.val, '20:15:00')
+    secs = ClockTime.Parse('20:15:00').Seconds()
+    self.assertEqual(self.Closings(), [secs] * 3)
+    self.assertTrue(WaitFor(lambda: len(self.web.updates) == 1))
+    time.sleep(0.1)
+    self.assertEqual(self.web.updates, [('open', '20:15')])
+    self.assertEqual(len(self.Events()), 1)
+
+  def test_SetOpen_Coalesced(self):
+    #/set/open answers with what the boards were set to, which is a newer
+    #request's time if that one replaced it before it was sent
+    for board in main.manager.boards:
+      board.st.commands.Pause()
+    saved, restserv.spacetime = restserv.spacetime, main.manager
+    try:
+      app = web.application(restserv.urls, vars(restserv))
+      replies = []
+      th = threading.Thread(target = lambda: replies.append(app.request('/set/open/15:30').data))
+      th.start()
+      time.sleep(0.1)
+      main.manager.SetTime(1, ClockTime.Parse('16:00:00'))
+      for board in main.manager.boards:
+        board.st.commands.Resume()
+      th.join(5)
+    finally:
+      restserv.spacetime = saved
+    self.assertEqual(replies, [b'SpaceTime set to 16:00:00.'])
+    self.assertEqual(self.Closings(), [ClockTime.Parse('16:00:00').Seconds()] * 3)
+
+  def test_Reboot_Restores(self):
+    self.emus[0].Keypad('1', '23:00')
+    secs = ClockTime.Parse('23:00:00').Seconds()
+    self.assertTrue(WaitFor(lambda: self.Closings() == [secs] * 3))
+    self.emus[1].Reboot()
+    self.assertTrue(WaitFor(lambda: self.emus[1].clocks['1'] == secs))
+    time.sleep(0.1)
+    #The space is still open
+    self.assertEqual(self.web.updates, [('open', '23:00')])
+    self.assertEqual(main.state.EventsSince(0)[1][-1]['board'], 'back')
+    self.assertEqual([e['source'] for e in main.history.Between(0, time.time() + 1, ('boot',))], ['back'])
+
+if __name__ == '__main__':
+  unittest.main()
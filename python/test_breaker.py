@@ -0,0 +1,132 @@
+import unittest
+import time
+import metrics
+from breaker import CircuitBreaker, CircuitOpen
+from sinks import Dispatcher, WebApiSink, DoorEvent
+from stubserver import StubServer
+from webapi import WebApi
+
+#To run these unit tests from command line:
+#python -m unittest test_breaker
+
+class TestCircuitBreaker(unittest.TestCase):
+
+  def setUp(self):
+    self.changes = []
+    self.b = CircuitBreaker('test', failureThreshold = 3, resetTimeout = 0.1)
+    self.b.onChange = lambda name, old, new: self.changes.append(new)
+
+  def Fail(self, n):
+    for i in range(n):
+      self.b.Failure(self.b.Allow())
+
+  def test_Opens(self):
+    self.Fail(2)
+    self.b.Success(self.b.Allow()) #Only failures in a row count
+    self.Fail(2)
+    self.assertEqual(self.b.State(), 'closed')
+    self.Fail(1)
+    self.assertEqual(self.b.State(), 'open')
+    self.assertRaises(CircuitOpen, self.b.Allow)
+    self.assertGreater(self.b.RetryAt(), time.time())
+    self.assertEqual(self.changes, ['open'])
+
+  def test_OnChange_ReadsState(self):
+    #onChange is called without the lock held, so it can look at the breaker
+    seen = []
+    self.b.onChange = lambda name, old, new: seen.append((new, self.b.State(), self.b.RetryAt() != None))
+    self.Fail(3)
+    self.assertEqual(seen, [('open', 'open', True)])
+
+  def test_FailsFast(self):
+    self.Fail(3)
+    start = time.perf_counter()
+    for i in range(1000):
+      try:
+        self.b.Allow()
+      except CircuitOpen:
+        pass
+    self.assertLess((time.perf_counter() - start) / 1000, 0.0001)
+
+  def test_HalfOpen_Closes(self):
+    self.Fail(3)
+    time.sleep(0.1)
+    self.assertEqual(self.b.State(), 'half_open')
+    probe = self.b.Allow()
+    self.assertTrue(probe)
+    #Only one probe at a time
+    self.assertRaises(CircuitOpen, self.b.Allow)
+    self.b.Success(probe)
+    self.assertEqual(self.b.State(), 'closed')
+    self.assertFalse(self.b.Allow())
+    self.assertEqual(self.changes, ['open', 'half_open', 'closed'])
+
+  def test_HalfOpen_Reopens(self):
+    self.Fail(3)
+    time.sleep(0.1)
+    self.b.Failure(self.b.Allow())
+    self.assertEqual(self.b.State(), 'open')
+    self.assertRaises(CircuitOpen, self.b.Allow)
+    self.assertEqual(self.changes, ['open', 'half_open', 'open'])
+
+class TestWebApiBreaker(unittest.TestCase):
+
+  def setUp(self):
+    self.stub = StubServer()
+    self.stub.Start()
+    self.web = WebApi(dataURL = self.stub.webURL, timeout = 1,
+      breaker = CircuitBreaker('isvhsopen', failureThreshold = 2, resetTimeout = 0.2))
+
+  def tearDown(self):
+    self.stub.Stop()
+
+  def test_Outage(self):
+    self.stub.failureRate = 1
+    self.assertFalse(self.web.Update('open', '21:30'))
+    self.assertFalse(self.web.Update('open', '21:30'))
+    requests = self.stub.requests
+    #Open: fails without asking the server
+    start = time.perf_counter()
+    self.assertFalse(self.web.Update('open', '21:30'))
+    self.assertLess(time.perf_counter() - start, 0.01)
+    self.assertEqual(self.stub.requests, requests)
+    self.assertIn('webapi_circuit_state{api="isvhsopen"} 2', metrics.registry.Render())
+    #Back up: the probe after resetTimeout closes it
+    self.stub.failureRate = 0
+    time.sleep(0.2)
+    self.assertNotEqual(self.web.Update('open', '21:30'), False)
+    self.assertEqual(self.web.breaker.State(), 'closed')
+    self.assertEqual(self.stub.status['status'], 'open')
+    self.assertIn('webapi_circuit_state{api="isvhsopen"} 0', metrics.registry.Render())
+
+  def test_Timeouts(self):
+    #A server that hangs trips it too
+    self.stub.delay = 1.5
+    for i in range(2):
+      self.assertFalse(self.web.Update('closed'))
+    self.assertEqual(self.web.breaker.State(), 'open')
+    start = time.perf_counter()
+    self.assertFalse(self.web.Update('closed'))
+    self.assertLess(time.perf_counter() - start, 0.01)
+
+  def test_Dispatcher_RetriesAfterOpen(self):
+    #Deliveries aren't retried before the circuit lets them through
+    self.stub.failureRate = 1
+    d = Dispatcher([WebApiSink(self.web)], backoffMin = 0.01, backoffMax = 0.02)
+    d.Start()
+    try:
+      d.Publish(DoorEvent('21:30:00'))
+      time.sleep(0.1)
+      self.assertEqual(self.web.breaker.State(), 'open')
+      self.assertEqual(d.Stats('isvhsopen')[1], 2)
+      self.stub.failureRate = 0
+      end = time.time() + 2
+      while d.Stats('isvhsopen')[0] == 0 and time.time() < end:
+        time.sleep(0.01)
+      self.assertEqual(d.Stats('isvhsopen')[:2], (1, 2))
+      self.assertEqual(self.stub.status['status'], 'open')
+    finally:
+      d.Stop()
+
+if __name__ == '__main__':
+  unittest.main()
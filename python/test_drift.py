@@ -0,0 +1,89 @@
+import unittest
+import json
+import time
+from drift import DriftModel
+from timeutil import ClockTime
+
+#To run these unit tests from command line:
+#python -m unittest test_drift
+
+class TestDriftModel(unittest.TestCase):
+
+  def setUp(self):
+    self.m = DriftModel(0.5)
+    self.t0 = time.mktime((2026, 3, 2, 6, 0, 0, 0, 0, -1))
+
+  def Board(self, t, ppm, setAt):
+    #What SpaceTime prints at t if it drifts ppm since being set at setAt: whole seconds, truncated
+    return ClockTime.FromEpoch(int(t + (t - setAt) * ppm / 1e6))
+
+  def Run(self, ppm, until):
+    #Reads the clock whenever the model asks, until it needs setting.
+    #Returns the (time, true offset) of every reading.
+    self.m.Set(self.t0)
+    t = self.t0
+    readings = []
+    while True:
+      t = self.m.NextCheck(t)
+      if t > until:
+        return readings
+      readings.append((t, (t - self.t0) * ppm / 1e6))
+      if self.m.NeedsSet(t, self.m.Observe(t, self.Board(t, ppm, self.t0))):
+        return readings
+
+  def test_Fit(self):
+    #Truncated one second readings still give the rate once they span enough time
+    readings = self.Run(20, self.t0 + 7 * 86400)
+    self.assertTrue(self.m.Fitted())
+    self.assertAlmostEqual(self.m.rate, 20e-6, delta = 3 * self.m.error)
+    #Asked to be set before it drifted past the threshold
+    self.assertLess(readings[-1][1], 0.5)
+    self.assertLess(len(readings), 20)
+
+  def test_NoDrift(self):
+    #A good clock is checked at most once a day and never set
+    readings = self.Run(0, self.t0 + 7 * 86400)
+    self.assertGreater(len(readings), 5)
+    self.assertAlmostEqual(readings[-1][0] - readings[-2][0], DriftModel.maxInterval, delta = 1)
+
+  def test_Prior(self):
+    #The rate fitted before a set is used straight away after it
+    self.Run(-20, self.t0 + 7 * 86400)
+    rate = self.m.rate
+    self.t0 += 7 * 86400
+    self.m.Set(self.t0)
+    self.assertFalse(self.m.Fitted())
+    self.assertEqual(self.m.rate, rate)
+    #Checked before it could reach 0.4s
+    wait = self.m.NextCheck(self.t0) - self.t0
+    self.assertLess(wait, 0.4 / 20e-6)
+    self.assertGreater(wait, DriftModel.minInterval)
+
+  def test_Changed(self):
+    #A reading far from the fit means the clock was changed by hand
+    self.Run(0, self.t0 + 7 * 86400)
+    t = self.t0 + 8 * 86400
+    self.assertTrue(self.m.NeedsSet(t, self.m.Observe(t, ClockTime.FromEpoch(t + 60))))
+    #Readings are off by up to a second on their own
+    self.m.Set(t)
+    self.assertFalse(self.m.NeedsSet(t + 900, self.m.Observe(t + 900, ClockTime.FromEpoch(t + 900))))
+
+  def test_Status(self):
+    self.assertEqual(self.m.Status(self.t0)['drift_ppm'], None)
+    self.Run(20, self.t0 + 7 * 86400)
+    status = self.m.Status(self.t0)
+    self.assertEqual(status['set_at'], self.t0)
+    self.assertGreater(status['samples'], 2)
+    self.assertLess(status['residual_rms'], 0.5)
+
+  def test_SaveRestore(self):
+    #Picks up where it left off after a restart, through JSON
+    self.Run(20, self.t0 + 3 * 86400)
+    m = DriftModel(0.5)
+    m.Restore(json.loads(json.dumps(self.m.Save())))
+    t = self.t0 + 3 * 86400
+    self.assertEqual(m.Status(t), self.m.Status(t))
+    self.assertEqual(m.NextCheck(t), self.m.NextCheck(t))
+
+if __name__ == '__main__':
+  unittest.main()
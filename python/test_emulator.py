@@ -0,0 +1,110 @@
+import unittest
+import time
+from emulator import SpaceTimeEmulator
+from spacetime import SpaceTime
+from timeutil import ClockTime
+
+#To run these unit tests from command line:
+#python -m unittest test_emulator
+
+class TestEmulator(unittest.TestCase):
+
+  def Start(self, **kwargs):
+    self.emu = SpaceTimeEmulator(**kwargs).Start()
+    self.st = SpaceTime(self.emu.device)
+    return self.st
+
+  def tearDown(self):
+    self.st.serial.close()
+    self.emu.Stop()
+
+  def Lines(self, n):
+    return [self.st.ReadLine() for i in range(n)]
+
+  def test_Boot(self):
+    #Opening the port flushes what arrived before, so reboot once it's open
+    st = self.Start(boot = False)
+    self.emu.Reboot()
+    self.assertEqual([st.Read().type for i in range(2)], ['Banner', 'Boot'])
+
+  def test_Reboot(self):
+    st = self.Start(boot = False)
+    st.SetTime(1, ClockTime.Parse('23:00:00')).Wait()
+    self.emu.Reboot()
+    st.ReadAvailable()
+    self.assertEqual(st.GetTime(1).Wait().val, None)
+
+  def test_Commands(self):
+    st = self.Start(boot = False)
+    self.assertTrue(st.IsConnected())
+    self.assertEqual(st.SerialCommand('AT').Wait().type, 'OK')
+    self.assertEqual(st.SerialCommand('ATDT5551234').Wait(), None)
+    self.assertEqual(st.SetTime(0, ClockTime.Parse('14:56:05')).Wait().val, '14:56:05')
+    self.assertEqual(st.GetTime(0).Wait().val, '14:56:05')
+    self.assertEqual(st.SerialCommand('ATST1=21:30').Wait().val, '21:30:00')
+    self.assertEqual(st.ClearTime(1).Wait().val, None)
+    cmd = st.ClearTime(0)
+    self.assertEqual(cmd.Wait(), None)
+    self.assertEqual(cmd.error, 'ERROR: Only closing time is clearable.')
+    self.assertEqual(st.SerialCommand('ATST5?').Wait(), None)
+    self.assertEqual(st.SerialCommand('ATST0=1:00').Wait(), None)
+
+  def test_Echo(self):
+    st = self.Start(boot = False)
+    #Written directly, since nothing reads these replies for the CommandTracker
+    st.serial.write(b'Pizza\r\n')
+    self.assertEqual(self.Lines(2), ['Pizza\r\n', 'ERROR: Try AT?\r\n'])
+    #Only BUFFER_SIZE characters are echoed (and the rest ignored)
+    st.serial.write(b'ATST2=01:02:03.45678901\r\n')
+    self.assertEqual(self.Lines(2), ['ATST2=01:02:03.45678\r\n', 'OK\r\n'])
+
+  def test_ClosingTimeExpires(self):
+    st = self.Start(boot = False)
+    st.SerialCommand('ATST0=21:29:59.90').Wait()
+    st.SerialCommand('ATST1=21:30').Wait()
+    st.ReadAvailable()
+    msg = st.Read()
+    self.assertEqual((msg.type, msg.val), ('Closing', None))
+
+  def test_Keypad(self):
+    st = self.Start(boot = False)
+    self.emu.Keypad('1', '22:15')
+    msg = st.Read()
+    self.assertEqual((msg.type, msg.val), ('Closing', '22:15:00'))
+
+  def test_Latency(self):
+    st = self.Start(boot = False, latency = 0.1, jitter = 0.05)
+    start = time.time()
+    self.assertTrue(st.SerialCommand('AT').Wait())
+    self.assertGreaterEqual(time.time() - start, 0.1)
+    self.assertLess(time.time() - start, 0.3)
+
+  def test_Corruption(self):
+    st = self.Start(boot = False, corruption = 1, seed = 1)
+    st.SerialCommand('ATST1=X')
+    time.sleep(0.2)
+    msgs = st.ReadAvailable()
+    self.assertNotIn(('Closing', None), [(m.type, m.val) for m in msgs])
+
+  def test_Throughput(self):
+    #Pipelined queries are limited by the baud rate, not by round-trips
+    st = self.Start(boot = False)
+    n = 200
+    start = time.time()
+    cmds = [st.GetTime(1, timeout = 10) for i in range(n)]
+    for c in cmds:
+      self.assertTrue(c.Wait())
+    elapsed = time.time() - start
+    #Each query is 8 bytes of echo and 9 bytes of reply at 57600 baud
+    self.assertLess(elapsed, n * 17 * 10 / 57600.0 * 2)
+
+  def test_Throughput_Unpaced(self):
+    st = self.Start(boot = False, baud = 0)
+    n = 500
+    start = time.time()
+    for i in range(n):
+      self.assertTrue(st.SerialCommand('AT').Wait())
+    self.assertGreater(n / (time.time() - start), 200)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from eventlog import EventLog, ParseTime, LocalMidnight, record
+
+#To run these unit tests from command line:
+#python -m unittest test_eventlog
+
+class TestEventLog(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.log = EventLog(self.dir, segmentRecords = 4)
+    self.day = LocalMidnight(time.mktime((2024, 3, 5, 12, 0, 0, 0, 0, -1)))
+
+  def tearDown(self):
+    self.log.Close()
+    shutil.rmtree(self.dir)
+
+  def At(self, hours):
+    return self.day + hours * 3600
+
+  def test_AppendAndQuery(self):
+    self.log.Append('boot', source = 'front', t = self.At(1))
+    self.log.Append('closing', 21 * 3600 + 30 * 60, 'front', t = self.At(2))
+    self.log.Append('sync', -250, 'front', t = self.At(3))
+    self.log.Append('delivery', 2, 'isvhsopen', ok = False, t = self.At(4))
+    self.assertEqual(self.log.Size(), 4)
+    events = self.log.Between(self.At(1.5), self.At(24))
+    self.assertEqual([e['type'] for e in events], ['closing', 'sync', 'delivery'])
+    self.assertEqual(events[0], {'at': self.At(2), 'type': 'closing', 'source': 'front', 'closing_time': '21:30:00'})
+    self.assertEqual(events[1]['offset'], -0.25)
+    self.assertEqual((events[2]['ok'], events[2]['attempts']), (False, 2))
+    self.assertEqual(len(self.log.Between(self.At(0), self.At(24), ('sync', 'boot'))), 2)
+    self.assertEqual(len(self.log.Between(self.At(0), self.At(24), limit = 1)), 1)
+    self.assertEqual(self.log.Between(self.At(5), self.At(24)), [])
+
+  def test_Reopen(self):
+    #Across segments and days, after a restart, and after a torn write
+    for i in range(10):
+      self.log.Append('sync', i, t = self.At(i * 10))
+    self.log.Close()
+    with open(os.path.join(self.dir, '00000002.evt'), 'ab') as f:
+      f.write(b'\1' * (record.size // 2))
+    self.log = EventLog(self.dir, segmentRecords = 4)
+    self.assertEqual(self.log.Size(), 10)
+    self.log.Append('sync', 10, t = self.At(100))
+    events = self.log.Between(self.At(25), self.At(75))
+    self.assertEqual([e['offset'] for e in events], [0.003, 0.004, 0.005, 0.006, 0.007])
+    self.assertEqual(self.log.Between(self.At(95), self.At(101))[0]['offset'], 0.01)
+
+  def test_Retention(self):
+    #Whole segments older than maxDays are dropped as new ones are started
+    self.log.Close()
+    self.log = EventLog(self.dir, segmentRecords = 4, maxDays = 2)
+    for i in range(12):
+      self.log.Append('sync', i, t = self.At(i * 12))
+    #Segment 0 (hours 0-36) is over 2 days before hour 132, segment 1 (48-84) isn't
+    self.assertEqual(sorted(os.listdir(self.dir)), ['00000001.evt', '00000002.evt', 'days.idx'])
+    self.assertEqual(self.log.Size(), 8)
+    self.log.Append('sync', 12, t = self.At(144))
+    self.assertFalse(os.path.exists(os.path.join(self.dir, '00000001.evt')))
+    events = self.log.Between(0, self.At(200))
+    self.assertEqual([e['offset'] for e in events], [0.008, 0.009, 0.01, 0.011, 0.012])
+    self.assertEqual(self.log.Between(self.At(0), self.At(90)), [])
+    #And after a restart
+    self.log.Close()
+    self.log = EventLog(self.dir, segmentRecords = 4, maxDays = 2)
+    self.assertEqual(self.log.Size(), 5)
+    self.assertEqual(len(self.log.Between(self.At(90), self.At(200))), 5)
+    self.assertEqual(self.log.LastBefore(self.At(100), 'sync')['offset'], 0.008)
+
+  def test_Monotonic(self):
+    #A clock stepped back doesn't put events out of order
+    self.log.Append('boot', t = self.At(2))
+    self.log.Append('set', t = self.At(1))
+    self.assertEqual([e['at'] for e in self.log.Between(0, self.At(3))], [self.At(2), self.At(2)])
+
+  def test_OpenHours(self):
+    #Open from 22:00 the day before to 01:00, then 18:00 to 21:30
+    self.log.Append('closing', 1 * 3600, t = self.At(-2))
+    self.log.Append('closing', -1, t = self.At(1))
+    self.log.Append('closing', 21 * 3600, t = self.At(18))
+    self.log.Append('closing', -1, t = self.At(21.5))
+    self.log.Append('closing', 23 * 3600, t = self.At(47))
+    days = self.log.OpenHours(self.At(0), self.At(48), now = self.At(47.5))
+    self.assertEqual(days, [('2024-03-05', 4.5), ('2024-03-06', 0.5)])
+
+  def test_Fast(self):
+    #A query over a day doesn't slow down with years of history
+    n = 20000
+    log = EventLog(os.path.join(self.dir, 'big'))
+    start = self.At(0) - n * 3600
+    for i in range(n):
+      log.Append('closing', -1 if i % 2 else 21 * 3600, t = start + i * 3600)
+    begin = time.perf_counter()
+    events = log.Between(self.At(-48), self.At(-24))
+    elapsed = time.perf_counter() - begin
+    log.Close()
+    self.assertEqual(len(events), 24)
+    self.assertLess(elapsed, 0.01)
+
+  def test_ParseTime(self):
+    self.assertEqual(ParseTime('', 5), 5)
+    self.assertEqual(ParseTime('1700000000.5', 5), 1700000000.5)
+    self.assertEqual(ParseTime('2024-03-05', 5), self.day)
+    self.assertRaises(ValueError, ParseTime, 'yesterday', 5)
+
+if __name__ == '__main__':
+  unittest.main()
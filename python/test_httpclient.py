@@ -0,0 +1,123 @@
+import unittest
+import socket
+import threading
+import requests
+from httpclient import HttpClient
+from stubserver import StubServer
+from webapi import WebApi
+from vhsapi import VHSApi
+
+#To run these unit tests from command line:
+#python -m unittest test_httpclient
+
+#These tests run against a local stand-in server, not the live APIs.
+
+class TestHttpClient(unittest.TestCase):
+
+  def setUp(self):
+    self.srv = StubServer().Start()
+
+  def tearDown(self):
+    self.srv.Stop()
+
+  def test_WebApi_ReusesConnection(self):
+    w = WebApi(dataURL = self.srv.webURL)
+    for i in range(5):
+      self.assertEqual(w.Query('status'), 'closed')
+    self.assertTrue(w.Update('open', '12:34'))
+    self.assertEqual(self.srv.requests, 6)
+    self.assertEqual(self.srv.connections, 1)
+
+  def test_VHSApi_ReusesConnection(self):
+    v = VHSApi(dataURL = self.srv.vhsURL)
+    self.assertEqual(v.Update('test1', 'v1'), 'v1')
+    self.assertEqual(v.Query('test1'), 'v1')
+    self.assertEqual(self.srv.connections, 1)
+
+  def test_StaleConnection(self):
+    w = WebApi(dataURL = self.srv.webURL)
+    self.assertTrue(w.Query())
+    #The server hangs up on our pooled connection
+    self.srv.DropConnections()
+    self.assertTrue(w.Query())
+    self.assertTrue(w.Update('closed'))
+    self.assertEqual(self.srv.connections, 2)
+
+  def test_ServerDown(self):
+    w = WebApi(dataURL = self.srv.webURL)
+    self.assertTrue(w.Query())
+    self.srv.Stop()
+    self.assertFalse(w.Query())
+    #Once it's back, we reconnect
+    self.srv = StubServer(port = int(self.srv.url.rsplit(':', 1)[1])).Start()
+    self.assertTrue(w.Query())
+
+class HangUpServer:
+  #Reads each request, then closes the connection without replying, like a
+  #server that dies after acting on it
+  def __init__(self):
+    self.sock = socket.socket()
+    self.sock.bind(('127.0.0.1', 0))
+    self.sock.listen(5)
+    self.url = 'http://127.0.0.1:%d/' % self.sock.getsockname()[1]
+    self.requests = 0
+    th = threading.Thread(target = self.Run)
+    th.daemon = True
+    th.start()
+
+  def Run(self):
+    while True:
+      try:
+        conn = self.sock.accept()[0]
+      except OSError:
+        return
+      if conn.recv(65536):
+        self.requests += 1
+      conn.close()
+
+  def Stop(self):
+    self.sock.close()
+
+class TestRetry(unittest.TestCase):
+
+  def setUp(self):
+    self.srv = HangUpServer()
+    self.http = HttpClient()
+
+  def tearDown(self):
+    self.srv.Stop()
+
+  def test_GetRetried(self):
+    with self.assertRaises(requests.exceptions.ConnectionError):
+      self.http.Get(self.srv.url, timeout = 2)
+    self.assertEqual(self.srv.requests, 2)
+
+  def test_PostNotResent(self):
+    #The server may have acted on it, so it isn't sent twice
+    with self.assertRaises(requests.exceptions.ConnectionError):
+      self.http.Post(self.srv.url, data = 'x', timeout = 2)
+    self.assertEqual(self.srv.requests, 1)
+    self.assertEqual(self.http.resets, 1)
+
+  def test_PostUnsentRetried(self):
+    #Nothing listening: nothing was sent, so trying again is safe
+    url = self.srv.url
+    self.srv.Stop()
+    sessions = []
+    newSession = self.http.NewSession
+    self.http.NewSession = lambda: sessions.append(1) or newSession()
+    with self.assertRaises(requests.exceptions.ConnectionError):
+      self.http.Post(url, data = 'x', timeout = 2)
+    #Tried on a second session
+    self.assertEqual(len(sessions), 2)
+
+  def test_ResetReplacedOnce(self):
+    #Two threads that both failed on the same session only replace it once
+    old = self.http.Session()
+    self.assertTrue(self.http.Reset(old))
+    new = self.http.Session()
+    self.assertFalse(self.http.Reset(old))
+    self.assertIs(self.http.Session(), new)
+
+if __name__ == '__main__':
+  unittest.main()
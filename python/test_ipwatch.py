@@ -0,0 +1,118 @@
+import unittest
+import threading
+import time
+from ipwatch import IPWatcher, AddressSource, LocalIP
+from stubserver import StubServer
+from vhsapi import VHSApi
+
+#To run these unit tests from command line:
+#python -m unittest test_ipwatch
+
+class FakeSource:
+  #An address source whose IP the test sets
+  def __init__(self, ip = None):
+    self.ip = ip
+    self.cond = threading.Condition()
+    self.changed = False
+    self.closed = False
+
+  def Set(self, ip):
+    #Like a DHCP lease, or a link going down (None); the kernel reports it
+    #even if the IP ends up the same
+    with self.cond:
+      self.ip = ip
+      self.changed = True
+      self.cond.notify_all()
+
+  def Current(self):
+    with self.cond:
+      return self.ip
+
+  def Wait(self, timeout):
+    with self.cond:
+      self.cond.wait_for(lambda: self.changed or self.closed, timeout)
+      self.changed = False
+      return not self.closed
+
+  def Close(self):
+    with self.cond:
+      self.closed = True
+      self.cond.notify_all()
+
+class TestIPWatcher(unittest.TestCase):
+
+  def setUp(self):
+    self.source = FakeSource('10.0.0.2')
+    self.reported = []
+    self.watcher = IPWatcher(self.source, self.reported.append, last = '10.0.0.2')
+
+  def tearDown(self):
+    self.watcher.Stop()
+
+  def Settle(self):
+    time.sleep(0.05)
+
+  def test_OnlyChanges(self):
+    #Same as before the restart: nothing to report
+    self.assertFalse(self.watcher.Check())
+    self.watcher.Start()
+    self.source.Set('10.0.0.2')
+    self.Settle()
+    self.assertEqual(self.reported, [])
+    self.source.Set('10.0.0.7')
+    self.Settle()
+    self.assertEqual(self.reported, ['10.0.0.7'])
+    #The link going down and back up with the same lease isn't a change
+    self.source.Set(None)
+    self.Settle()
+    self.source.Set('10.0.0.7')
+    self.Settle()
+    self.assertEqual(self.reported, ['10.0.0.7'])
+
+  def test_FirstCheck(self):
+    #With nothing reported before, the first check reports the IP
+    self.watcher.last = None
+    self.assertTrue(self.watcher.Check())
+    self.assertEqual(self.reported, ['10.0.0.2'])
+
+  def test_Stop(self):
+    #A real source stops waiting as soon as it's told to
+    watcher = IPWatcher(AddressSource(), self.reported.append, last = LocalIP())
+    watcher.Start()
+    start = time.time()
+    watcher.Stop()
+    self.assertLess(time.time() - start, 1)
+
+class TestUpdateIfNecessary(unittest.TestCase):
+
+  def setUp(self):
+    self.stub = StubServer()
+    self.stub.Start()
+    self.vhs = VHSApi(dataURL = self.stub.vhsURL)
+
+  def tearDown(self):
+    self.stub.Stop()
+
+  def test_Unchanged(self):
+    self.stub.data['spacetime_ip'] = '10.0.0.2'
+    requests = self.stub.requests
+    self.assertEqual(self.vhs.UpdateIfNecessary('spacetime_ip', '10.0.0.2'), '10.0.0.2')
+    #Only the query
+    self.assertEqual(self.stub.requests, requests + 1)
+
+  def test_Changed(self):
+    self.stub.data['spacetime_ip'] = '10.0.0.2'
+    self.assertEqual(self.vhs.UpdateIfNecessary('spacetime_ip', '10.0.0.7'), '10.0.0.7')
+    self.assertEqual(self.stub.data['spacetime_ip'], '10.0.0.7')
+
+  def test_New(self):
+    #A variable that doesn't exist yet can't be queried, so is just written
+    self.assertEqual(self.vhs.UpdateIfNecessary('spacetime_ip', '10.0.0.2'), '10.0.0.2')
+    self.assertEqual(self.stub.data['spacetime_ip'], '10.0.0.2')
+
+  def test_Down(self):
+    self.stub.failureRate = 1
+    self.assertFalse(self.vhs.UpdateIfNecessary('spacetime_ip', '10.0.0.2'))
+
+if __name__ == '__main__':
+  unittest.main()
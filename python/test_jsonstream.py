@@ -0,0 +1,44 @@
+import unittest
+import json
+from jsonstream import IterArray
+
+#To run these unit tests from command line:
+#python -m unittest test_jsonstream
+
+def Chunks(s, n):
+  b = s.encode('utf-8')
+  return [b[i:i + n] for i in range(0, len(b), n)]
+
+class TestJsonStream(unittest.TestCase):
+
+  def test_Array(self):
+    doc = '[{"a": 1}, [2, "x]"], 3.5, "café", null, 12345]'
+    for n in (1, 2, 3, 7, 1000):
+      self.assertEqual(list(IterArray(Chunks(doc, n))), json.loads(doc))
+
+  def test_InObject(self):
+    #The first array, even after strings with brackets in them
+    doc = '{"name": "door [\\"x\\"]", "history": [{"value": "open"}, {"value": "closed"}], "more": [1]}'
+    for n in (1, 5, 1000):
+      self.assertEqual(list(IterArray(Chunks(doc, n))), [{'value': 'open'}, {'value': 'closed'}])
+
+  def test_Empty(self):
+    self.assertEqual(list(IterArray(['{"history": [ ]}'])), [])
+
+  def test_Errors(self):
+    self.assertRaises(ValueError, list, IterArray(['{"history": 5}']))
+    self.assertRaises(ValueError, list, IterArray(['[1, 2']))
+    self.assertRaises(ValueError, list, IterArray(['[1, {"a": x}]']))
+    self.assertRaises(ValueError, list, IterArray(['["' + 'x' * 100] + ['x'] * 100, maxItem = 50))
+
+  def test_Lazy(self):
+    #Items come out as soon as they're complete
+    def Source():
+      yield b'[{"a": 1}, '
+      yield b'{"a": 2}'
+      raise AssertionError('Read too far')
+    items = IterArray(Source())
+    self.assertEqual(next(items), {'a': 1})
+
+if __name__ == '__main__':
+  unittest.main()
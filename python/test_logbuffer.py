@@ -0,0 +1,99 @@
+import unittest
+import io
+import json
+import time
+import web
+import restserv
+from logbuffer import LogBuffer, FormatEntry, log
+
+#To run these unit tests from command line:
+#python -m unittest test_logbuffer
+
+class SlowWriter(io.StringIO):
+  #A stalled SD card
+  def write(self, s):
+    time.sleep(0.5)
+    return io.StringIO.write(self, s)
+
+class TestLogBuffer(unittest.TestCase):
+
+  def setUp(self):
+    self.out = io.StringIO()
+    self.log = LogBuffer(self.out)
+
+  def tearDown(self):
+    self.log.Stop()
+
+  def test_Log(self):
+    self.assertEqual(self.log.Info('Connected!'), 1)
+    self.assertEqual(self.log.Error('isvhsopen Update failed', error = 'timed out'), 2)
+    seq, entries, missed = self.log.EntriesSince(0)
+    self.assertEqual((seq, missed), (2, False))
+    self.assertEqual([e['msg'] for e in entries], ['Connected!', 'isvhsopen Update failed'])
+    self.assertEqual(entries[1]['error'], 'timed out')
+    self.assertEqual(self.log.EntriesSince(1, 'ERROR')[1][0]['seq'], 2)
+    self.assertEqual(self.log.EntriesSince(0, 'ERROR')[1], entries[1:])
+    #Written out in the background
+    self.log.Stop()
+    lines = self.out.getvalue().splitlines()
+    self.assertEqual(len(lines), 2)
+    self.assertTrue(lines[1].endswith(' ERROR   isvhsopen Update failed error=timed out'))
+
+  def test_Format(self):
+    e = {'seq': 1, 'at': 0, 'level': 'INFO', 'msg': 'Hi', 'status': 500, 'response': 'Oops'}
+    self.assertTrue(FormatEntry(e).endswith(' INFO    Hi response=Oops status=500'))
+
+  def test_RingBuffer(self):
+    self.log.entries = type(self.log.entries)(maxlen = 3)
+    for i in range(5):
+      self.log.Info('Message ' + str(i))
+    seq, entries, missed = self.log.EntriesSince(0)
+    self.assertEqual([e['seq'] for e in entries], [3, 4, 5])
+    self.assertTrue(missed)
+    self.assertFalse(self.log.EntriesSince(2)[2])
+
+  def test_Dedup(self):
+    for i in range(100):
+      self.log.Error('Exception in main loop!', error = 'boom')
+    self.log.Error('Exception in main loop!', error = 'something else')
+    self.assertEqual(len(self.log.EntriesSince(0)[1]), 2)
+    #The repeats are logged once the window is over
+    with self.log.cond:
+      self.log.Expire(time.time() + self.log.dedupWindow)
+    entries = self.log.EntriesSince(0)[1]
+    self.assertEqual(len(entries), 3)
+    self.assertEqual((entries[2]['error'], entries[2]['repeats']), ('boom', 99))
+    #And then it's logged again
+    self.assertEqual(self.log.Error('Exception in main loop!', error = 'boom'), 4)
+
+  def test_Dedup_NotInfo(self):
+    #Repeated state changes are history, not noise
+    for i in range(3):
+      self.log.Info('SpaceTime reports that Closing time is 21:30:00')
+    self.assertEqual(len(self.log.EntriesSince(0)[1]), 3)
+
+  def test_SlowOutput(self):
+    #Logging doesn't wait for the output
+    self.log = LogBuffer(SlowWriter())
+    self.log.flushInterval = 0.01
+    self.log.Info('First')
+    time.sleep(0.1) #Being written
+    start = time.time()
+    for i in range(1000):
+      self.log.Info('Message ' + str(i))
+    self.assertLess(time.time() - start, 0.25)
+    self.log.Stop()
+    self.assertEqual(len(self.log.out.getvalue().splitlines()), 1001)
+
+  def test_Endpoint(self):
+    seq = log.Warning('test_Endpoint')
+    app = web.application(restserv.urls, vars(restserv))
+    r = app.request('/log?since=' + str(seq - 1))
+    self.assertEqual(r.status, '200 OK')
+    doc = json.loads(r.data.decode('utf-8'))
+    self.assertEqual(doc['entries'][0]['msg'], 'test_Endpoint')
+    self.assertEqual(doc['seq'], seq)
+    self.assertEqual(app.request('/log?since=x').status, '400 Bad Request')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import threading
+import web
+import metrics
+import restserv
+import atcommand
+
+#To run these unit tests from command line:
+#python -m unittest test_metrics
+
+class TestMetrics(unittest.TestCase):
+
+  def setUp(self):
+    self.r = metrics.Registry()
+
+  def test_Counter(self):
+    c = metrics.Counter('messages_total', 'Messages', ('type',), registry = self.r)
+    c.Labels('Current').Inc()
+    c.Labels('Current').Inc(2)
+    c.Labels('Closing').Inc()
+    self.assertIs(c.Labels('Current'), c.Labels('Current'))
+    self.assertEqual(c.Labels('Current').Get(), 3)
+    self.assertRaises(ValueError, c.Labels)
+    self.assertEqual(self.r.Render(),
+      '# HELP messages_total Messages\n'
+      '# TYPE messages_total counter\n'
+      'messages_total{type="Current"} 3\n'
+      'messages_total{type="Closing"} 1\n')
+
+  def test_Gauge(self):
+    g = metrics.Gauge('depth', 'Depth', registry = self.r)
+    g.Inc(5)
+    g.Dec()
+    self.assertEqual(g.Get(), 4)
+    g.Set(1.5)
+    self.assertIn('depth 1.5\n', self.r.Render())
+    #Read when served
+    depth = [7]
+    metrics.Gauge('depth', 'Depth', registry = self.r, func = lambda: depth[0])
+    self.assertIn('depth 7\n', self.r.Render())
+    depth[0] = None
+    self.assertNotIn('\ndepth ', self.r.Render())
+
+  def test_Histogram(self):
+    h = metrics.Histogram('latency_seconds', 'Latency', registry = self.r, buckets = (0.1, 1))
+    for v in (0.05, 0.1, 0.5, 3):
+      h.Observe(v)
+    lines = self.r.Render().splitlines()
+    self.assertEqual(lines[2:], [
+      'latency_seconds_bucket{le="0.1"} 2',
+      'latency_seconds_bucket{le="1"} 3',
+      'latency_seconds_bucket{le="+Inf"} 4',
+      'latency_seconds_sum 3.65',
+      'latency_seconds_count 4'])
+
+  def test_LabelEscaping(self):
+    c = metrics.Counter('errors_total', 'Errors', ('line',), registry = self.r)
+    c.Labels('say "hi"\\\n').Inc()
+    self.assertIn('errors_total{line="say \\"hi\\"\\\\\\n"} 1', self.r.Render())
+
+  def test_Threads(self):
+    c = metrics.Counter('n_total', 'N', registry = self.r)
+    h = metrics.Histogram('h', 'H', ('k',), registry = self.r)
+    def Work():
+      for i in range(10000):
+        c.Inc()
+        h.Labels('a').Observe(0.01)
+    threads = [threading.Thread(target = Work) for i in range(4)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(c.Get(), 40000)
+    self.assertEqual(h.Labels('a').Get()[2], 40000)
+
+  def test_Endpoint(self):
+    metrics.Counter('test_metrics_endpoint_total', 'For test_Endpoint').Inc()
+    try:
+      app = web.application(restserv.urls, vars(restserv))
+      r = app.request('/metrics')
+      self.assertEqual(r.status, '200 OK')
+      self.assertTrue(r.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+      self.assertIn('\ntest_metrics_endpoint_total 1\n', r.data.decode('utf-8'))
+      #Metrics created by other modules, ex: atcommand
+      self.assertIn('# TYPE spacetime_command_seconds histogram\n', r.data.decode('utf-8'))
+    finally:
+      metrics.registry.Unregister('test_metrics_endpoint_total')
+
+if __name__ == '__main__':
+  unittest.main()
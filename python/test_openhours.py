@@ -0,0 +1,125 @@
+import unittest
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import openhours
+from openhours import History, Heatmap, DurationHistogram, LikelyClosing, HourOfWeek
+from stubserver import StubServer
+from vhsapi import VHSApi
+
+#To run these unit tests from command line:
+#python -m unittest test_openhours
+
+#These tests use a recorded door history, served by a local stand-in server.
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', 'vhs_door_history.json')
+
+class TestOpenHours(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    with open(fixture) as f:
+      cls.doc = json.load(f)
+
+  def setUp(self):
+    self.srv = StubServer().Start()
+    self.srv.recorded['GET /s/vhs/data/history/door.json'] = (200, self.doc)
+    self.api = VHSApi(dataURL = self.srv.vhsURL)
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.srv.Stop()
+
+  def Intervals(self):
+    #The open intervals, the slow way
+    out = []
+    opened = None
+    for e in self.doc['history']:
+      if e['value'] == 'open' and opened == None:
+        opened = e['last_updated']
+      elif e['value'] == 'closed' and opened != None:
+        out.append((opened, e['last_updated']))
+        opened = None
+    return out
+
+  def test_History(self):
+    changes = list(self.api.History('door', chunkSize = 64))
+    self.assertEqual(len(changes), len(self.doc['history']))
+    self.assertEqual(changes[0], (1444093885, 'open'))
+    last = changes[-10][0]
+    self.assertEqual(len(list(self.api.History('door', since = last))), 9)
+    self.assertRaises(IOError, list, self.api.History('nothere'))
+
+  def test_Intervals(self):
+    h = History()
+    self.assertEqual(h.Update(self.api), len(self.doc['history']))
+    starts, ends = h.Intervals()
+    self.assertEqual(list(zip(starts, ends)), self.Intervals())
+    #Open now
+    h.Append([ends[-1] + 100], [1])
+    self.assertEqual(len(h.Intervals()[0]), len(starts))
+    self.assertEqual(h.Intervals(now = ends[-1] + 200)[1][-1], ends[-1] + 200)
+
+  def test_Cache(self):
+    path = os.path.join(self.dir, 'door.npz')
+    #Only part of the history so far
+    full = self.doc['history']
+    self.srv.recorded['GET /s/vhs/data/history/door.json'] = (200, {'history': full[:50]})
+    h = History.Load(path)
+    self.assertEqual(h.Update(self.api), 50)
+    h.Save(path)
+    #The rest is added
+    self.srv.recorded['GET /s/vhs/data/history/door.json'] = (200, self.doc)
+    h = History.Load(path)
+    self.assertEqual(h.times.size, 50)
+    self.assertEqual(h.Update(self.api), len(full) - 50)
+    h.Save(path)
+    self.assertEqual(History.Load(path).times.tolist(), [e['last_updated'] for e in full])
+    self.assertLess(os.path.getsize(path), len(json.dumps(self.doc)) / 2)
+
+  def test_Durations(self):
+    h = History()
+    h.Update(self.api)
+    counts = DurationHistogram(*h.Intervals())
+    durations = [e - s for s, e in self.Intervals()]
+    self.assertEqual(counts.sum(), len(durations))
+    self.assertEqual(counts[openhours.durationBins.index(4 * 3600)],
+      len([d for d in durations if 4 * 3600 <= d < 6 * 3600]))
+
+  def test_Heatmap(self):
+    h = History()
+    h.Update(self.api)
+    starts, ends = h.Intervals()
+    grid = Heatmap(starts, ends)
+    #Open seconds in each hour of the week, the slow way
+    first = int(starts[0] // 3600 * 3600)
+    openSecs = np.zeros(7 * 24)
+    seen = np.zeros(7 * 24)
+    for t in range(first, int(ends[-1]), 3600):
+      lt = time.localtime(t)
+      which = lt.tm_wday * 24 + lt.tm_hour
+      seen[which] += 3600
+      openSecs[which] += sum(max(0, min(e, t + 3600) - max(s, t)) for s, e in self.Intervals())
+    np.testing.assert_allclose(grid.ravel(), openSecs / np.maximum(seen, 1))
+
+  def test_HourOfWeek(self):
+    for t in (0, 1444093885, 1446336000, time.time()):
+      lt = time.localtime(t)
+      self.assertEqual(HourOfWeek([t])[0], lt.tm_wday * 24 + lt.tm_hour)
+
+  def test_LikelyClosing(self):
+    h = History()
+    h.Update(self.api)
+    starts, ends = h.Intervals()
+    guess = LikelyClosing(starts, ends, starts[-1])
+    self.assertGreater(guess['samples'], 1)
+    self.assertTrue(starts[-1] < guess['early'] <= guess['closing'] <= guess['late'])
+    #Only the opening itself, on its weekday within a second
+    guess = LikelyClosing(starts, ends, starts[-1], window = 1, sameWeekday = True)
+    self.assertEqual((guess['samples'], guess['closing']), (1, ends[-1]))
+    self.assertEqual(LikelyClosing(starts[:0], ends[:0], starts[-1]), None)
+
+if __name__ == '__main__':
+  unittest.main()
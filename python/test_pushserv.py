@@ -0,0 +1,151 @@
+import unittest
+import http.client
+import json
+import socket
+import threading
+import time
+from pushserv import PushServer
+from statestore import StateStore
+from testutil import WaitFor
+
+#To run these unit tests from command line:
+#python -m unittest test_pushserv
+
+def App(environ, start_response):
+  #Stands in for the web.py app
+  start_response('200 OK', [('Content-Type', 'text/plain')])
+  return [(environ['REQUEST_METHOD'] + ' ' + environ['PATH_INFO'] + '?' + environ['QUERY_STRING']).encode('ascii')]
+
+class TestPushServer(unittest.TestCase):
+
+  def setUp(self):
+    self.state = StateStore(maxEvents = 3)
+    self.srv = PushServer(App, self.state).Start()
+
+  def tearDown(self):
+    self.srv.Stop()
+
+  def Get(self, path, timeout = 5):
+    c = http.client.HTTPConnection('127.0.0.1', self.srv.port, timeout = timeout)
+    c.request('GET', path)
+    r = c.getresponse()
+    body = r.read()
+    c.close()
+    return r, body
+
+  def Json(self, path):
+    r, body = self.Get(path)
+    self.assertEqual(r.status, 200)
+    return json.loads(body.decode('ascii'))
+
+  def test_App(self):
+    #Everything else goes to the WSGI app, over one keep-alive connection
+    c = http.client.HTTPConnection('127.0.0.1', self.srv.port, timeout = 5)
+    for path, reply in (('/set/open/15:30', b'GET /set/open/15:30?'), ('/status?x=1', b'GET /status?x=1')):
+      c.request('GET', path)
+      self.assertEqual(c.getresponse().read(), reply)
+    c.close()
+
+  def test_LongPoll_Ready(self):
+    v = self.state.Publish('closing', closing_time = '22:00:00')
+    r = self.Json('/events?since=0')
+    self.assertEqual(r['version'], v)
+    self.assertEqual([(e['type'], e['closing_time']) for e in r['events']], [('closing', '22:00:00')])
+    self.assertFalse(r['missed'])
+
+  def test_LongPoll_Waits(self):
+    since = self.state.version
+    result = []
+    th = threading.Thread(target = lambda: result.append(self.Json('/events?since=%d' % since)))
+    th.start()
+    self.assertTrue(WaitFor(lambda: self.srv.subscribers == 1))
+    #State changes that aren't events don't end the wait
+    self.state.Update(last_heartbeat = 1)
+    time.sleep(0.1)
+    self.assertEqual(result, [])
+    self.state.Publish('boot')
+    th.join(2)
+    self.assertEqual([e['type'] for e in result[0]['events']], ['boot'])
+
+  def test_LongPoll_Timeout(self):
+    start = time.time()
+    r = self.Json('/events?since=%d&timeout=0.2' % self.state.version)
+    self.assertEqual(r['events'], [])
+    self.assertGreaterEqual(time.time() - start, 0.2)
+
+  def test_LongPoll_Missed(self):
+    for i in range(5):
+      self.state.Publish('closing', closing_time = None)
+    r = self.Json('/events?since=0')
+    self.assertTrue(r['missed'])
+    self.assertEqual(len(r['events']), 3)
+    self.assertFalse(self.Json('/events?since=2')['missed'])
+
+  def Subscribe(self, headers = ''):
+    s = socket.create_connection(('127.0.0.1', self.srv.port), 5)
+    s.sendall(('GET /events/stream HTTP/1.1\r\nHost: x\r\n' + headers + '\r\n').encode('ascii'))
+    return s
+
+  def ReadEvents(self, s, n):
+    #Returns the first n SSE events, as (id, event, data)
+    data = b''
+    while data.count(b'\r\n\r\n') < n + 2: #Headers and retry first
+      data += s.recv(4096)
+    events = []
+    for block in data.decode('ascii').split('\r\n\r\n')[2:2 + n]:
+      fields = dict(line.split(': ', 1) for line in block.split('\r\n'))
+      events.append((fields.get('id'), fields['event'], json.loads(fields['data'])))
+    return events
+
+  def test_Stream(self):
+    s = self.Subscribe()
+    self.assertTrue(WaitFor(lambda: self.srv.subscribers == 1))
+    self.state.Publish('closing', closing_time = '21:30:00')
+    self.state.Publish('closing', closing_time = None)
+    events = self.ReadEvents(s, 2)
+    self.assertEqual([e[2]['closing_time'] for e in events], ['21:30:00', None])
+    self.assertEqual(events[1][0], self.state.id + '-' + str(self.state.version))
+    s.close()
+    #Reconnecting with the last id seen resumes from there
+    s = self.Subscribe('Last-Event-ID: ' + events[0][0] + '\r\n')
+    self.assertEqual(self.ReadEvents(s, 1)[0][2]['closing_time'], None)
+    s.close()
+
+  def test_Stream_AfterRestart(self):
+    #The client saw version 57 of the previous process, which is further
+    #than this one has got: it gets what this one has, and is told it missed
+    #the rest
+    self.state.Publish('boot')
+    self.state.Publish('closing', closing_time = '21:30:00')
+    s = self.Subscribe('Last-Event-ID: 0123abcd-57\r\n')
+    data = b''
+    while data.count(b'\r\n\r\n') < 5:
+      data += s.recv(4096)
+    s.close()
+    blocks = data.decode('ascii').split('\r\n\r\n')[2:5]
+    self.assertEqual(blocks[0], 'event: missed\r\ndata: {}')
+    self.assertIn('event: boot', blocks[1])
+    self.assertIn('event: closing', blocks[2])
+
+  def test_LongPoll_AfterRestart(self):
+    self.state.Publish('boot')
+    self.state.Publish('closing', closing_time = '21:30:00')
+    r = self.Json('/events?since=57')
+    self.assertTrue(r['missed'])
+    self.assertEqual([e['type'] for e in r['events']], ['boot', 'closing'])
+    self.assertEqual(r['version'], 2)
+
+  def test_Stream_ManySubscribers(self):
+    #Idle subscribers don't cost a thread each
+    threads = threading.active_count()
+    subs = [self.Subscribe() for i in range(200)]
+    self.assertTrue(WaitFor(lambda: self.srv.subscribers == 200, 5))
+    self.assertLessEqual(threading.active_count(), threads + 1)
+    self.state.Publish('boot')
+    for s in subs:
+      self.assertEqual(self.ReadEvents(s, 1)[0][1], 'boot')
+      s.close()
+    self.assertTrue(WaitFor(lambda: self.srv.subscribers == 0, 20))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+import main
+from boards import BoardManager
+from emulator import SpaceTimeEmulator
+from eventlog import EventLog
+from runtime import Runtime
+from scheduler import Scheduler
+from spacetime import SpaceTime
+from statestore import StateStore
+from timeutil import ClockTime
+from testutil import WaitFor
+
+#To run these unit tests from command line:
+#python -m unittest test_reconnect
+
+#These tests unplug an emulated board (emulator.py) from under a running
+#Runtime and plug it back in, so they need Linux but no hardware.
+
+class FakeWebApi:
+  def __init__(self):
+    self.updates = []
+
+  def Update(self, *args):
+    self.updates.append(args)
+    return True
+
+class ReconnectCase(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.emu = SpaceTimeEmulator(boot = False, link = os.path.join(self.dir, 'spacetime')).Start()
+    self.st = SpaceTime(self.emu.device)
+    self.msgs = []
+    self.rt = Runtime(self.st, self.OnMsg, self.MakeScheduler())
+
+  def MakeScheduler(self):
+    return Scheduler()
+
+  def Start(self):
+    self.th = threading.Thread(target = self.rt.Run)
+    self.th.daemon = True
+    self.th.start()
+    time.sleep(0.1)
+
+  def tearDown(self):
+    self.rt.Stop()
+    self.th.join(2)
+    self.st.Close()
+    if self.emu.running:
+      self.emu.Stop()
+    shutil.rmtree(self.dir)
+
+  def OnMsg(self, msg):
+    self.msgs.append(msg)
+
+  def Unplug(self):
+    self.emu.Unplug()
+    self.assertTrue(WaitFor(lambda: not self.st.connected, 2))
+
+class TestReconnect(ReconnectCase):
+
+  def setUp(self):
+    ReconnectCase.setUp(self)
+    self.Start()
+
+  def test_QueuedWhileUnplugged(self):
+    self.Unplug()
+    cmd = self.st.SetTime(1, ClockTime.Parse('21:30:00'))
+    time.sleep(0.3)
+    self.assertEqual(self.st.commands.Pending(), 1)
+    self.emu.Replug()
+    self.assertEqual(cmd.Wait(5).val, '21:30:00')
+    self.assertEqual(self.emu.clocks['1'], ClockTime.Parse('21:30:00').Seconds())
+    self.assertTrue(self.st.connected)
+    #Measured from losing the port, which was gone for at least 0.3s
+    self.assertGreaterEqual(self.st.reconnectTime, 0.3)
+    self.assertLess(self.st.reconnectTime, 2)
+
+  def test_InflightReplayed(self):
+    self.emu.latency = 0.3
+    cmd = self.st.GetTime(0)
+    self.assertTrue(WaitFor(lambda: self.emu.received == 1, 1))
+    #Unplugged before the reply goes out
+    self.Unplug()
+    self.emu.latency = 0
+    self.emu.Replug()
+    self.assertTrue(cmd.Wait(5))
+    self.assertEqual(cmd.error, None)
+
+  def test_NewPortWatched(self):
+    self.Unplug()
+    self.emu.Replug()
+    self.assertTrue(WaitFor(lambda: self.st.connected))
+    self.emu.Keypad('1', '22:15')
+    self.assertTrue(WaitFor(lambda: [m for m in self.msgs if m.type == 'Closing'], 2))
+
+  def test_Backoff(self):
+    self.Unplug()
+    time.sleep(1)
+    self.emu.Replug()
+    self.assertTrue(WaitFor(lambda: self.st.connected))
+    #Keeps trying, but not much more often than reconnectMin
+    self.assertLess(self.st.reconnectTime, 1 + SpaceTime.reconnectMax)
+
+class TestResync(ReconnectCase):
+  #What main does once a board is back
+
+  def setUp(self):
+    self.saved = main.manager, main.state, main.scheduler, main.dispatcher, main.history
+    main.history = EventLog(tempfile.mkdtemp())
+    main.manager = BoardManager()
+    main.state = StateStore()
+    main.dispatcher = None
+    self.web = FakeWebApi()
+    ReconnectCase.setUp(self)
+    main.manager.Add(self.st)
+    self.st.listeners.append(main.OnConnection)
+
+  def MakeScheduler(self):
+    main.scheduler = Scheduler()
+    return main.scheduler
+
+  def OnMsg(self, msg):
+    main.ProcessSerialMsg(msg, self.web, self.st)
+
+  def tearDown(self):
+    ReconnectCase.tearDown(self)
+    shutil.rmtree(main.history.path)
+    main.history.Close()
+    main.manager, main.state, main.scheduler, main.dispatcher, main.history = self.saved
+
+  def test_ClosingTimeChanged(self):
+    self.Start()
+    self.Unplug()
+    self.assertFalse(main.state.Get('boards')[main.manager.boards[0].name]['connected'])
+    #Set on the keypad while unplugged, so nothing heard about it
+    with self.emu.lock:
+      self.emu.clocks['1'] = ClockTime.Parse('23:00:00').Seconds()
+    self.emu.Replug()
+    self.assertTrue(WaitFor(lambda: self.web.updates == [('open', '23:00')]))
+    self.assertEqual(main.manager.boards[0].closing_time, '23:00:00')
+    self.assertTrue(main.state.Get('boards')[main.manager.boards[0].name]['connected'])
+
+  def test_ClockResynced(self):
+    self.Start()
+    self.Unplug()
+    self.emu.Replug()
+    #The board's clock is asked for, and will be set since it was never set
+    board = main.manager.boards[0]
+    self.assertTrue(WaitFor(lambda: board.last_sync != None))
+    self.assertTrue(WaitFor(lambda: main.scheduler.When(board.Job('clock set')) != None))
@@ -0,0 +1,103 @@
+import unittest
+import os
+import threading
+import time
+from spacetime import SpaceTime
+from runtime import Runtime
+
+#To run these unit tests from command line:
+#python -m unittest test_runtime
+
+#These tests stand in for the SpaceTime board with a pseudo-terminal,
+#so they need Linux but no hardware.
+
+class TestRuntime(unittest.TestCase):
+
+  def setUp(self):
+    self.master, slave = os.openpty()
+    self.st = SpaceTime(os.ttyname(slave))
+    os.close(slave)
+    self.msgs = []
+    self.received = threading.Event()
+    self.rt = Runtime(self.st, self.OnMsg)
+
+  def tearDown(self):
+    self.rt.Stop()
+    self.th.join(2)
+    self.st.serial.close()
+    os.close(self.master)
+
+  def OnMsg(self, msg):
+    self.msgs.append((time.time(), msg))
+    self.received.set()
+
+  def Start(self):
+    self.th = threading.Thread(target = self.rt.Run)
+    self.th.daemon = True
+    self.th.start()
+    time.sleep(0.1)
+
+  def test_Dispatch_Latency(self):
+    self.Start()
+    sent = time.time()
+    os.write(self.master, b'Closing time: 21:30:00\r\n')
+    self.assertTrue(self.received.wait(1))
+    t, msg = self.msgs[0]
+    self.assertEqual(msg.type, 'Closing')
+    self.assertEqual(msg.val, '21:30:00')
+    #Well under the 1s polling interval of loop()
+    self.assertLess(t - sent, 0.05)
+
+  def test_Dispatch_PartialLine(self):
+    self.Start()
+    os.write(self.master, b'Current ti')
+    self.assertFalse(self.received.wait(0.2))
+    os.write(self.master, b'me: 08:00:20\r\nOK\r\n')
+    self.assertTrue(self.received.wait(1))
+    time.sleep(0.1)
+    self.assertEqual([m.type for t, m in self.msgs], ['Current', 'OK'])
+
+  def test_Dispatch_WaitingBeforeRun(self):
+    #Data that arrived before the Runtime started is still processed
+    os.write(self.master, b'SpaceTime, yay!\r\n')
+    time.sleep(0.1)
+    self.Start()
+    self.assertTrue(self.received.wait(1))
+    self.assertEqual(self.msgs[0][1].type, 'Boot')
+
+  def test_Job(self):
+    fired = []
+    due = time.time() + 0.2
+    self.rt.scheduler.Schedule('job', due, lambda: fired.append(time.time()))
+    self.Start()
+    time.sleep(0.5)
+    self.assertEqual(len(fired), 1)
+    self.assertAlmostEqual(fired[0], due, delta = 0.05)
+
+  def test_Job_Interval(self):
+    fired = []
+    self.rt.scheduler.Schedule('job', 0, lambda: fired.append(time.time()), interval = 0.3)
+    self.Start()
+    time.sleep(0.35)
+    self.assertEqual(len(fired), 2)
+    self.assertGreaterEqual(fired[1] - fired[0], 0.3)
+
+  def test_Job_FromOtherThread(self):
+    #A job added while the Runtime sleeps wakes it up
+    fired = threading.Event()
+    self.rt.scheduler.Schedule('later', time.time() + 60, lambda: None)
+    self.Start()
+    due = time.time() + 0.1
+    self.rt.scheduler.Schedule('sooner', due, fired.set)
+    self.assertTrue(fired.wait(1))
+    self.assertAlmostEqual(time.time(), due, delta = 0.05)
+
+  def test_CommandExpiry(self):
+    #Commands SpaceTime never replies to are given up on by the Runtime
+    self.Start()
+    cmd = self.st.SerialCommand('AT', timeout = 0.1)
+    time.sleep(0.3)
+    self.assertEqual(cmd.error, 'Timeout')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import time
+from scheduler import Scheduler, InMinuteWindow
+
+#To run these unit tests from command line:
+#python -m unittest test_scheduler
+
+class TestScheduler(unittest.TestCase):
+
+  def setUp(self):
+    self.s = Scheduler()
+    self.ran = []
+
+  def Job(self, name):
+    return lambda: self.ran.append(name)
+
+  def test_Order(self):
+    self.s.Schedule('b', 200, self.Job('b'))
+    self.s.Schedule('a', 100, self.Job('a'))
+    self.s.Schedule('c', 300, self.Job('c'))
+    self.assertEqual(self.s.NextDeadline(), 100)
+    self.assertEqual(self.s.RunDue(250), 2)
+    self.assertEqual(self.ran, ['a', 'b'])
+    self.assertEqual(self.s.NextDeadline(), 300)
+    self.assertEqual(self.s.When('a'), None)
+
+  def test_Reschedule(self):
+    #Scheduling a name again replaces the pending job
+    self.s.Schedule('heartbeat', 100, self.Job('old'))
+    self.s.Schedule('heartbeat', 500, self.Job('new'))
+    self.assertEqual(self.s.RunDue(400), 0)
+    self.assertTrue(self.s.Reschedule('heartbeat', 50))
+    self.assertEqual(self.s.NextDeadline(), 50)
+    self.s.RunDue(1000)
+    self.assertEqual(self.ran, ['new'])
+    self.assertFalse(self.s.Reschedule('heartbeat', 50))
+
+  def test_Reschedule_Same(self):
+    #The same deadline again (with a new lambda, as callers pass) doesn't
+    #move the job or wake anyone
+    changes = []
+    job = self.s.Schedule('sync', 100, lambda: self.ran.append('old'))
+    self.s.onChange = lambda: changes.append(1)
+    self.assertIs(self.s.Schedule('sync', 100, lambda: self.ran.append('new')), job)
+    self.assertEqual(changes, [])
+    self.assertEqual(len(self.s.heap), 1)
+    self.s.RunDue(100)
+    self.assertEqual(self.ran, ['new'])
+
+  def test_Cancel(self):
+    self.s.Schedule('a', 100, self.Job('a'))
+    self.s.Schedule('b', 200, self.Job('b'))
+    self.s.Cancel('a')
+    self.s.Schedule('b', None, self.Job('b'))
+    self.assertEqual(self.s.NextDeadline(), None)
+    self.assertEqual(self.s.RunDue(1000), 0)
+
+  def test_Interval(self):
+    self.s.Schedule('tick', 100, self.Job('tick'), interval = 10)
+    for t in (100, 105, 110, 120):
+      self.s.RunDue(t)
+    self.assertEqual(len(self.ran), 3)
+    self.assertEqual(self.s.When('tick'), 130)
+    self.assertEqual(self.s.jobs['tick'].runs, 3)
+
+  def test_JobSchedulesJobs(self):
+    def First():
+      self.ran.append('first')
+      self.s.Schedule('second', 0, self.Job('second'))
+    self.s.Schedule('first', 0, First)
+    self.assertEqual(self.s.RunDue(1), 2)
+    self.assertEqual(self.ran, ['first', 'second'])
+
+  def test_Exception(self):
+    #A failing job doesn't stop the others
+    self.s.Schedule('bad', 1, lambda: 1 / 0)
+    self.s.Schedule('good', 2, self.Job('good'))
+    self.assertEqual(self.s.RunDue(3), 2)
+    self.assertEqual(self.ran, ['good'])
+
+  def test_OnChange(self):
+    changes = []
+    self.s.onChange = lambda: changes.append(self.s.NextDeadline())
+    self.s.Schedule('a', 100, self.Job('a'))
+    self.s.Schedule('b', 200, self.Job('b')) #Not the next deadline
+    self.s.Schedule('c', 50, self.Job('c'))
+    self.assertEqual(changes, [100, 50])
+
+  def test_InMinuteWindow(self):
+    minute = time.mktime((2026, 1, 1, 12, 0, 0, 0, 0, -1))
+    self.assertEqual(InMinuteWindow(minute), minute + 41)
+    self.assertEqual(InMinuteWindow(minute + 45.5), minute + 45.5)
+    self.assertEqual(InMinuteWindow(minute + 50), minute + 101)
+    #Clock sync: 24h after the last one, in the next 41-50s window
+    s = self.s
+    s.Schedule('clock sync', minute + 10, self.Job('sync'), interval = 10, align = InMinuteWindow)
+    self.assertEqual(s.When('clock sync'), minute + 41)
+    s.RunDue(minute + 41)
+    self.assertEqual(s.When('clock sync'), minute + 41 + 60)
+    s.RunDue(minute + 49)
+    self.assertEqual(self.ran, ['sync'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from serialparser import *
+
+#To run these unit tests from command line:
+#python -m unittest test_serialparser
+
+class TestSerialParser(unittest.TestCase):
+
+  def Parse(self, *chunks):
+    p = SerialParser()
+    msgs = []
+    for c in chunks:
+      msgs += p.Feed(c)
+    return [(m.type, m.val) for m in msgs]
+
+  def test_Time(self):
+    self.assertEqual(self.Parse(b'Current time: 14:56:05\r\n'), [('Current', '14:56:05')])
+    self.assertEqual(self.Parse(b'Closing time: 23:30:00\r\n'), [('Closing', '23:30:00')])
+    self.assertEqual(self.Parse(b'Closing time: Not set\r\n'), [('Closing', None)])
+
+  def test_AmbiguousTime(self):
+    self.assertEqual(self.Parse(b'14:56:05\r\n'), [('AmbiguousTime', '14:56:05')])
+    self.assertEqual(self.Parse(b'Not set\r\n'), [('AmbiguousTime', None)])
+    self.assertEqual(self.Parse(b'24:56:05\r\n'), [('Unknown', '24:56:05\r\n')])
+    self.assertEqual(self.Parse(b'14:56\r\n'), [('Unknown', '14:56\r\n')])
+
+  def test_Results(self):
+    self.assertEqual(self.Parse(b'OK\r\n'), [('OK', 'OK\r\n')])
+    self.assertEqual(self.Parse(b'ERROR: Try AT?\r\n'), [('Error', 'ERROR: Try AT?\r\n')])
+    self.assertEqual(self.Parse(b'BUSY\r\n'), [('Busy', 'BUSY\r\n')])
+
+  def test_Echo(self):
+    self.assertEqual(self.Parse(b'ATST1=X\r\n'), [('Echo', 'ATST1=X\r\n')])
+    self.assertEqual(self.Parse(b'atst0?\r\n'), [('Echo', 'atst0?\r\n')])
+
+  def test_Boot(self):
+    self.assertEqual(self.Parse(b'\r\n*** BOOTED ***\r\nSpaceTime, yay!\r\n'),
+      [('Banner', '*** BOOTED ***\r\n'), ('Boot', 'SpaceTime, yay!\r\n')])
+
+  def test_Help(self):
+    msgs = self.Parse(b'AT?\r\nSpaceTime commands:\r\n  AT? - display this help\r\n'
+      b'  ATSTn? - display time: n=0 - current, 1 - closing, 2 - cleanup, 3 - countdown\r\n'
+      b'\r\nFor drift correction, set time with .cc twice, at least 1 hr apart.\r\n')
+    self.assertEqual([t for t, v in msgs], ['Echo', 'Help', 'Help', 'Help', 'Help'])
+
+  def test_Unknown(self):
+    self.assertEqual(self.Parse(b'Pizza\r\n'), [('Unknown', 'Pizza\r\n')])
+    self.assertEqual(self.Parse(b'SpaceTime, yay!!\r\n'), [('Unknown', 'SpaceTime, yay!!\r\n')])
+
+  def test_PartialLines(self):
+    self.assertEqual(self.Parse(b'Clos', b'ing time: 2', b'3:30:00\r', b'\nO', b'K\r\n'),
+      [('Closing', '23:30:00'), ('OK', 'OK\r\n')])
+    p = SerialParser()
+    self.assertEqual(p.Feed(b'Current time: 01:02'), [])
+
+  def test_ByteAtATime(self):
+    data = b'ATST0?\r\n14:56:05\r\nATST1=X\r\nClosing time: Not set\r\nOK\r\n'
+    msgs = self.Parse(*[data[i:i+1] for i in range(len(data))])
+    self.assertEqual([t for t, v in msgs], ['Echo', 'AmbiguousTime', 'Echo', 'Closing', 'OK'])
+
+  def test_LostCR(self):
+    self.assertEqual(self.Parse(b'OK\nClosing time: Not set\nOK\rOK\r\n'),
+      [('OK', 'OK\r\n'), ('Closing', None), ('OK', 'OK\r\n'), ('OK', 'OK\r\n')])
+
+  def test_Noise(self):
+    msgs = self.Parse(b'\x00\xff\xfe\r\nOK\r\n')
+    self.assertEqual(msgs[0][0], 'Unknown')
+    self.assertEqual(msgs[1], ('OK', 'OK\r\n'))
+    #A runaway line without a line ending is dropped, and parsing resumes
+    msgs = self.Parse(b'x' * 500, b'\r\nOK\r\n')
+    self.assertEqual(msgs[0][0], 'Unknown')
+    self.assertEqual(msgs[-1], ('OK', 'OK\r\n'))
+
+  def test_BufferReused(self):
+    p = SerialParser()
+    buf = p.buf
+    p.Feed(b'OK\r\nCurrent')
+    p.Feed(b' time: 01:02:03\r\n')
+    self.assertIs(p.buf, buf)
+    self.assertEqual(len(p.buf), 0)
+
+if __name__ == '__main__':
+  unittest.main()
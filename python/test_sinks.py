@@ -0,0 +1,198 @@
+import unittest
+import json
+import os
+import tempfile
+import threading
+import time
+import metrics
+from sinks import Dispatcher, Sink, FileSink, QueueSink, WebApiSink, VHSApiSink, WebhookSink, DoorEvent, IPEvent
+from stubserver import StubServer
+from webapi import WebApi
+from vhsapi import VHSApi
+from testutil import WaitFor
+
+#To run these unit tests from command line:
+#python -m unittest test_sinks
+
+class RecordingSink(Sink):
+  def __init__(self, name, delay = 0, results = None, coalesce = False, events = None, timeout = 10):
+    self.name = name
+    self.delay = delay
+    self.results = list(results or [])
+    self.coalesce = coalesce
+    self.events = events
+    self.timeout = timeout
+    self.delivered = []
+    self.release = threading.Event()
+    self.release.set()
+
+  def Deliver(self, event):
+    self.release.wait()
+    time.sleep(self.delay)
+    if self.results and not self.results.pop(0):
+      return False
+    self.delivered.append((time.time(), event))
+    return True
+
+class TestDispatcher(unittest.TestCase):
+
+  def setUp(self):
+    self.d = Dispatcher(workers = 3, backoffMin = 0.02, backoffMax = 0.1)
+
+  def tearDown(self):
+    for q in self.d.queues:
+      q.sink.release.set()
+    self.d.Stop()
+
+  def test_FanOut(self):
+    a, b = RecordingSink('a'), RecordingSink('b', events = ('door',))
+    self.d.Add(a)
+    self.d.Add(b)
+    self.d.Start()
+    self.d.Publish(DoorEvent('21:30:00'))
+    self.d.Publish(IPEvent('10.0.0.2'))
+    self.assertTrue(WaitFor(lambda: len(a.delivered) == 2 and len(b.delivered) == 1))
+    self.assertEqual([e['type'] for t, e in a.delivered], ['door', 'ip'])
+    self.assertEqual(b.delivered[0][1]['until'], '21:30')
+    self.assertEqual(self.d.Depth(), 0)
+
+  def test_Order(self):
+    #A failed delivery is retried before the events published after it
+    s = RecordingSink('q', results = [True, False, False, True, True, True])
+    self.d.Add(s)
+    self.d.Start()
+    for i in range(4):
+      self.d.Publish({'type': 'n', 'n': i})
+    self.assertTrue(WaitFor(lambda: len(s.delivered) == 4))
+    self.assertEqual([e['n'] for t, e in s.delivered], [0, 1, 2, 3])
+    self.assertEqual(self.d.Stats('q'), (4, 2, 0))
+    self.assertEqual(self.d.LastDelivered('q')['n'], 3)
+
+  def test_Coalesce(self):
+    s = RecordingSink('web', coalesce = True)
+    s.release.clear()
+    self.d.Add(s)
+    self.d.Start()
+    self.d.Publish(DoorEvent('21:30:00'))
+    time.sleep(0.05) #Now being delivered
+    self.d.Publish(DoorEvent('22:00:00'))
+    self.d.Publish(DoorEvent(None))
+    self.assertEqual(self.d.Depth(), 1)
+    s.release.set()
+    self.assertTrue(WaitFor(lambda: len(s.delivered) == 2))
+    self.assertEqual([e['status'] for t, e in s.delivered], ['open', 'closed'])
+
+  def test_SlowSinkIsolated(self):
+    slow, fast = RecordingSink('slow'), RecordingSink('fast')
+    slow.release.clear()
+    self.d.Add(slow)
+    self.d.Add(fast)
+    self.d.Start()
+    start = time.time()
+    for i in range(5):
+      self.d.Publish({'type': 'n', 'n': i})
+    self.assertTrue(WaitFor(lambda: len(fast.delivered) == 5))
+    self.assertLess(fast.delivered[-1][0] - start, 0.5)
+    self.assertEqual(slow.delivered, [])
+    #The slow sink only holds one worker, and gets everything once it's back
+    self.assertEqual(self.d.Depth(), 4)
+    slow.release.set()
+    self.assertTrue(WaitFor(lambda: len(slow.delivered) == 5))
+
+  def test_Bounded(self):
+    s = RecordingSink('q')
+    s.maxlen = 3
+    self.d.Add(s)
+    for i in range(5):
+      self.d.Publish({'type': 'n', 'n': i})
+    self.assertEqual(self.d.Depth(), 3)
+    self.d.Start()
+    self.assertTrue(WaitFor(lambda: len(s.delivered) == 3))
+    self.assertEqual([e['n'] for t, e in s.delivered], [2, 3, 4])
+    self.assertEqual(self.d.Stats('q')[2], 2)
+
+  def test_Timeout(self):
+    s = RecordingSink('late', delay = 0.06, results = [False, True], timeout = 0.05)
+    results = []
+    self.d.Add(s)
+    self.d.onResult = lambda *r: results.append(r)
+    self.d.Start()
+    self.d.Publish({'type': 'n'})
+    self.assertTrue(WaitFor(lambda: len(s.delivered) == 1))
+    self.assertEqual(results, [('late', False, 1), ('late', True, 2)])
+    self.assertIn('sink_deliveries_total{sink="late",result="timeout"} 1', metrics.registry.Render())
+    self.assertIn('sink_delivery_seconds_count{sink="late"} 2', metrics.registry.Render())
+
+  def test_Offline(self):
+    web, local = RecordingSink('web'), RecordingSink('local')
+    web.network = True
+    self.d.Add(web)
+    self.d.Add(local)
+    self.d.SetOnline(False)
+    self.d.Start()
+    self.d.Publish(DoorEvent('21:30:00'))
+    self.assertTrue(WaitFor(lambda: len(local.delivered) == 1))
+    time.sleep(0.05)
+    #Held, not failed and backing off
+    self.assertEqual(web.delivered, [])
+    self.assertEqual(self.d.Stats('web'), (0, 0, 0))
+    self.d.SetOnline(True)
+    self.assertTrue(WaitFor(lambda: len(web.delivered) == 1, 0.5))
+
+  def test_DuplicateName(self):
+    self.d.Add(RecordingSink('a'))
+    self.assertRaises(ValueError, self.d.Add, RecordingSink('a'))
+
+class TestSinks(unittest.TestCase):
+
+  def test_FileSink(self):
+    path = os.path.join(tempfile.mkdtemp(), 'status.json')
+    FileSink(path).Deliver(DoorEvent('21:30:00'))
+    with open(path) as f:
+      self.assertEqual(json.load(f)['closing_time'], '21:30:00')
+    self.assertFalse(os.path.exists(path + '.tmp'))
+
+  def test_QueueSink(self):
+    s = QueueSink(maxsize = 1, timeout = 0.01)
+    self.assertTrue(s.Deliver({'type': 'n', 'n': 1}))
+    self.assertFalse(s.Deliver({'type': 'n', 'n': 2}))
+    self.assertEqual(s.Get(0.1)['n'], 1)
+    self.assertEqual(s.Get(0.01), None)
+
+  def test_WebApiSink(self):
+    stub = StubServer()
+    stub.Start()
+    try:
+      s = WebApiSink(WebApi(dataURL = stub.webURL))
+      self.assertNotEqual(s.Deliver(DoorEvent('21:30:00')), False)
+      self.assertEqual(stub.status['status'], 'open')
+      self.assertNotEqual(s.Deliver(DoorEvent(None)), False)
+      self.assertEqual(stub.status['status'], 'closed')
+    finally:
+      stub.Stop()
+
+  def test_VHSApiSink(self):
+    stub = StubServer()
+    stub.Start()
+    try:
+      vhs = VHSApi(dataURL = stub.vhsURL)
+      s = VHSApiSink(vhs)
+      #Time for both the Query and the Update
+      self.assertEqual(s.timeout, 2 * vhs.timeout)
+      self.assertNotEqual(s.Deliver(IPEvent('10.0.0.2')), False)
+      self.assertEqual(vhs.Query('spacetime_ip'), '10.0.0.2')
+    finally:
+      stub.Stop()
+
+  def test_WebhookSink(self):
+    stub = StubServer()
+    stub.Start()
+    try:
+      self.assertTrue(WebhookSink(stub.url + '/hook').Deliver(IPEvent('10.0.0.2')))
+      self.assertEqual(stub.hooks[0]['ip'], '10.0.0.2')
+      self.assertFalse(WebhookSink(stub.url + '/nohook').Deliver(IPEvent('10.0.0.2')))
+    finally:
+      stub.Stop()
+
+if __name__ == '__main__':
+  unittest.main()
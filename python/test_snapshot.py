@@ -0,0 +1,53 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import time
+import main
+from snapshot import Snapshot
+
+#To run these unit tests from command line:
+#python -m unittest test_snapshot
+
+class TestSnapshot(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'state.json')
+    self.state = {'isvhsopen': None, 'vhsapi_ip': '10.0.0.2', 'boards': {}}
+    self.snap = Snapshot(self.path, lambda: self.state, main.CheckSnapshotState)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def Write(self, saved):
+    with open(self.path, 'w') as f:
+      json.dump(saved, f)
+
+  def test_SaveAndLoad(self):
+    self.assertTrue(self.snap.Save())
+    #Unchanged, so not written again
+    self.assertFalse(self.snap.Save())
+    self.assertEqual(self.snap.Load(60), self.state)
+    self.assertEqual(self.snap.Load(60, now = time.time() + 120), None)
+
+  def test_Corrupt(self):
+    with open(self.path, 'w') as f:
+      f.write('{"version": 1, "sav')
+    self.assertEqual(self.snap.Load(60), None)
+
+  def test_MissingKeys(self):
+    #Valid JSON, but not all there: a cold start, not a failed one
+    self.Write({'version': 1, 'state': self.state})
+    self.assertEqual(self.snap.Load(60), None)
+    self.Write({'version': 1, 'saved_at': time.time()})
+    self.assertEqual(self.snap.Load(60), None)
+    self.Write({'version': 1, 'saved_at': time.time(), 'state': {'isvhsopen': {'closing_time': None}, 'boards': {}}})
+    self.assertEqual(self.snap.Load(60), None)
+    self.Write({'version': 1, 'saved_at': time.time(), 'state': {'isvhsopen': None,
+      'boards': {'front': {'closing_time': None, 'current_time': None, 'last_sync': 5, 'drift': {'samples': []}}}}})
+    self.assertEqual(self.snap.Load(60), None)
+
+if __name__ == '__main__':
+  unittest.main()
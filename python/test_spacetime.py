@@ -1,18 +1,41 @@
 import unittest
+import os
 import serial
 from timeutil import *
+import spacetime
 from spacetime import *
+from emulator import SpaceTimeEmulator
 
 #To run these unit tests from command line:
 #python -m unittest test_spacetime
 
+#The tests talk to the board on /dev/ttyAMA0 if there is one, and otherwise
+#to the emulator (see emulator.py). Set SPACETIME_DEVICE to choose another
+#serial port, or to 'emulator' to always use the emulator.
+device = os.environ.get('SPACETIME_DEVICE', '/dev/ttyAMA0' if os.path.exists('/dev/ttyAMA0') else 'emulator')
+emulator = None
+
+def setUpModule():
+  global device, emulator
+  if device == 'emulator':
+    emulator = SpaceTimeEmulator(boot = False).Start()
+    device = emulator.device
+
+def tearDownModule():
+  if emulator != None:
+    emulator.Stop()
+
+def SpaceTime():
+  #The SpaceTime from spacetime.py, on the device under test
+  return spacetime.SpaceTime(device)
+
 class TestSpaceTime(unittest.TestCase):
   
   def test_ClearSerial(self):
     st = SpaceTime()
     st.ClearSerial()
     self.assertEqual(st.serial.inWaiting(), 0)
-    st.serial.write('AT\r\nRandom')
+    st.serial.write(b'AT\r\nRandom')
     time.sleep(0.25)
     #SpaceTime should echo 'AT\r\nRandom' and respond to AT with 'OK\r\n', hence 14 characters.
     self.assertEqual(st.serial.inWaiting(), 14)
@@ -22,26 +45,26 @@ class TestSpaceTime(unittest.TestCase):
     #Verify input buffer is empty
     self.assertEqual(st.serial.inWaiting(), 0)
     #Verify SpaceTime's buffer by sending and receiving some commands.
-    st.serial.write('AT' + CRLF)
-    self.assertEqual(st.serial.readline(), 'AT' + CRLF)
-    self.assertEqual(st.serial.readline(), 'OK' + CRLF)
+    st.serial.write(('AT' + CRLF).encode(ENCODING))
+    self.assertEqual(st.ReadLine(), 'AT' + CRLF)
+    self.assertEqual(st.ReadLine(), 'OK' + CRLF)
     
   def test_CanRead(self):
     st = SpaceTime()
     st.ClearSerial()
     self.assertFalse(st.CanRead())
-    st.serial.write('AT')
+    st.serial.write(b'AT')
     time.sleep(0.25)
     self.assertTrue(st.CanRead())
     st.serial.read() #Read 'A'
     self.assertTrue(st.CanRead())
     st.serial.read() #Read 'T'
     self.assertFalse(st.CanRead())
-    st.serial.write(CRLF)
+    st.serial.write(CRLF.encode(ENCODING))
     time.sleep(0.25)
     self.assertTrue(st.CanRead())
-    st.serial.readline() #Read '\r\n'
-    st.serial.readline() #Read 'OK\r\n'
+    st.ReadLine() #Read '\r\n'
+    st.ReadLine() #Read 'OK\r\n'
     self.assertFalse(st.CanRead())
     
   def test_IsConnected_Success(self):
@@ -49,7 +72,7 @@ class TestSpaceTime(unittest.TestCase):
     st.ClearSerial()
     self.assertTrue(st.IsConnected())
     #Make sure the buffers aren't polluted from IsConnected().
-    st.serial.write(CRLF)
+    st.serial.write(CRLF.encode(ENCODING))
     self.assertFalse(st.CanRead())
     
   def test_IsConnected_Timeout(self):
@@ -62,34 +85,34 @@ class TestSpaceTime(unittest.TestCase):
     st = SpaceTime()
     st.ClearSerial()
     st.SerialCommand('AT')
-    self.assertEqual(st.serial.readline(), 'AT' + CRLF)
-    self.assertEqual(st.serial.readline(), 'OK' + CRLF)
+    self.assertEqual(st.ReadLine(), 'AT' + CRLF)
+    self.assertEqual(st.ReadLine(), 'OK' + CRLF)
     
   def test_SetTime(self):
     st = SpaceTime()
     st.ClearSerial()
     t = '14:56:05'
-    st.SetTime(0, StrToTime(t))
-    self.assertEqual(st.serial.readline(), 'ATST0=14:56:05' + CRLF)
-    self.assertEqual(st.serial.readline(), 'Current time: 14:56:05' + CRLF)
+    st.SetTime(0, ClockTime.Parse(t))
+    self.assertEqual(st.ReadLine(), 'ATST0=14:56:05' + CRLF)
+    self.assertEqual(st.ReadLine(), 'Current time: 14:56:05' + CRLF)
     
   def test_GetTime(self):
     st = SpaceTime()
     st.ClearSerial()
-    st.serial.write('ATST0=14:56:05' + CRLF)
-    st.serial.readline()  #Read echo of above command
-    st.serial.readline()  #Read current time response
-    st.serial.readline()  #Read OK
+    st.serial.write(('ATST0=14:56:05' + CRLF).encode(ENCODING))
+    st.ReadLine()  #Read echo of above command
+    st.ReadLine()  #Read current time response
+    st.ReadLine()  #Read OK
     st.GetTime(0)
-    self.assertEqual(st.serial.readline(), 'ATST0?' + CRLF)
-    self.assertEqual(st.serial.readline(), '14:56:05' + CRLF)
+    self.assertEqual(st.ReadLine(), 'ATST0?' + CRLF)
+    self.assertEqual(st.ReadLine(), '14:56:05' + CRLF)
     
   def test_ClearTime(self):
     st = SpaceTime()
     st.ClearSerial()
     st.ClearTime(1)
-    self.assertEqual(st.serial.readline(), 'ATST1=X' + CRLF)
-    self.assertEqual(st.serial.readline(), 'Closing time: Not set' + CRLF)
+    self.assertEqual(st.ReadLine(), 'ATST1=X' + CRLF)
+    self.assertEqual(st.ReadLine(), 'Closing time: Not set' + CRLF)
     
   #----Read----
     
@@ -105,7 +128,7 @@ class TestSpaceTime(unittest.TestCase):
     st = SpaceTime()
     st.ClearSerial()
     st.SerialCommand('AT')
-    st.serial.readline()  #Read echo of above command
+    st.ReadLine()  #Read echo of above command
     r = st.Read()
     self.assertEqual(r.type, 'OK')
     self.assertEqual(r.val, 'OK' + CRLF)
@@ -114,35 +137,37 @@ class TestSpaceTime(unittest.TestCase):
     st = SpaceTime()
     st.ClearSerial()
     t = '14:56:05'
-    st.SetTime(0, StrToTime(t))
-    st.serial.readline()  #Read echo of above command
+    st.SetTime(0, ClockTime.Parse(t))
+    st.Read()      #Read echo of above command
     r = st.Read()         #Read response to SetTime command
     #Response to SetTime specifies clock name 'Current'
     self.assertEqual(r.type, 'Current')
     self.assertEqual(r.val, t)
-    st.serial.readline()  #Read OK
+    st.Read()      #Read OK
     st.GetTime(0)
-    st.serial.readline()  #Read echo of above command
+    st.Read()      #Read echo of above command
     r = st.Read()         #Read response to GetTime command
-    #Ambiguous because response to GetTime doesn't specify clock name
-    self.assertEqual(r.type, 'AmbiguousTime')
+    #Response to GetTime doesn't specify clock name, but it is
+    #labelled by matching it to the GetTime command
+    self.assertEqual(r.type, 'Current')
     self.assertEqual(r.val, t)
     
   def test_Read_Time_Not_Set(self):
     st = SpaceTime()
     st.ClearSerial()
     st.ClearTime(1)
-    st.serial.readline()  #Read echo of above command
+    st.Read()      #Read echo of above command
     r = st.Read()         #Read response to ClearTime command
     #Response to SetTime specifies clock name 'Closing'
     self.assertEqual(r.type, 'Closing')
     self.assertEqual(r.val, None)
-    st.serial.readline()  #Read OK
+    st.Read()      #Read OK
     st.GetTime(1)
-    st.serial.readline()  #Read echo of above command
+    st.Read()      #Read echo of above command
     r = st.Read()         #Read response to GetTime command
-    #Ambiguous because response to GetTime doesn't specify clock name
-    self.assertEqual(r.type, 'AmbiguousTime')
+    #Response to GetTime doesn't specify clock name, but it is
+    #labelled by matching it to the GetTime command
+    self.assertEqual(r.type, 'Closing')
     self.assertEqual(r.val, None)
     
   def test_Read_Unknown(self):
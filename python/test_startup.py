@@ -0,0 +1,209 @@
+import unittest
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import main
+from bench_latency import FreePort
+from boards import BoardManager
+from emulator import SpaceTimeEmulator
+from eventlog import EventLog
+from milestones import Milestones
+from runtime import Runtime
+from scheduler import Scheduler
+from snapshot import Snapshot, avoided
+from statestore import StateStore
+from stubserver import StubServer
+from vhsapi import VHSApi
+from webapi import WebApi
+from testutil import WaitFor
+
+#To run these unit tests from command line:
+#python -m unittest test_startup
+
+#These tests run main.setup() against an emulated board (emulator.py) and a
+#local stand-in for the web APIs (stubserver.py), so they need Linux but no
+#hardware or internet.
+
+class StartupCase(unittest.TestCase):
+
+  def setUp(self):
+    self.saved = main.manager, main.state, main.scheduler, main.dispatcher, main.startup, main.history, main.snapshot, main.ip_watcher
+    self.dir = tempfile.mkdtemp()
+    main.history = EventLog(self.dir)
+    self.Reset()
+    self.emu = SpaceTimeEmulator(boot = False).Start()
+    #Every request fails, as if the internet were down
+    self.stub = StubServer(failureRate = 1)
+    self.stub.Start()
+    self.port = FreePort()
+
+  def Reset(self):
+    #What a new process would start with
+    main.manager = BoardManager()
+    main.state = StateStore()
+    main.scheduler = Scheduler()
+    main.startup = Milestones()
+    main.dispatcher = None
+    main.snapshot = Snapshot(os.path.join(self.dir, 'state.json'), main.SnapshotState, main.CheckSnapshotState)
+
+  def Shutdown(self):
+    if main.dispatcher != None:
+      main.dispatcher.Stop()
+    main.snapshot.Stop()
+    if main.ip_watcher != None:
+      main.ip_watcher.Stop()
+      main.ip_watcher = None
+    for board in main.manager.boards:
+      board.st.Close()
+
+  def tearDown(self):
+    self.Shutdown()
+    self.emu.Stop()
+    self.stub.Stop()
+    main.history.Close()
+    shutil.rmtree(self.dir)
+    main.manager, main.state, main.scheduler, main.dispatcher, main.startup, main.history, main.snapshot, main.ip_watcher = self.saved
+
+  def Status(self, path = '/status'):
+    c = http.client.HTTPConnection('127.0.0.1', self.port, timeout = 2)
+    try:
+      c.request('GET', path)
+      return json.loads(c.getresponse().read())
+    except OSError:
+      return None
+    finally:
+      c.close()
+
+class TestStartup(StartupCase):
+
+  def test_Offline(self):
+    start = time.time()
+    web, st = main.setup([('front', self.emu.device)], WebApi(dataURL = self.stub.webURL),
+      VHSApi(dataURL = self.stub.vhsURL), self.port)
+    #Doesn't wait for the internet
+    self.assertLess(time.time() - start, 3)
+    self.assertTrue(WaitFor(lambda: self.Status() != None, 2))
+    self.assertNotEqual(main.startup.Get('serial'), None)
+    self.assertEqual(main.startup.Get('online'), None)
+    #Updates are queued until the internet is back
+    main.UpdateDoorStatus(web, '21:30:00')
+    time.sleep(0.1)
+    self.assertEqual(main.dispatcher.Depth(), 2)
+    self.assertEqual(self.stub.status['status'], 'closed')
+    self.stub.failureRate = 0
+    self.assertTrue(WaitFor(lambda: main.startup.Get('web_update') != None))
+    self.assertEqual(self.stub.status['status'], 'open')
+    self.assertTrue(WaitFor(lambda: 'spacetime_ip' in self.stub.data))
+    milestones = self.Status()['startup']
+    self.assertLessEqual(milestones['serial'], milestones['online'])
+    self.assertLessEqual(milestones['online'], milestones['web_update'])
+    #The delivery is in the local history
+    events = self.Status('/history?type=delivery')['events']
+    self.assertIn(('isvhsopen', True), [(e['source'], e['ok']) for e in events])
+
+  def test_AbsentBoard(self):
+    #One board of two isn't plugged in: the other one is served without it
+    self.emu.clocks['1'] = 21 * 3600 + 30 * 60
+    back = os.path.join(self.dir, 'back')
+    start = time.time()
+    web, st = main.setup([('front', self.emu.device), ('back', back)], WebApi(dataURL = self.stub.webURL),
+      VHSApi(dataURL = self.stub.vhsURL), self.port)
+    self.assertLess(time.time() - start, 3)
+    rt = Runtime(st, lambda msg: main.ProcessSerialMsg(msg, web, st), main.scheduler)
+    other = main.manager.boards[1].st
+    rt.Add(other, lambda msg: main.ProcessSerialMsg(msg, web, other))
+    th = threading.Thread(target = rt.Run)
+    th.daemon = True
+    th.start()
+    try:
+      self.assertTrue(WaitFor(lambda: main.manager.Primary().closing_time == '21:30:00'))
+      #Once it's plugged in, it catches up with the front board
+      emu = SpaceTimeEmulator(boot = False, link = back).Start()
+      try:
+        self.assertTrue(WaitFor(lambda: emu.clocks['1'] == 21 * 3600 + 30 * 60, 10))
+        self.assertTrue(other.connected)
+      finally:
+        other.Close()
+        emu.Stop()
+    finally:
+      rt.Stop()
+      th.join(2)
+
+class TestWarmRestart(StartupCase):
+  #Restarts against the same board and web APIs, with the state snapshot
+  #the first run left
+
+  def setUp(self):
+    StartupCase.setUp(self)
+    self.stub.failureRate = 0
+    #The board is open until 21:30, with its clock right
+    lt = time.localtime()
+    self.emu.clocks['0'], self.emu.setAt = (lt.tm_hour * 60 + lt.tm_min) * 60 + lt.tm_sec, time.time()
+    self.emu.clocks['1'] = 21 * 3600 + 30 * 60
+
+  def Start(self):
+    #main.setup(), and main.run() on a thread
+    web, st = main.setup([('front', self.emu.device)], WebApi(dataURL = self.stub.webURL),
+      VHSApi(dataURL = self.stub.vhsURL), FreePort())
+    self.rt = Runtime(st, lambda msg: main.ProcessSerialMsg(msg, web, st), main.scheduler)
+    th = threading.Thread(target = self.rt.Run)
+    th.daemon = True
+    th.start()
+    return th
+
+  def Restart(self):
+    self.rt.Stop()
+    self.th.join(2)
+    self.Shutdown()
+    self.Reset()
+    self.avoided = dict((call, avoided.Labels(call).Get()) for call in ('isvhsopen', 'vhsapi', 'clock_query'))
+    self.th = self.Start()
+
+  def Avoided(self, call):
+    return avoided.Labels(call).Get() - self.avoided[call]
+
+  def tearDown(self):
+    self.rt.Stop()
+    self.th.join(2)
+    StartupCase.tearDown(self)
+
+  def Saved(self):
+    #Whether the snapshot has everything a warm restart needs
+    saved = main.snapshot.Load(60) or {}
+    return saved.get('isvhsopen') != None and saved.get('vhsapi_ip') != None and \
+      saved['boards']['front']['last_sync'] != None
+
+  def test_Warm(self):
+    self.th = self.Start()
+    self.assertTrue(WaitFor(self.Saved))
+    self.assertEqual(self.stub.status['status'], 'open')
+    last = self.stub.status['last']
+    drift = main.manager.Primary().drift.Save()
+    self.Restart()
+    time.sleep(0.3)
+    #Nothing was sent again, and the board was only asked for its closing time
+    self.assertEqual(main.dispatcher.Stats('isvhsopen'), (0, 0, 0))
+    self.assertEqual(main.dispatcher.Stats('vhsapi'), (0, 0, 0))
+    self.assertEqual(self.stub.status['last'], last)
+    self.assertEqual([self.Avoided(call) for call in ('isvhsopen', 'vhsapi', 'clock_query')], [1, 1, 1])
+    self.assertEqual(main.manager.Primary().drift.Save()['samples'], drift['samples'])
+    self.assertEqual(main.state.Get('closing_time'), '21:30:00')
+    self.assertGreater(main.scheduler.When('heartbeat'), time.time() + main.heartbeat_interval - 60)
+    self.assertNotEqual(main.startup.Get('ready'), None)
+
+  def test_BoardChanged(self):
+    #The closing time ran out while we were down
+    self.th = self.Start()
+    self.assertTrue(WaitFor(self.Saved))
+    self.emu.clocks['1'] = None
+    self.Restart()
+    self.assertTrue(WaitFor(lambda: self.stub.status['status'] == 'closed'))
+    self.assertEqual([self.Avoided(call) for call in ('isvhsopen', 'vhsapi', 'clock_query')], [0, 1, 0])
+    self.assertTrue(WaitFor(lambda: main.manager.Primary().last_sync > time.time() - 2))
+
+if __name__ == '__main__':
+  unittest.main()
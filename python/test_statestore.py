@@ -0,0 +1,100 @@
+import unittest
+import http.client
+import json
+import socket
+import time
+import restserv
+from statestore import StateStore
+
+#To run these unit tests from command line:
+#python -m unittest test_statestore
+
+class TestStateStore(unittest.TestCase):
+
+  def test_Update(self):
+    s = StateStore()
+    self.assertEqual(s.version, 0)
+    self.assertEqual(s.Update(closing_time = '22:00:00'), 1)
+    self.assertEqual(s.Get('closing_time'), '22:00:00')
+    #Setting the same value again isn't a change
+    self.assertEqual(s.Update(closing_time = '22:00:00'), 1)
+    self.assertEqual(s.Update(closing_time = None, last_heartbeat = 5), 2)
+    self.assertEqual(s.Snapshot(), (2, {'current_time': None, 'closing_time': None,
+      'last_sync': None, 'last_heartbeat': 5, 'last_delivery': None, 'clock': None, 'boards': None,
+      'startup': None}))
+    self.assertRaises(KeyError, s.Update, door = 'open')
+
+  def test_Body(self):
+    s = StateStore()
+    etag, body = s.Body()
+    self.assertEqual(json.loads(body.decode('ascii'))['version'], 0)
+    #The same bytes are handed out until something changes
+    self.assertIs(s.Body()[1], body)
+    s.Update(current_time = '14:56:05')
+    etag2, body2 = s.Body()
+    self.assertNotEqual(etag, etag2)
+    self.assertEqual(json.loads(body2.decode('ascii'))['current_time'], '14:56:05')
+    #Another process (ex: after a restart) has different ETags
+    self.assertNotEqual(StateStore().Body()[0], etag)
+
+  def test_EventsSince_AfterRestart(self):
+    #A client that saw version 57 of the previous process
+    s = StateStore()
+    s.Publish('boot')
+    s.Publish('closing', closing_time = '21:30:00')
+    version, events, missed = s.EventsSince(57)
+    self.assertEqual((version, [e['type'] for e in events], missed), (2, ['boot', 'closing'], True))
+    self.assertEqual(s.EventsSince(1)[1:], ([events[1]], False))
+
+  def test_RecordDelivery(self):
+    s = StateStore()
+    s.RecordDelivery('isvhsopen', False, 3)
+    d = s.Get('last_delivery')
+    self.assertEqual((d['target'], d['ok'], d['attempts']), ('isvhsopen', False, 3))
+
+class TestStatusEndpoint(unittest.TestCase):
+  #restserv's /status, served over HTTP
+
+  @classmethod
+  def setUpClass(cls):
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    cls.port = s.getsockname()[1]
+    s.close()
+    cls.state = StateStore()
+    restserv.RestServ(None, cls.port, '127.0.0.1', state = cls.state)
+    end = time.time() + 5
+    while time.time() < end:
+      try:
+        socket.create_connection(('127.0.0.1', cls.port), 0.1).close()
+        break
+      except OSError:
+        time.sleep(0.05)
+
+  def Get(self, headers = {}):
+    c = http.client.HTTPConnection('127.0.0.1', self.port, timeout = 5)
+    c.request('GET', '/status', headers = headers)
+    r = c.getresponse()
+    body = r.read()
+    c.close()
+    return r, body
+
+  def test_Status(self):
+    self.state.Update(closing_time = '21:30:00')
+    r, body = self.Get()
+    self.assertEqual(r.status, 200)
+    self.assertEqual(r.getheader('Content-Type'), 'application/json')
+    self.assertEqual(json.loads(body.decode('ascii'))['closing_time'], '21:30:00')
+    etag = r.getheader('ETag')
+    self.assertEqual(etag, self.state.Body()[0])
+    #Unchanged: no body
+    r, body = self.Get({'If-None-Match': etag})
+    self.assertEqual((r.status, body), (304, b''))
+    #Changed: the new state
+    self.state.Update(closing_time = None)
+    r, body = self.Get({'If-None-Match': etag})
+    self.assertEqual(r.status, 200)
+    self.assertEqual(json.loads(body.decode('ascii'))['closing_time'], None)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -61,5 +61,46 @@ class TestTimeUtil(unittest.TestCase):
     self.assertFalse(IsTimeStr('12:34 56'))
     self.assertFalse(IsTimeStr('12:34:5o'))
   
+class TestClockTime(unittest.TestCase):
+
+  def test_Parse(self):
+    self.assertEqual(ClockTime.Parse('14:56:05').cs, 5376500)
+    self.assertEqual(ClockTime.Parse('21:30'), ClockTime.FromHMS(21, 30))
+    t = ClockTime.Parse('01:02:03.45')
+    self.assertEqual((t.hour, t.minute, t.second, t.hundredths), (1, 2, 3, 45))
+    self.assertEqual(ClockTime.Parse('00:00:00').cs, 0)
+    self.assertEqual(ClockTime.Parse('23:59:59.99').cs, 8639999)
+    for bad in ('24:00', '12:60', '12:00:60', '2:12:34', '12.34:56', '12:34 56',
+        '12:34:5o', '12:34:56.7', '12:34:56:78', '', ' 2:34:56'):
+      self.assertIsNone(ClockTime.Parse(bad), bad)
+
+  def test_Format(self):
+    t = ClockTime.Parse('04:10:00.07')
+    self.assertEqual(str(t), '04:10:00')
+    self.assertEqual(t.Format(True), '04:10:00.07')
+    self.assertEqual(TimeToStr(t225035), str(ClockTime.Parse('22:50:35')))
+
+  def test_FromEpoch(self):
+    t = time.time()
+    lt = time.localtime(t)
+    c = ClockTime.FromEpoch(t)
+    self.assertEqual(c.Seconds(), TimeToSeconds(lt))
+    self.assertEqual(c.hundredths, int(t * 100) % 100)
+
+  def test_Arithmetic(self):
+    t = ClockTime.Parse('23:59:30')
+    self.assertEqual(t + 45, ClockTime.Parse('00:00:15'))
+    self.assertEqual(ClockTime.Parse('00:00:15') - 45, t)
+    self.assertEqual(t + 0.25, ClockTime.Parse('23:59:30.25'))
+    self.assertLess(ClockTime.Parse('08:00:20'), ClockTime.Parse('22:50:35'))
+    self.assertEqual(len(set([ClockTime.Parse('12:00'), ClockTime.Parse('12:00:00')])), 1)
+
+  def test_Offset(self):
+    #Same results as TimeOffsetSeconds
+    for a, b in ((t041000, t080020), (t080020, t041000), (t225035, t000000), (t000000, t225035)):
+      ca, cb = ClockTime.Parse(TimeToStr(a)), ClockTime.Parse(TimeToStr(b))
+      self.assertEqual(ca.Offset(cb), TimeOffsetSeconds(a, b))
+    self.assertEqual(ClockTime.Parse('12:00:00').Offset(ClockTime.Parse('12:00:01.50')), 1.5)
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
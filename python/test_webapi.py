@@ -1,5 +1,7 @@
 import unittest
-from webapi import WebApi
+import time
+from webapi import WebApi, LocalHHMM
+from stubserver import StubServer
 
 #To run these unit tests from command line:
 #python -m unittest test_webapi
@@ -66,6 +68,60 @@ class TestWebApi(unittest.TestCase):
     v = WebApi(dataURL = 'https://isvhsopen.com/')
     self.assertFalse(v.Update('test1', 'v1'))
   
+
+class TestWebApiCache(unittest.TestCase):
+  #Against a local stand-in server, not the live API
+
+  def setUp(self):
+    self.srv = StubServer().Start()
+    self.w = WebApi(dataURL = self.srv.webURL, cacheTTL = 300, maxWriteAge = 3600)
+
+  def tearDown(self):
+    self.srv.Stop()
+
+  def Posts(self):
+    return len([l for l in self.srv.log if l[1] == 'POST'])
+
+  def test_SkipsUnchanged(self):
+    self.assertTrue(self.w.Update('open', '22:30'))
+    for i in range(5):
+      j = self.w.Update('open', '22:30')
+      self.assertEqual((j['result'], j['status']), ('ok', 'open'))
+    self.assertEqual((self.Posts(), self.srv.requests), (1, 1))
+    #A change is sent
+    self.assertTrue(self.w.Update('open', '23:00'))
+    self.assertTrue(self.w.Update('closed'))
+    self.assertTrue(self.w.Update('closed'))
+    self.assertEqual(self.Posts(), 3)
+
+  def test_Verifies(self):
+    self.assertTrue(self.w.Update('closed'))
+    self.w.remoteAt -= 300
+    #Stale: checked with a GET, which gets the full status the first time...
+    self.assertTrue(self.w.Update('closed'))
+    self.assertEqual((self.Posts(), self.srv.requests), (1, 2))
+    self.w.remoteAt -= 300
+    #...and 304 Not Modified after that
+    self.assertTrue(self.w.Update('closed'))
+    self.assertEqual((self.Posts(), self.srv.requests), (1, 3))
+    self.assertEqual(self.w.Query('status'), 'closed')
+    #Changed behind our back (ex: by hand): sent again
+    self.srv.status = {'status': 'open', 'last': 'x', 'openUntil': '2015-12-07T12:32:00.000Z'}
+    self.w.remoteAt -= 300
+    self.assertTrue(self.w.Update('closed'))
+    self.assertEqual(self.Posts(), 2)
+
+  def test_MaxWriteAge(self):
+    self.assertTrue(self.w.Update('closed'))
+    self.w.writtenAt -= 3600
+    self.assertTrue(self.w.Update('closed'))
+    self.assertEqual(self.Posts(), 2)
+
+  def test_LocalHHMM(self):
+    t = time.mktime((2015, 12, 7, 12, 32, 0, 0, 0, -1))
+    self.assertEqual(LocalHHMM(time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(t))), '12:32')
+    self.assertEqual(LocalHHMM(None), None)
+    self.assertEqual(LocalHHMM('soon'), None)
   
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -0,0 +1,12 @@
+import time
+
+#Helpers shared by the unit tests
+
+def WaitFor(cond, timeout = 5):
+  #Polls cond() until it's true or timeout seconds have passed. Returns its
+  #last result, so tests can assertTrue(WaitFor(...)) on things another
+  #thread does.
+  end = time.time() + timeout
+  while not cond() and time.time() < end:
+    time.sleep(0.01)
+  return cond()
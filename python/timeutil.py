@@ -1,5 +1,6 @@
 import time
 
+#struct_time helpers. ClockTime (below) replaces them, and is much faster.
 timeFormatStr = "%H:%M:%S"
 
 def StrToTime(str):
@@ -42,4 +43,134 @@ def IsTimeStr( str ):
       return False
     return True
   return False
-  
\ No newline at end of file
+  
+_24h_cs = 8640000 #Hundredths of a second in 24h
+_12h_cs = 4320000
+
+#Two digit strings and their values, so ClockTime parses and formats with
+#lookups instead of int() and '%02d'
+_2digits = ['%02d' % i for i in range(100)]
+_2values = dict((d, i) for i, d in enumerate(_2digits))
+
+class ClockTime:
+  #A time of day, as SpaceTime's clocks hold it: hundredths of a second since
+  #midnight, in a single int. Replaces struct_time, which holds a date we
+  #don't use and can only be made by time.strptime (slow, and it takes a
+  #lock). Immutable, and compared and hashed by value.
+  #  t = ClockTime.Parse('21:30')        #Formats accepted by ATSTn=, see below
+  #  str(t) == '21:30:00'
+  #  t + 90 == ClockTime.Parse('21:31:30')
+  #  ClockTime.Parse('23:59:00').Offset(ClockTime.Parse('00:01:00')) == 120
+  __slots__ = ('cs',)
+
+  def __init__(self, cs = 0):
+    #cs is hundredths of a second since midnight; it wraps around at 24h
+    self.cs = int(cs) % _24h_cs
+
+  @classmethod
+  def FromHMS(cls, hour, minute, second = 0, hundredths = 0):
+    return cls(((hour * 60 + minute) * 60 + second) * 100 + hundredths)
+
+  @classmethod
+  def FromEpoch(cls, t = None):
+    #The local time of day at time.time() t (default: now)
+    if t == None:
+      t = time.time()
+    lt = time.localtime(t)
+    return cls(((lt.tm_hour * 60 + lt.tm_min) * 60 + lt.tm_sec) * 100 + int(t * 100) % 100)
+
+  @classmethod
+  def Parse(cls, text):
+    #Parses 'HH:MM', 'HH:MM:SS' or 'HH:MM:SS.cc' (timer_parse() in sw/timer.c).
+    #Returns None if text isn't one of those or isn't a valid time.
+    n = len(text)
+    if n != 5 and n != 8 and n != 11 or text[2] != ':':
+      return None
+    hour, minute = _2values.get(text[0:2]), _2values.get(text[3:5])
+    if hour == None or minute == None or hour > 23 or minute > 59:
+      return None
+    cs = (hour * 60 + minute) * 6000
+    if n > 5:
+      second = _2values.get(text[6:8])
+      if text[5] != ':' or second == None or second > 59:
+        return None
+      cs += second * 100
+      if n > 8:
+        hundredths = _2values.get(text[9:11])
+        if text[8] != '.' or hundredths == None:
+          return None
+        cs += hundredths
+    t = cls.__new__(cls)
+    t.cs = cs
+    return t
+
+  @property
+  def hour(self):
+    return self.cs // 360000
+
+  @property
+  def minute(self):
+    return self.cs // 6000 % 60
+
+  @property
+  def second(self):
+    return self.cs // 100 % 60
+
+  @property
+  def hundredths(self):
+    return self.cs % 100
+
+  def Seconds(self):
+    #Whole seconds since midnight, like TimeToSeconds()
+    return self.cs // 100
+
+  def Format(self, hundredths = False):
+    #'HH:MM:SS', or 'HH:MM:SS.cc' with hundredths
+    s = self.cs // 100
+    text = _2digits[s // 3600] + ':' + _2digits[s // 60 % 60] + ':' + _2digits[s % 60]
+    if hundredths:
+      return text + '.' + _2digits[self.cs % 100]
+    return text
+
+  def Offset(self, other):
+    #Seconds from self to other, the short way around midnight, like
+    #TimeOffsetSeconds(): always within -12h and +12h
+    diff = other.cs - self.cs
+    if diff > _12h_cs:
+      diff -= _24h_cs
+    elif diff < -_12h_cs:
+      diff += _24h_cs
+    return diff / 100.0
+
+  def __add__(self, seconds):
+    return ClockTime(self.cs + round(seconds * 100))
+
+  def __sub__(self, seconds):
+    return ClockTime(self.cs - round(seconds * 100))
+
+  def __eq__(self, other):
+    return isinstance(other, ClockTime) and self.cs == other.cs
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __lt__(self, other):
+    return self.cs < other.cs
+
+  def __le__(self, other):
+    return self.cs <= other.cs
+
+  def __gt__(self, other):
+    return self.cs > other.cs
+
+  def __ge__(self, other):
+    return self.cs >= other.cs
+
+  def __hash__(self):
+    return self.cs
+
+  def __str__(self):
+    return self.Format()
+
+  def __repr__(self):
+    return 'ClockTime(' + repr(self.Format(True)) + ')'
@@ -1,5 +1,9 @@
 import requests
+from httpclient import HttpClient, Instrumented, connectRetries
+from breaker import CircuitBreaker
 from time import sleep
+from logbuffer import log
+from jsonstream import IterArray
 
 class VHSApi:
   # The VHS API runs at https://api.vanhack.ca/
@@ -14,10 +18,15 @@ class VHSApi:
   #  '<hostname>/s/<spacename>/data/<dataname>/feed'
   #  '<hostname>/s/<spacename>/data/history/<dataname>.json'
   api_update_str = '/update?value='
+  api_history_str = 'history/'
   
-  def __init__(self, dataURL = 'https://api.vanhack.ca/s/vhs/data/', timeout = 5):
+  def __init__(self, dataURL = 'https://api.vanhack.ca/s/vhs/data/', timeout = 5, poolSize = 2, breaker = None):
     self.baseURL = dataURL
     self.timeout = timeout
+    #Keep-alive connections to the server, reused between requests. While
+    #the server is down, requests fail right away (see breaker.py).
+    self.breaker = breaker if breaker != None else CircuitBreaker('vhsapi')
+    self.http = HttpClient(poolSize, self.breaker)
   
   def WaitForConnect(self, dataname):
     #Periodically queries the API until it receives a successful response.
@@ -25,7 +34,8 @@ class VHSApi:
     sleepAmt = .25
     sleepMax = 16
     while self.Query(dataname) == False:
-      print('Waiting ' + str(sleepAmt) + 's for retry...')
+      connectRetries.Labels('vhsapi').Inc()
+      log.Info('Waiting ' + str(sleepAmt) + 's for retry...', api = 'vhsapi')
       sleep(sleepAmt)
       if sleepAmt < sleepMax:
         sleepAmt *= 2
@@ -35,42 +45,66 @@ class VHSApi:
     #update with datavalue if they are different. This prevents
     #needless writes, which is important because each API variable
     #has a timestamp that is updated every time it changes.
+    #If the query fails (ex: the variable doesn't exist yet), it's updated
+    #anyway. Returns datavalue, or False if the update failed.
     
     q = self.Query(dataname)
-    if q != False and q != datavalue:
-      self.Update(dataname, datavalue)
+    if q == datavalue:
+      return q
+    return self.Update(dataname, datavalue)
   
+  @Instrumented('vhsapi', 'query')
   def Query(self, dataname):
     #Returns the value of dataname from the VHSApi server, or False if query failed.
     try:
-      r = requests.get( self.baseURL + dataname + '.json' , timeout = self.timeout )
+      r = self.http.Get( self.baseURL + dataname + '.json' , timeout = self.timeout )
       if r.status_code == requests.codes.ok:
         #Expected json response in format:
         #{"last_updated":<unixtimestamp>,"name":"<dataname>","value":"<datavalue>"}
         j = r.json()
         if (j['name'] == dataname):
-          print('VHSApi Query  "' + dataname + '" is "' + j['value'] + '"')
+          log.Info('VHSApi Query  "' + dataname + '" is "' + j['value'] + '"')
           return j['value']
-      print('VHSApi Query of "' + dataname + '" failed.')
-      print('Response code: ' + str(r.status_code))
-      print('Response text: ' + r.text)
+      log.Error('VHSApi Query of "' + dataname + '" failed.', status = r.status_code, response = r.text)
     except Exception as e:
-      print('VHSApi Query failed: ', str(e))
+      log.Error('VHSApi Query failed', error = str(e))
     return False
   
+  @Instrumented('vhsapi', 'update')
   def Update(self, dataname, datavalue):
     try:
-      r = requests.get( self.baseURL + dataname + self.api_update_str + datavalue , timeout = self.timeout )
+      r = self.http.Get( self.baseURL + dataname + self.api_update_str + datavalue , timeout = self.timeout )
       if r.status_code == requests.codes.ok:
         #Expected json response in format:
         #{"result":{"value":"<datavalue>","last_updated":<unixtimestamp>,"name":"<dataname>"},"status":"OK"}
         j = r.json()
         if (j['status'] == 'OK' and j['result']['name'] == dataname and j['result']['value'] == datavalue):
-          print('VHSApi Update "' + dataname + '" to "' + datavalue + '"')
+          log.Info('VHSApi Update "' + dataname + '" to "' + datavalue + '"')
           return datavalue
-      print('VHSApi Update of "' + dataname + '" failed.')
-      print('Response code: ' + str(r.status_code))
-      print('Response text: ' + r.text)
+      log.Error('VHSApi Update of "' + dataname + '" failed.', status = r.status_code, response = r.text)
     except Exception as e:
-      print('VHSApi Update failed: ' + str(e))
+      log.Error('VHSApi Update failed', error = str(e))
     return False
+
+  def History(self, dataname, since = None, chunkSize = 16384):
+    #Yields (unix timestamp, value) for each change to dataname in its
+    #history, oldest first, or only the ones after timestamp since.
+    #The history is parsed as it downloads, so it's never all in memory
+    #(see jsonstream.py). Each entry is expected to be like the variable
+    #itself, {"last_updated":<unixtimestamp>,"value":"<datavalue>",...},
+    #or a [<unixtimestamp>, "<datavalue>"] pair.
+    #Raises an exception if the history can't be downloaded or parsed.
+    r = self.http.Get( self.baseURL + self.api_history_str + dataname + '.json' , timeout = self.timeout, stream = True )
+    try:
+      if r.status_code != requests.codes.ok:
+        raise IOError('VHSApi History of "' + dataname + '" failed: ' + str(r.status_code))
+      for item in IterArray(r.iter_content(chunkSize)):
+        if isinstance(item, dict):
+          t, val = item.get('last_updated'), item.get('value')
+        else:
+          t, val = item[0], item[1]
+        t = float(t)
+        if since == None or t > since:
+          yield t, val
+    finally:
+      r.close()
@@ -1,5 +1,25 @@
+import calendar
+import threading
+import time
 import requests
+from httpclient import HttpClient, Instrumented, connectRetries
+from breaker import CircuitBreaker
 from time import sleep
+from logbuffer import log
+import metrics
+
+updatesSkipped = metrics.Counter('webapi_updates_skipped_total',
+  'Door status updates not POSTed because isvhsopen.com already had that status, '
+  'by how that was known (cached, or verified with a GET)', ('how',))
+
+def LocalHHMM(iso):
+  #'HH:MM' local time for a UTC time from isvhsopen.com, ex: '2015-12-07T12:32:00.000Z',
+  #or None if it isn't one
+  try:
+    t = calendar.timegm(time.strptime(iso[:19], '%Y-%m-%dT%H:%M:%S'))
+  except (TypeError, ValueError):
+    return None
+  return time.strftime('%H:%M', time.localtime(t))
 
 class WebApi:
   # The isvhsopen.com Web API is at https://isvhsopen.com/api/status/
@@ -12,56 +32,90 @@ class WebApi:
   #POST https://isvhsopen.com/api/status/open?key=ISVHSOPEN_API_KEY&until=12:30
   #POST https://isvhsopen.com/api/status/closed?key=ISVHSOPEN_API_KEY
   
-  def __init__(self, dataURL = 'https://isvhsopen.com/api/status/', apiKey = 'ISVHSOPEN_API_KEY', timeout = 5):
+  #The server ignores updates that don't change the status, so Update()
+  #doesn't send them either: the status last confirmed by a reply from the
+  #server is cached, and an update that matches it is skipped. Within
+  #cacheTTL seconds of the confirmation, the cache is trusted as is; after
+  #that, a conditional GET (answered with 304 Not Modified if nothing
+  #changed) checks it first. Either way, the status is POSTed at least every
+  #maxWriteAge seconds, in case the server lost it.
+  
+  def __init__(self, dataURL = 'https://isvhsopen.com/api/status/', apiKey = 'ISVHSOPEN_API_KEY', timeout = 5, poolSize = 2,
+               cacheTTL = 300, maxWriteAge = 3600, breaker = None):
     self.baseURL = dataURL
     self.apiKey = apiKey
     self.timeout = timeout
+    #Keep-alive connections to the server, reused between requests. While
+    #the server is down, requests fail right away (see breaker.py).
+    self.breaker = breaker if breaker != None else CircuitBreaker('isvhsopen')
+    self.http = HttpClient(poolSize, self.breaker)
+    self.cacheTTL = cacheTTL
+    self.maxWriteAge = maxWriteAge
+    self.lock = threading.Lock()
+    self.remote = None    #Last full status from the server: status, last, openUntil if open
+    self.remoteAt = 0     #time.time() when the server last confirmed self.remote
+    self.etag = None      #ETag of self.remote, for conditional GETs
+    self.writtenAt = 0    #time.time() of the last successful POST
     
-  def WaitForConnect(self):
+  def WaitForConnect(self, sleepMax = 1616):
     #Periodically queries the API until it receives a successful response.
+    #Waits up to sleepMax seconds between queries.
     sleepAmt = .25
-    sleepMax = 1616
     while self.Query() == False:
-      print('Waiting ' + str(sleepAmt) + 's for retry...')
+      connectRetries.Labels('isvhsopen').Inc()
+      log.Info('Waiting ' + str(sleepAmt) + 's for retry...', api = 'isvhsopen')
       sleep(sleepAmt)
       if sleepAmt < sleepMax:
         sleepAmt *= 2
   
+  @Instrumented('isvhsopen', 'query')
   def Query(self, dataname = None):
     #Returns the value of dataname from the isvhsopen server, or False if query failed.
     #If dataname is None or '', returns the full json response, or False if query failed.
     try:
-      #Query should return a json object with all status info
-      r = requests.get( self.baseURL , timeout = self.timeout )
-      if r.status_code == requests.codes.ok:
+      #Query should return a json object with all status info.
+      #If we have it already, only ask for it if it changed.
+      with self.lock:
+        cached, etag = self.remote, self.etag
+      headers = {'If-None-Match': etag} if cached != None and etag != None else {}
+      r = self.http.Get( self.baseURL , timeout = self.timeout, headers = headers )
+      notModified = r.status_code == requests.codes.not_modified and headers
+      if r.status_code == requests.codes.ok or notModified:
         #Expected json response in format:
         #{"status":"open","last":"2015-12-06T20:05:17.669Z","_events":{"change":[null,null]},"_eventsCount":1,"openUntil":"2015-12-07T12:32:00.000Z"}
         #{"status":"closed","last":"2015-12-06T20:07:09.232Z","_events":{"change":[null,null]},"_eventsCount":1}
-        j = r.json()
+        #or 304 Not Modified, with no body, if it's still what we have
+        j = dict(cached) if notModified else r.json()
+        self.Confirm(j, r.headers.get('ETag', etag if notModified else None))
         if (dataname):
           val = j.get(dataname)
           #val is the value of dataname, or None if no such dataname exists
           if (val):
-            print('isvhsopen Query "' + dataname + '" is "' + val + '"')
+            log.Info('isvhsopen Query "' + dataname + '" is "' + val + '"')
             return val
         else:
           #No dataname was specified, so return full json response
           return j
-      print('isvhsopen Query' + (' of "' + dataname + '"' if dataname != None else '') + ' failed.')
-      print('Response code: ' + str(r.status_code))
-      print('Response text: ' + r.text)
+      log.Error('isvhsopen Query' + (' of "' + dataname + '"' if dataname != None else '') + ' failed.',
+        status = r.status_code, response = r.text)
     except Exception as e:
-      print('isvhsopen Query failed: ', str(e))
+      log.Error('isvhsopen Query failed', error = str(e))
     return False
   
+  @Instrumented('isvhsopen', 'update')
   def Update(self, doorStatus, until = ''):
     #Updates the isvhsopen.com WebAPI with the current door status.
     #Valid values for doorStatus are 'open' and 'closed'
     #The until parameter is ignored by the server if doorStatus == 'closed'
     #Returns the json response object from the update if successful, or False if failed.
+    #If the server already has this status, returns what it last confirmed
+    #without POSTing (see above).
+    cached = self.Cached(doorStatus, until)
+    if cached != None:
+      return cached
     try:
       d = { 'key': self.apiKey, 'until': until }
-      p = requests.post( self.baseURL + doorStatus , data = d, timeout = self.timeout )
+      p = self.http.Post( self.baseURL + doorStatus , data = d, timeout = self.timeout )
       if p.status_code == requests.codes.ok:
         #Expected json response in format:
         #{"result":"ok","status":"open","last":"2015-12-06T20:05:17.669Z","openUntil":"2015-12-07T12:32:00.000Z"}
@@ -69,11 +123,46 @@ class WebApi:
         j = p.json()
         if (j['result'] == 'ok' and j['status'] == doorStatus):
           #Note we're just trusting that openUntil was set correctly
-          print('isvhsopen Update door status to "' + doorStatus + '" until "' + str(j.get('openUntil')) + '"')
+          self.Confirm(j, None, written = True)
+          log.Info('isvhsopen Update door status to "' + doorStatus + '" until "' + str(j.get('openUntil')) + '"')
           return j
-      print('isvhsopen Update door status to "' + doorStatus + '" failed.')
-      print('Response code: ' + str(p.status_code))
-      print('Response text: ' + p.text)
+      log.Error('isvhsopen Update door status to "' + doorStatus + '" failed.',
+        status = p.status_code, response = p.text)
     except Exception as e:
-      print('isvhsopen Update failed: ' + str(e))
+      log.Error('isvhsopen Update failed', error = str(e))
     return False
+
+  def Confirm(self, j, etag, written = False):
+    #Caches j, a status the server just replied with
+    if not isinstance(j, dict) or j.get('status') not in ('open', 'closed'):
+      return
+    with self.lock:
+      self.remote = dict((k, j[k]) for k in ('status', 'last', 'openUntil') if k in j)
+      self.remoteAt = time.time()
+      self.etag = etag
+      if written:
+        self.writtenAt = self.remoteAt
+
+  def Matches(self, doorStatus, until):
+    #Whether the cached status is doorStatus (until 'HH:MM' if open)
+    with self.lock:
+      remote = self.remote
+    if remote == None or remote['status'] != doorStatus:
+      return False
+    return doorStatus != 'open' or LocalHHMM(remote.get('openUntil')) == until[:5]
+
+  def Cached(self, doorStatus, until):
+    #Returns the cached status as an Update() result, if doorStatus doesn't
+    #need to be POSTed; otherwise None
+    now = time.time()
+    with self.lock:
+      if self.remote == None or now - self.writtenAt >= self.maxWriteAge:
+        return None
+      fresh = now - self.remoteAt < self.cacheTTL
+    if not self.Matches(doorStatus, until):
+      return None
+    if not fresh and (self.Query() == False or not self.Matches(doorStatus, until)):
+      return None
+    updatesSkipped.Labels('cached' if fresh else 'verified').Inc()
+    with self.lock:
+      return dict(self.remote, result = 'ok')